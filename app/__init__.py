@@ -2,39 +2,44 @@
 应用程序初始化模块
 """
 import os
+import time
 import logging
 import datetime
 import uuid
 import secrets
-from threading import Lock
 from flask import Flask, request, g, has_request_context, session
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from .config.config import Config
 from .routes import register_blueprints
+from .routes.metrics import metrics_bp
 from .utils.file_monitor import setup_file_monitor
-from .utils.security import cleanup_bans, is_banned, get_real_ip
-from .utils.logger import setup_logger
+from .utils.security import cleanup_bans, is_banned, get_client_ip, setup_ban_store, TrustedProxyMatcher
+from .utils.logger import setup_logger, log_request_completion
+from .utils.metrics import observe_request, setup_metrics_share
+from .utils.image_utils import setup_thumbnail_cache, setup_resize_cache, start_cache_sync
+from .utils.home_cache import setup_home_cache
+from .utils.variant_store import setup_variant_store
+from .utils.render_pool import setup_render_pool
+from .utils.state_backend import setup_state_backend
+from .utils.shuffle import setup_shuffle_bag
 
 # 获取模块日志记录器
 logger = logging.getLogger(__name__)
 
-# 请求计数器锁（线程安全）
-request_count_lock = Lock()
-
-# 创建限流器，使用优化后的IP获取函数
+# 创建限流器，与封禁检查共用每个请求解析一次的客户端IP
 limiter = Limiter(
-    key_func=lambda: get_real_ip(getattr(Flask, '_trusted_proxies', [])),
-    default_limits=["500 per hour"],
-    storage_uri="memory://"
+    key_func=get_client_ip,
+    default_limits=["500 per hour"]
 )
 
-def create_app(config_class=Config):
+def create_app(config_class=Config, file_monitor=True):
     """
     创建并配置Flask应用
     
     Args:
         config_class: 配置类
+        file_monitor: 是否在本进程中启动文件监控（多进程模式下由主进程统一监控）
         
     Returns:
         配置好的Flask应用实例
@@ -52,7 +57,19 @@ def create_app(config_class=Config):
     # 设置日志系统
     setup_logger(app, config_class)
     
-    # 初始化限流器
+    # 初始化共享状态后端（封禁记录、违规计数及限流存储）
+    app.state_backend = setup_state_backend(config_class.STATE_BACKEND, config_class.REDIS_URL,
+                                            config_class.STATE_KEY_PREFIX, config_class.BAN_MAX_IPS,
+                                            config_class.BAN_MAX_PATHS_PER_IP, config_class.STATE_LOCAL_CACHE_TTL,
+                                            config_class.SHUFFLE_MAX_CLIENTS)
+    setup_ban_store(app.state_backend)
+    
+    # 洗牌取图模式：取图进度保存在状态后端中（每个客户端取完一轮前不重复）
+    setup_shuffle_bag(app.state_backend if config_class.RANDOM_MODE == 'shuffle' else None,
+                      config_class.SHUFFLE_STATE_TTL)
+    
+    # 初始化限流器（存储与状态后端一致）
+    app.config['RATELIMIT_STORAGE_URI'] = app.state_backend.limiter_storage_uri
     limiter.init_app(app)
     
     # 添加自定义过滤器
@@ -64,26 +81,23 @@ def create_app(config_class=Config):
     # 注册蓝图
     register_blueprints(app)
     
+    # 指标端点不参与限流（采集器按固定间隔抓取）
+    limiter.exempt(metrics_bp)
+    
     # 设置请求前处理函数
     @app.before_request
     def before_request():
         """请求前处理：生成请求ID并检查封禁状态"""
-        # 生成请求ID
+        # 生成请求ID并记录开始时间（请求完成时记录一条含耗时的访问日志）
         g.request_id = request.headers.get('X-Request-ID') or str(uuid.uuid4())[:8]
+        g.request_start = time.perf_counter()
         
-        # 记录请求开始
-        access_logger = logging.getLogger('access')
-        access_logger.info(f"请求开始: {request.method} {request.path}")
-        
-        # 使用优化后的get_real_ip函数获取真实IP（传递可信代理列表）
-        client_ip = get_real_ip(getattr(app, '_trusted_proxies', []))
+        # 获取真实IP（每个请求只解析一次，限流器和错误处理共用）
+        client_ip = get_client_ip()
         current_path = request.path
         banned, remaining, end_time = is_banned(client_ip, current_path, config_class.BAN_DURATION)
 
         if banned:
-            # 清理过期封禁
-            cleanup_bans()
-            
             # 记录封禁日志
             logger.warning(f"IP {client_ip} 访问 {current_path} 被封禁，剩余时间: {int(remaining)}秒")
 
@@ -95,14 +109,8 @@ def create_app(config_class=Config):
                                 client_ip=client_ip,
                                 target_url=current_path), 429
 
-        # 定期清理过期封禁（线程安全）
-        with request_count_lock:
-            if not hasattr(app, 'request_count'):
-                app.request_count = 0
-            app.request_count += 1
-            if app.request_count >= 100:
-                cleanup_bans()
-                app.request_count = 0
+        # 清理过期封禁（过期堆只处理已到期的IP，无到期记录时不加锁）
+        cleanup_bans()
     
     # 设置响应后处理函数
     @app.after_request
@@ -112,7 +120,11 @@ def create_app(config_class=Config):
         response.headers['X-Request-ID'] = g.get('request_id', '-')
         
         # 设置缓存控制
-        if response.status_code == 200:
+        cache_control = g.get('cache_control')
+        if cache_control and response.status_code in (200, 206, 304):
+            # 路由指定的缓存策略（如单个图像URL的长期缓存）
+            response.headers['Cache-Control'] = cache_control
+        elif response.status_code == 200:
             # 检查请求头中是否存在 CDN: CDNRequest
             if request.headers.get('CDN') == 'CDNRequest':
                 # CDN请求：设置公共缓存5分钟
@@ -121,16 +133,47 @@ def create_app(config_class=Config):
                 # 非CDN请求：强制每次验证
                 response.headers['Cache-Control'] = 'no-cache'
         
-        # 记录请求完成
-        access_logger = logging.getLogger('access')
-        access_logger.info(f"请求完成: {request.method} {request.path} - 状态码: {response.status_code}")
+        # 记录请求指标和访问日志（日志写入由后台线程批量完成）
+        duration = time.perf_counter() - g.get('request_start', time.perf_counter())
+        observe_request(request.endpoint, response.status_code, duration, response.content_length)
+        log_request_completion(response, duration)
         
         return response
     
+    # 初始化缩略图磁盘缓存
+    setup_thumbnail_cache(config_class.CACHE_DIR, config_class.THUMBNAIL_CACHE_MAX_BYTES)
+    
+    # 启动图像处理进程池
+    app.render_pool = setup_render_pool(config_class.RENDER_WORKERS, config_class.RENDER_MAX_PENDING,
+                                        config_class.RENDER_TIMEOUT)
+    
+    # 初始化缩放图磁盘缓存
+    setup_resize_cache(config_class.CACHE_DIR, config_class.RESIZE_CACHE_MAX_BYTES)
+    
+    # 初始化图像格式变体存储（WebP/AVIF）
+    setup_variant_store(config_class.CACHE_DIR, config_class.IMAGE_VARIANT_FORMATS,
+                        config_class.VARIANT_CACHE_MAX_BYTES, config_class.VARIANT_QUALITY,
+                        config_class.VARIANT_WORKERS)
+    
+    # 多进程共享缓存目录：定期同步其他进程写入和淘汰的文件，共同遵守字节数上限
+    if config_class.WORKERS > 1 and config_class.CACHE_SYNC_INTERVAL > 0:
+        start_cache_sync(config_class.CACHE_SYNC_INTERVAL)
+    
+    # 多进程模式：定期写出本进程的指标，采集请求由任一工作进程汇总所有进程的数据
+    if config_class.WORKERS > 1 and config_class.METRICS_ENABLED:
+        setup_metrics_share(config_class.METRICS_DIR, config_class.METRICS_SHARE_INTERVAL)
+    
+    # 初始化主页预览缓存
+    setup_home_cache(config_class.IMAGE_BASE, config_class.THUMBNAIL_SIZE,
+                     config_class.IMAGE_EXTENSIONS, config_class.HOME_ROTATE_INTERVAL)
+    
     # 启动文件监控
-    app.file_monitor = setup_file_monitor(config_class.IMAGE_BASE, config_class.IMAGE_EXTENSIONS)
+    if file_monitor:
+        app.file_monitor = setup_file_monitor(config_class.IMAGE_BASE, config_class.IMAGE_EXTENSIONS,
+                                              config_class.MONITOR_DEBOUNCE, config_class.MONITOR_MAX_DELAY)
     
-    # 保存可信代理列表到应用实例
+    # 保存可信代理列表到应用实例，并预编译为区间匹配器
     app._trusted_proxies = getattr(config_class, 'TRUSTED_PROXIES', [])
+    app.proxy_matcher = TrustedProxyMatcher(app._trusted_proxies)
     
     return app
\ No newline at end of file
@@ -11,6 +11,11 @@ class Config:
     DEBUG = False
     TESTING = False
     PORT = int(os.environ.get('PORT') or 50721)  # 使用不同的端口
+    
+    # 多进程配置：工作进程数（1 为单进程），优雅退出等待时间，是否使用 SO_REUSEPORT
+    WORKERS = int(os.environ.get('WORKERS') or 1)
+    GRACEFUL_TIMEOUT = float(os.environ.get('GRACEFUL_TIMEOUT') or 30)
+    REUSE_PORT = os.environ.get('REUSE_PORT', 'false').lower() == 'true'
     APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     
     # 图像相关配置
@@ -18,19 +23,106 @@ class Config:
     IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
     THUMBNAIL_SIZE = (300, 300)  # 管理面板中的缩略图尺寸
     
+    # 磁盘缓存配置（缩略图等生成物）
+    CACHE_DIR = os.environ.get('CACHE_DIR', 'cache')
+    THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES') or 256 * 1024 * 1024)  # 默认256MB
+    # 多进程模式下各进程与缓存目录同步的间隔（秒），字节数上限按所有进程写入的文件总量计算
+    CACHE_SYNC_INTERVAL = float(os.environ.get('CACHE_SYNC_INTERVAL') or 30)
+    
+    # 图像格式变体：按优先级列出后台生成的格式（如 avif,webp），留空不启用
+    IMAGE_VARIANT_FORMATS = [f for f in os.environ.get('IMAGE_VARIANT_FORMATS', '').split(',') if f.strip()]
+    VARIANT_CACHE_MAX_BYTES = int(os.environ.get('VARIANT_CACHE_MAX_BYTES') or 1024 * 1024 * 1024)  # 默认1GB
+    VARIANT_QUALITY = int(os.environ.get('VARIANT_QUALITY') or 80)
+    VARIANT_WORKERS = int(os.environ.get('VARIANT_WORKERS') or 2)
+    # 更合适的变体仍在生成时单张图片的缓存策略（生成后同一URL会返回变体，不能长期缓存原图）
+    VARIANT_PENDING_CACHE_CONTROL = os.environ.get('VARIANT_PENDING_CACHE_CONTROL', 'public, max-age=60')
+    
+    # 缩放图配置：请求的 w/h 向上对齐到尺寸白名单，生成结果保存在磁盘 LRU 缓存中
+    RESIZE_SIZES = sorted(int(s) for s in (os.environ.get('RESIZE_SIZES') or
+                                           '160,320,480,640,800,1080,1280,1600,1920,2560').split(',') if s.strip())
+    RESIZE_CACHE_MAX_BYTES = int(os.environ.get('RESIZE_CACHE_MAX_BYTES') or 512 * 1024 * 1024)  # 默认512MB
+    
+    # 图像处理进程池：缩略图、缩放图和格式变体的 Pillow 处理在子进程中执行（0 表示在请求线程中直接处理）
+    RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS') or 2)
+    RENDER_MAX_PENDING = int(os.environ.get('RENDER_MAX_PENDING') or 64)  # 排队及执行中的任务上限，超过时返回503
+    RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT') or 30)  # 等待单个任务的超时时间（秒）
+    
+    # 管理面板批量导入：单次导入的图片数上限和单个文件大小上限
+    INGEST_MAX_FILES = int(os.environ.get('INGEST_MAX_FILES') or 10000)
+    INGEST_MAX_FILE_BYTES = int(os.environ.get('INGEST_MAX_FILE_BYTES') or 50 * 1024 * 1024)  # 默认50MB
+    
+    # 浏览页分页：每页默认图片数、API 允许的每页上限、缩略图边长（对齐到 RESIZE_SIZES）
+    BROWSE_PAGE_SIZE = int(os.environ.get('BROWSE_PAGE_SIZE') or 60)
+    BROWSE_MAX_PAGE_SIZE = int(os.environ.get('BROWSE_MAX_PAGE_SIZE') or 200)
+    BROWSE_THUMB_SIZE = int(os.environ.get('BROWSE_THUMB_SIZE') or 320)
+    
+    # 批量随机接口 /api/random 单次返回的图片数上限
+    RANDOM_BATCH_MAX = int(os.environ.get('RANDOM_BATCH_MAX') or 50)
+    
+    # 索引预热配置：启动时并行扫描所有文件夹，并通过磁盘快照加速重启
+    INDEX_WARMUP = os.environ.get('INDEX_WARMUP', 'true').lower() == 'true'
+    INDEX_WARMUP_WORKERS = int(os.environ.get('INDEX_WARMUP_WORKERS') or 8)
+    INDEX_SNAPSHOT_PATH = os.environ.get('INDEX_SNAPSHOT_PATH') or os.path.join(CACHE_DIR, 'index_snapshot.json.gz')
+    # 紧凑索引：文件名打包为一个文件并以 mmap 只读共享（多进程模式下各工作进程共用）
+    INDEX_PACKED = os.environ.get('INDEX_PACKED', 'true').lower() == 'true'
+    INDEX_PACKED_PATH = os.environ.get('INDEX_PACKED_PATH') or os.path.join(CACHE_DIR, 'index.pack')
+    
+    # 主页预览轮换间隔（秒），到期后在后台重新挑选预览图，0 表示仅在文件变化时重建
+    HOME_ROTATE_INTERVAL = int(os.environ.get('HOME_ROTATE_INTERVAL') or 300)
+    
+    # 随机图像返回方式：redirect（302 跳转到图像URL）或 direct（直接返回图像内容）
+    RANDOM_SERVE_MODE = os.environ.get('RANDOM_SERVE_MODE', 'redirect').lower()
+    # 随机选择方式：random（每次独立随机）或 shuffle（每个客户端按随机排列依次取图，取完一轮前不重复）
+    RANDOM_MODE = os.environ.get('RANDOM_MODE', 'random').lower()
+    SHUFFLE_COOKIE = os.environ.get('SHUFFLE_COOKIE', '')  # 标识客户端的 Cookie 名（留空或无该 Cookie 时按 IP）
+    SHUFFLE_STATE_TTL = int(os.environ.get('SHUFFLE_STATE_TTL') or 86400)  # 客户端取图进度的保留时间（秒）
+    SHUFFLE_MAX_CLIENTS = int(os.environ.get('SHUFFLE_MAX_CLIENTS') or 100000)  # 内存后端最多保留的进度条数
+    # 交给前置代理发送文件：留空为应用直接发送，可选 X-Accel-Redirect（Nginx）或 X-Sendfile（Apache/Lighttpd）
+    SENDFILE_HEADER = os.environ.get('SENDFILE_HEADER', '')
+    SENDFILE_PREFIX = os.environ.get('SENDFILE_PREFIX', '/protected-images')  # X-Accel-Redirect 使用的 internal location
+    
+    # 单个图像URL（/{folder}/{file}）的缓存策略：内容不变，允许长期缓存
+    IMAGE_CACHE_CONTROL = os.environ.get('IMAGE_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+    
     # 限流相关配置
     DEFAULT_LIMITS = ["500 per hour"]
     BAN_DURATION = 3600  # 1小时封禁
+    BAN_MAX_IPS = int(os.environ.get('BAN_MAX_IPS') or 100000)  # 最多记录的封禁IP数，超过时淘汰最早到期的IP
+    BAN_MAX_PATHS_PER_IP = int(os.environ.get('BAN_MAX_PATHS_PER_IP') or 256)  # 单个IP最多记录的路径数，超过后改为全局封禁
     
     # 缓存相关配置
     CACHE_TTL = 3600  # 缓存过期时间（秒）
     
+    # 文件监控配置：事件静默多久后批量提交，以及持续有事件时的最长延迟（秒）
+    MONITOR_DEBOUNCE = float(os.environ.get('MONITOR_DEBOUNCE') or 0.5)
+    MONITOR_MAX_DELAY = float(os.environ.get('MONITOR_MAX_DELAY') or 5.0)
+    
+    # 日志配置：格式（text / json），是否由后台线程批量写入及队列容量（队列满时丢弃），
+    # 成功图片请求访问日志的采样率（0-1，错误请求始终记录）
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+    LOG_QUEUE = os.environ.get('LOG_QUEUE', 'true').lower() == 'true'
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE') or 10000)
+    ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE') or 1.0)
+    
+    # 指标配置：Prometheus 指标端点路径，仅管理员登录或携带 Authorization: Bearer <METRICS_TOKEN> 时可访问
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_PATH = os.environ.get('METRICS_PATH') or '/metrics'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    # 多进程模式下各工作进程的指标快照目录及写入间隔（秒），采集时汇总所有工作进程
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(CACHE_DIR, 'metrics')
+    METRICS_SHARE_INTERVAL = float(os.environ.get('METRICS_SHARE_INTERVAL') or 5)
+    
     # 可信代理配置（用于获取真实 IP）
-    TRUSTED_PROXIES = []  # 可通过环境变量 TRUSTED_PROXIES 设置，如：192.168.1.0/24,10.0.0.0/8
+    TRUSTED_PROXIES = [p.strip() for p in os.environ.get('TRUSTED_PROXIES', '').split(',') if p.strip()]  # 如：192.168.1.0/24,10.0.0.0/8
     
     # Redis 配置（用于限流存储）
     REDIS_URL = os.environ.get('REDIS_URL')  # 如：redis://localhost:6379/0
     
+    # 共享状态后端：memory（单进程）或 redis（多进程/多机共享封禁与限流状态，需安装 redis 包）
+    STATE_BACKEND = os.environ.get('STATE_BACKEND') or ('redis' if REDIS_URL else 'memory')
+    STATE_KEY_PREFIX = os.environ.get('STATE_KEY_PREFIX', 'ria:')
+    STATE_LOCAL_CACHE_TTL = float(os.environ.get('STATE_LOCAL_CACHE_TTL') or 1.0)  # Redis 封禁记录的本地读缓存（秒）
+    
     # 模板配置
     TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
     
@@ -5,6 +5,8 @@ from .main import main_bp
 from .images import images_bp
 from .errors import errors_bp
 from .admin import admin_bp
+from .metrics import metrics_bp
+from .api import api_bp
 
 def register_blueprints(app):
     """
@@ -17,3 +19,6 @@ def register_blueprints(app):
     app.register_blueprint(images_bp)
     app.register_blueprint(errors_bp)
     app.register_blueprint(admin_bp)
+    app.register_blueprint(api_bp)
+    if app.config.get('METRICS_ENABLED', True):
+        app.register_blueprint(metrics_bp, url_prefix=app.config.get('METRICS_PATH', '/metrics'))
@@ -3,12 +3,17 @@
 """
 import os
 import shutil
-from io import BytesIO
-from PIL import Image
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file, abort
+from urllib.parse import quote
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, session, send_file, abort, jsonify
+from werkzeug.formparser import parse_form_data
 from werkzeug.utils import secure_filename
 from ..utils.admin import is_password_set, set_admin_password, verify_admin_password, login_required, DEFAULT_ADMIN_USERNAME
 from ..utils.security import get_safe_path
+from ..utils import variant_store as variants
+from ..utils.image_utils import get_thumbnail
+from ..utils.ingest import BulkIngest, IngestError, ARCHIVE_MIMETYPES, atomic_save
+from ..utils.scanner import scan_images, list_subfolders, is_image_name
+from ..utils.zip_export import ZipExport
 from ..config.config import Config
 
 # 创建蓝图
@@ -32,8 +37,7 @@ def index():
     folders = []
     
     if os.path.exists(image_base) and os.path.isdir(image_base):
-        folders = [d for d in os.listdir(image_base) 
-                  if os.path.isdir(os.path.join(image_base, d))]
+        folders = list_subfolders(image_base)
     
     # 获取消息提示（如果有）
     message = session.pop('message', None)
@@ -182,15 +186,8 @@ def view_folder(folder_name):
     if not folder_path or not os.path.exists(folder_path) or not os.path.isdir(folder_path):
         abort(404)
     
-    # 获取文件夹中的所有图片
-    images = []
-    for f in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, f)
-        if os.path.isfile(file_path) and any(f.lower().endswith(ext) for ext in Config.IMAGE_EXTENSIONS):
-            images.append(f)
-    
-    # 按名称排序
-    images.sort()
+    # 直接扫描磁盘获取所有图片（管理面板需要实时状态，已按名称排序）
+    images = [entry.name for entry in scan_images(folder_path, Config.IMAGE_EXTENSIONS)]
     
     # 获取消息提示（如果有）
     message = session.pop('message', None)
@@ -229,7 +226,7 @@ def upload_image(folder_name):
         return redirect(url_for('admin.view_folder', folder_name=folder_name))
     
     # 检查文件类型
-    if not any(file.filename.lower().endswith(ext) for ext in Config.IMAGE_EXTENSIONS):
+    if not is_image_name(file.filename, Config.IMAGE_EXTENSIONS):
         session['message'] = '不支持的文件类型，请上传图片文件'
         session['success'] = False
         return redirect(url_for('admin.view_folder', folder_name=folder_name))
@@ -238,9 +235,9 @@ def upload_image(folder_name):
     filename = secure_filename(file.filename)
     file_path = os.path.join(folder_path, filename)
     
-    # 保存文件
+    # 保存文件（先写临时文件再原子重命名）
     try:
-        file.save(file_path)
+        atomic_save(file, file_path)
         session['message'] = f'图片 {filename} 上传成功'
         session['success'] = True
     except Exception as e:
@@ -249,6 +246,54 @@ def upload_image(folder_name):
     
     return redirect(url_for('admin.view_folder', folder_name=folder_name))
 
+@admin_bp.route('/folder/<folder_name>/bulk_upload', methods=['POST'])
+@login_required
+def bulk_upload(folder_name):
+    """
+    批量上传图片：multipart 表单中的多个图片文件（image_files）和压缩包（archive），
+    或直接以 zip/tar 压缩包作为请求体（Content-Type: application/zip、application/x-tar 等）
+    
+    请求体为压缩包或带 ?format=json 时返回 JSON 结果，否则返回文件夹页面并显示结果。
+    """
+    # 安全处理文件夹路径
+    folder_path = get_safe_path(Config.IMAGE_BASE, folder_name)
+    
+    if not folder_path or not os.path.exists(folder_path) or not os.path.isdir(folder_path):
+        abort(404)
+    
+    archive_kind = ARCHIVE_MIMETYPES.get(request.mimetype)
+    wants_json = archive_kind is not None or request.args.get('format') == 'json'
+    ingest = BulkIngest(folder_path, folder_name, Config.IMAGE_EXTENSIONS, Config.INGEST_MAX_FILES,
+                        Config.INGEST_MAX_FILE_BYTES, Config.RENDER_TIMEOUT)
+    try:
+        if archive_kind is not None:
+            ingest.add_archive_stream(request.stream, archive_kind)
+        else:
+            # 自行解析 multipart：上传文件直接写入目标文件夹的临时文件，不经过额外的缓冲文件
+            _, _, files = parse_form_data(request.environ, stream_factory=ingest.stream_factory)
+            for _, file_storage in files.items(multi=True):
+                ingest.add_upload(file_storage)
+        result = ingest.commit()
+    except IngestError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        session['message'] = str(e)
+        session['success'] = False
+        return redirect(url_for('admin.view_folder', folder_name=folder_name))
+    finally:
+        ingest.cleanup()
+    
+    if wants_json:
+        return jsonify(result)
+    
+    message = (f"已导入 {result['saved']} 张图片（{result['files_per_second']} 文件/秒，"
+               f"{result['mb_per_second']} MB/秒）")
+    if result['skipped']:
+        message += f"，跳过 {len(result['skipped'])} 个文件"
+    session['message'] = message
+    session['success'] = result['saved'] > 0
+    return redirect(url_for('admin.view_folder', folder_name=folder_name))
+
 @admin_bp.route('/folder/<folder_name>/delete', methods=['POST'])
 @login_required
 def delete_image(folder_name):
@@ -305,6 +350,56 @@ def download_image(folder_name, image_name):
     
     return send_file(file_path, as_attachment=True)
 
+@admin_bp.route('/folder/<folder_name>/export.zip')
+@login_required
+def export_folder(folder_name):
+    """
+    将整个文件夹导出为 zip（存储模式，边读边发送）
+    
+    文件按名称排序，输出内容只取决于文件名、大小和修改时间，
+    因此支持单段 Range 续传；多段 Range，或带 If-Range 时 ETag 不匹配（文件夹已变化），
+    均返回完整内容。
+    """
+    # 安全处理文件夹路径
+    folder_path = get_safe_path(Config.IMAGE_BASE, folder_name)
+    
+    if not folder_path or not os.path.exists(folder_path) or not os.path.isdir(folder_path):
+        abort(404)
+    
+    export = ZipExport(folder_path, scan_images(folder_path, Config.IMAGE_EXTENSIONS, with_stat=True))
+    
+    if request.if_none_match.contains(export.etag):
+        response = Response(status=304)
+        response.set_etag(export.etag)
+        return response
+    
+    start, end, status = 0, export.length, 200
+    byte_range = request.range
+    # 多段 Range 不支持，忽略 Range 返回完整内容（不返回416）
+    if byte_range is not None and byte_range.units == 'bytes' and len(byte_range.ranges) == 1 \
+            and (request.if_range.etag is None or request.if_range.etag == export.etag) \
+            and request.if_range.date is None:
+        span = byte_range.range_for_length(export.length)
+        if span is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{export.length}'
+            return response
+        start, end = span
+        status = 206
+    
+    body = export.iter_bytes(start, end) if request.method != 'HEAD' else iter(())
+    response = Response(body, status=status, mimetype='application/zip', direct_passthrough=True)
+    response.content_length = end - start
+    response.set_etag(export.etag)
+    response.headers['Accept-Ranges'] = 'bytes'
+    # 非 ASCII 文件夹名通过 filename* 传递（响应头只能使用 latin-1）
+    download_name = f'{folder_name}.zip'
+    fallback_name = secure_filename(download_name) if download_name.isascii() else 'export.zip'
+    response.headers['Content-Disposition'] = f"attachment; filename=\"{fallback_name}\"; filename*=UTF-8''{quote(download_name)}"
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{export.length}'
+    return response
+
 @admin_bp.route('/folder/<folder_name>/thumbnail/<image_name>')
 @login_required
 def get_image_thumbnail(folder_name, image_name):
@@ -323,18 +418,31 @@ def get_image_thumbnail(folder_name, image_name):
     if not file_path or not os.path.exists(file_path) or not os.path.isfile(file_path):
         abort(404)
     
-    try:
-        # 创建缩略图
-        img = Image.open(file_path)
-        img.thumbnail(Config.THUMBNAIL_SIZE)
+    # 从缩略图缓存获取（未命中时生成并写入缓存）；
+    # 缓存文件可能在返回路径之后被其他进程淘汰，此时重新获取一次
+    for _ in range(2):
+        thumbnail = get_thumbnail(file_path, Config.THUMBNAIL_SIZE)
+        if not thumbnail:
+            abort(500)
         
-        # 将图片转换为字节流
-        img_io = BytesIO()
-        img_format = img.format or 'JPEG'
-        img.save(img_io, format=img_format)
-        img_io.seek(0)
-        
-        return send_file(img_io, mimetype=f'image/{img_format.lower()}')
-    except Exception as e:
-        print(f"生成缩略图时出错: {str(e)}")
-        abort(500)
\ No newline at end of file
+        thumbnail_path, mimetype = thumbnail
+        try:
+            return send_file(thumbnail_path, mimetype=mimetype)
+        except FileNotFoundError:
+            continue
+    abort(500)
+
+
+@admin_bp.route('/variants/stats')
+@login_required
+def variant_stats():
+    """
+    获取图像格式变体统计（返回次数、节省字节数、缓存占用等）
+    """
+    store = variants.variant_store
+    if store is None:
+        return jsonify({'enabled': False})
+    
+    stats = store.stats()
+    stats.update({'enabled': True, 'formats': store.formats})
+    return jsonify(stats)
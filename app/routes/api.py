@@ -0,0 +1,135 @@
+"""
+API 路由模块 - JSON 接口
+"""
+import os
+from urllib.parse import quote
+from flask import Blueprint, request, jsonify, url_for
+from ..utils.security import get_safe_path
+from ..utils.cache import load_folder, get_random_images, get_random_images_from_all_folders, get_image_stat
+from ..utils.browse import get_page, image_urls
+from ..utils.image_utils import get_image_dimensions
+from ..config.config import Config
+from .images import make_etag
+
+# 创建蓝图
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+
+def get_page_limit():
+    """
+    解析每页数量参数 limit（缺省或无效时使用默认值，超过上限时取上限）
+
+    Returns:
+        每页数量
+    """
+    limit = request.args.get('limit', type=int) or Config.BROWSE_PAGE_SIZE
+    return max(1, min(limit, Config.BROWSE_MAX_PAGE_SIZE))
+
+
+def browse_items(folder, page, stats):
+    """
+    生成一页图片的描述（原图地址、缩略图地址和文件大小）
+
+    Args:
+        folder: 文件夹名称
+        page: 本页文件名列表
+        stats: 文件夹索引中的 {文件名: (文件大小, 修改时间纳秒)}
+
+    Returns:
+        字典列表
+    """
+    items = []
+    for name in page:
+        item = {'name': name}
+        item.update(image_urls(folder, name, Config.BROWSE_THUMB_SIZE, Config.RESIZE_SIZES))
+        stat = stats.get(name)
+        if stat is not None:
+            item['size'] = stat[0]
+        items.append(item)
+    return items
+
+
+@api_bp.route('/browse/<path:folder>')
+def browse_folder(folder):
+    """
+    分页列出文件夹中的图片
+
+    查询参数 cursor 为上一页返回的 next_cursor，limit 为每页数量。
+    """
+    # 验证文件夹路径安全性
+    folder_path = get_safe_path(Config.IMAGE_BASE, folder)
+    if not folder_path or not os.path.isdir(folder_path):
+        return jsonify({'error': '文件夹不存在'}), 404
+
+    # 从共享的文件夹索引分页（已按名称排序）
+    entry = load_folder(Config.IMAGE_BASE, folder, Config.IMAGE_EXTENSIONS)
+    images = entry.images if entry else ()
+    limit = get_page_limit()
+    try:
+        page, start, next_cursor = get_page(images, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({'error': '无效的游标'}), 400
+
+    return jsonify({
+        'folder': folder,
+        'total': len(images),
+        'offset': start,
+        'count': len(page),
+        'images': browse_items(folder, page, entry.stats if entry else {}),
+        'next_cursor': next_cursor,
+        'next': url_for('api.browse_folder', folder=folder, cursor=next_cursor, limit=limit) if next_cursor else None,
+    })
+
+
+def describe_image(folder, name):
+    """
+    生成单张图片的描述（地址、文件大小、尺寸和 ETag）
+
+    Args:
+        folder: 文件夹名称
+        name: 文件名
+
+    Returns:
+        字典
+    """
+    item = {'folder': folder, 'name': name, 'url': quote(f'/{folder}/{name}')}
+    stat = get_image_stat(folder, name)
+    if stat is not None:
+        dimensions = get_image_dimensions(os.path.join(Config.IMAGE_BASE, folder, name), stat)
+        item['size'] = stat[0]
+        item['width'], item['height'] = dimensions or (None, None)
+        item['etag'] = f'"{make_etag(*stat)}"'
+    return item
+
+
+@api_bp.route('/random')
+def random_images():
+    """
+    一次返回多张互不重复的随机图片
+
+    查询参数 count 为数量（上限 RANDOM_BATCH_MAX），folder 为文件夹名称，省略时从所有文件夹中选择。
+    """
+    count = request.args.get('count', '1')
+    try:
+        count = int(count)
+    except ValueError:
+        return jsonify({'error': '无效的数量'}), 400
+    if count < 1:
+        return jsonify({'error': '无效的数量'}), 400
+    count = min(count, Config.RANDOM_BATCH_MAX)
+
+    folder = request.args.get('folder')
+    if folder:
+        # 验证文件夹路径安全性
+        folder_path = get_safe_path(Config.IMAGE_BASE, folder)
+        if not folder_path or not os.path.isdir(folder_path):
+            return jsonify({'error': '文件夹不存在'}), 404
+        picks = [(folder, name) for name in get_random_images(Config.IMAGE_BASE, folder,
+                                                                Config.IMAGE_EXTENSIONS, count)]
+    else:
+        picks = get_random_images_from_all_folders(Config.IMAGE_BASE, Config.IMAGE_EXTENSIONS, count)
+
+    return jsonify({
+        'count': len(picks),
+        'images': [describe_image(pick_folder, name) for pick_folder, name in picks],
+    })
@@ -1,10 +1,11 @@
 """
 错误处理路由模块
 """
-import os
 import time
 from flask import Blueprint, render_template, request
-from ..utils.security import get_safe_path, get_real_ip, add_ban
+from ..utils.security import get_client_ip, add_ban
+from ..utils.scanner import list_subfolders, is_image_name
+from ..utils.render_pool import RenderBusyError
 from ..config.config import Config
 
 # 创建蓝图
@@ -16,8 +17,7 @@ def handle_404(e):
     404错误处理：显示自定义404页面
     """
     # 获取所有可用的子文件夹（用于导航）
-    subfolders = [d for d in os.listdir(Config.IMAGE_BASE)
-                if os.path.isdir(get_safe_path(Config.IMAGE_BASE, d))]
+    subfolders = list_subfolders(Config.IMAGE_BASE)
     # 渲染404模板并传入子文件夹列表
     return render_template('fnf.html', subfolders=subfolders), 404
 
@@ -27,11 +27,11 @@ def handle_ratelimit_exceeded(e):
     """
     自定义429错误处理，记录封禁信息并显示封禁页面
     """
-    client_ip = get_real_ip()
+    client_ip = get_client_ip()
     target_url = request.path
 
     # 确定路径类型（文件或目录）
-    is_directory = not any(target_url.lower().endswith(ext) for ext in Config.IMAGE_EXTENSIONS)
+    is_directory = not is_image_name(target_url, Config.IMAGE_EXTENSIONS)
 
     # 添加封禁记录（确保使用相同的封禁时间）
     end_time = add_ban(client_ip, target_url, is_directory, Config.BAN_DURATION)
@@ -47,6 +47,14 @@ def handle_ratelimit_exceeded(e):
                            target_url=target_url), 429
 
 
+@errors_bp.app_errorhandler(RenderBusyError)
+def handle_render_busy(e):
+    """
+    图像处理队列已满或超时：返回503，提示客户端稍后重试
+    """
+    return "服务器繁忙，请稍后重试", 503, {'Retry-After': '5'}
+
+
 @errors_bp.app_errorhandler(500)
 def handle_500(e):
     """
@@ -3,9 +3,17 @@
 """
 import os
 import logging
-from flask import Blueprint, redirect, send_from_directory, abort, request
+import mimetypes
+from stat import S_ISREG
+from urllib.parse import quote, urlencode
+from flask import Blueprint, redirect, send_from_directory, send_file, abort, request, Response, g
+from werkzeug.http import http_date
 from ..utils.security import get_safe_path
-from ..utils.cache import get_random_image, get_random_image_from_all_folders, invalidate_cache
+from ..utils.cache import (get_random_image, get_random_image_from_all_folders, invalidate_cache, get_image_stat,
+                           apply_folder_changes)
+from ..utils import variant_store as variants
+from ..utils.image_utils import get_resized, snap_size, RESIZE_FITS, RESIZE_SUFFIXES
+from ..utils.shuffle import make_picker
 from ..config.config import Config
 
 # 配置日志
@@ -14,6 +22,314 @@ logger = logging.getLogger(__name__)
 # 创建蓝图
 images_bp = Blueprint('images', __name__)
 
+
+def make_etag(size, mtime_ns):
+    """
+    根据文件大小和修改时间生成强校验 ETag（不含引号）
+    
+    Args:
+        size: 文件大小
+        mtime_ns: 修改时间（纳秒）
+        
+    Returns:
+        ETag字符串
+    """
+    return f'{size:x}-{mtime_ns:x}'
+
+
+def _get_validators(folder, filename, file_path):
+    """
+    获取图像的 (大小, 修改时间纳秒)：优先读取文件夹索引，未缓存时 stat 一次
+    
+    Returns:
+        (文件大小, 修改时间纳秒) 或 None（文件不存在）
+    """
+    stat = get_image_stat(folder, filename)
+    if stat is not None:
+        return stat
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _current_stat(folder, filename, file_path, stat):
+    """
+    发送文件前重新 stat 一次，获取磁盘上的 (大小, 修改时间纳秒)
+    
+    文件夹索引可能已过期（如重启后从快照恢复，快照只按目录修改时间校验），
+    200 响应的 ETag 和 Last-Modified 以实际发送的文件为准；与索引不一致时更新索引条目。
+    
+    Args:
+        folder: 文件夹名称
+        filename: 图像文件名
+        file_path: 图像绝对路径
+        stat: 索引中的 (文件大小, 修改时间纳秒)，未缓存时为 None
+        
+    Returns:
+        (文件大小, 修改时间纳秒) 或 None（文件不存在或不是普通文件）
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    if not S_ISREG(st.st_mode):
+        return None
+    current = (st.st_size, st.st_mtime_ns)
+    if stat is not None and current != stat:
+        apply_folder_changes({folder: {filename: current}})
+    return current
+
+
+def _image_etag(stat, resize, variant):
+    """
+    生成图像响应的 ETag：缩放图和格式变体在原图 ETag 后附加后缀
+    
+    Args:
+        stat: 原图的 (文件大小, 修改时间纳秒)
+        resize: (宽度, 高度, 缩放方式) 或 None
+        variant: 选中的格式变体或 None
+        
+    Returns:
+        ETag字符串（不含引号）
+    """
+    etag = make_etag(*stat)
+    if resize:
+        width, height, fit = resize
+        return f'{etag}-{width}x{height}-{fit}'
+    if variant is not None:
+        return f'{etag}-{variant.name}'
+    return etag
+
+
+def _send_image_file(folder_path, folder, filename, stat=None):
+    """
+    发送图像文件：按配置直接发送，或通过 X-Accel-Redirect / X-Sendfile 交给前置代理
+    
+    Args:
+        folder_path: 已验证的文件夹绝对路径
+        folder: 文件夹名称（URL路径）
+        filename: 图像文件名
+        stat: (文件大小, 修改时间纳秒)，提供时附带 ETag 和 Last-Modified
+        
+    Returns:
+        Flask响应对象
+    """
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    etag = make_etag(*stat) if stat else None
+    last_modified = stat[1] / 1e9 if stat else None
+    
+    sendfile_header = Config.SENDFILE_HEADER
+    if sendfile_header in ('X-Accel-Redirect', 'X-Sendfile'):
+        if sendfile_header == 'X-Accel-Redirect':
+            # Nginx：由 internal location 发送文件
+            location = quote(f"{Config.SENDFILE_PREFIX.rstrip('/')}/{folder}/{filename}")
+        else:
+            # Apache mod_xsendfile / Lighttpd：传递文件绝对路径
+            location = os.path.join(folder_path, filename)
+        response = Response(headers={sendfile_header: location}, mimetype=mimetype)
+        if etag:
+            response.set_etag(etag)
+            response.headers['Last-Modified'] = http_date(last_modified)
+        return response
+    
+    return send_from_directory(
+        folder_path,
+        filename,
+        mimetype=mimetype,
+        etag=etag if etag else True,
+        last_modified=last_modified
+    )
+
+
+def _get_resize_params(filename):
+    """
+    解析缩放参数 w、h、fit，并将尺寸向上对齐到白名单
+    
+    Args:
+        filename: 图像文件名（GIF 等不可缩放的格式返回原图）
+        
+    Returns:
+        (宽度, 高度, 缩放方式) 或 None（未请求缩放）；参数无效时返回400
+    """
+    width = request.args.get('w', '')
+    height = request.args.get('h', '')
+    if not width and not height:
+        return None
+    try:
+        width = int(width) if width else 0
+        height = int(height) if height else 0
+    except ValueError:
+        abort(400)
+    fit = request.args.get('fit', 'contain').lower()
+    if width < 0 or height < 0 or fit not in RESIZE_FITS:
+        abort(400)
+    if not (width or height) or not filename.lower().endswith(RESIZE_SUFFIXES):
+        return None
+    
+    sizes = Config.RESIZE_SIZES
+    width = snap_size(width, sizes) if width else 0
+    height = snap_size(height, sizes) if height else 0
+    return width, height, fit
+
+
+def _resize_query(resize):
+    """
+    生成缩放参数的规范查询字符串（便于 CDN 按URL缓存）
+    
+    Args:
+        resize: (宽度, 高度, 缩放方式) 或 None
+        
+    Returns:
+        查询字符串（含 ?）或空字符串
+    """
+    if not resize:
+        return ''
+    width, height, fit = resize
+    params = {}
+    if width:
+        params['w'] = width
+    if height:
+        params['h'] = height
+    if fit != 'contain':
+        params['fit'] = fit
+    return '?' + urlencode(params)
+
+
+def _send_resized(file_path, stat, resize, etag):
+    """
+    发送缩放图（缓存命中时直接作为静态文件发送）
+    
+    Args:
+        file_path: 原图路径
+        stat: 原图的 (文件大小, 修改时间纳秒)
+        resize: (宽度, 高度, 缩放方式)
+        etag: 缩放图 ETag（不含引号）
+        
+    Returns:
+        Flask响应对象
+    """
+    # 缓存文件可能在返回路径之后被其他进程淘汰，此时重新生成一次
+    for _ in range(2):
+        resized = get_resized(file_path, stat, *resize)
+        if not resized:
+            abort(500)
+        resized_path, mimetype = resized
+        try:
+            return send_file(resized_path, mimetype=mimetype, etag=etag,
+                             last_modified=stat[1] / 1e9, conditional=True)
+        except FileNotFoundError:
+            continue
+    abort(500)
+
+
+def _pick_variant(file_path, stat):
+    """
+    按 Accept 请求头选择已生成的图像格式变体
+    
+    Args:
+        file_path: 原图路径
+        stat: (文件大小, 修改时间纳秒)
+        
+    Returns:
+        (Variant或None, 响应是否随 Accept 变化, 是否有更合适的变体正在生成)
+    """
+    store = variants.variant_store
+    if store is None or stat is None or not store.formats:
+        return None, False, False
+    if not file_path.lower().endswith(variants.SOURCE_SUFFIXES):
+        return None, False, False
+    
+    # 只认明确列出且 q>0 的类型（*/* 不代表支持 AVIF/WebP）
+    accepted = [value for value, quality in request.accept_mimetypes if quality > 0]
+    variant, pending = store.lookup(file_path, stat, accepted)
+    return variant, True, pending
+
+
+def _set_image_cache_control(pending):
+    """
+    设置单个图像URL的缓存策略
+    
+    内容不变时允许浏览器和CDN长期缓存；更合适的变体仍在生成时只短期缓存，
+    生成完成（或确认不比原图小）后客户端才能拿到变体。
+    
+    Args:
+        pending: 是否有更合适的变体正在生成
+    """
+    g.cache_control = Config.VARIANT_PENDING_CACHE_CONTROL if pending else Config.IMAGE_CACHE_CONTROL
+
+
+def _send_variant(variant, etag, stat):
+    """
+    发送图像格式变体
+    
+    Args:
+        variant: Variant
+        etag: 变体 ETag（不含引号）
+        stat: 原图的 (文件大小, 修改时间纳秒)
+        
+    Returns:
+        Flask响应对象，变体文件已被淘汰时返回 None（改为发送原图）
+    """
+    try:
+        return send_file(variant.path, mimetype=variant.mimetype, etag=etag,
+                         last_modified=stat[1] / 1e9, conditional=True)
+    except FileNotFoundError:
+        return None
+
+
+def _not_modified(etag, stat):
+    """
+    构造304响应
+    
+    Args:
+        etag: ETag（不含引号）
+        stat: (文件大小, 修改时间纳秒)
+        
+    Returns:
+        Flask响应对象
+    """
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Last-Modified'] = http_date(stat[1] / 1e9)
+    return response
+
+
+def _respond_with_image(folder_path, folder, image):
+    """
+    返回随机选中的图像：重定向到图像URL，或在直接模式下直接返回图像内容
+    
+    Args:
+        folder_path: 已验证的文件夹绝对路径
+        folder: 文件夹名称（URL路径）
+        image: 图像文件名
+        
+    Returns:
+        Flask响应对象
+    """
+    image_url = f'/{folder}/{image}'
+    resize = _get_resize_params(image)
+    if Config.RANDOM_SERVE_MODE != 'direct':
+        # 重定向到实际图像URL（保留对齐后的缩放参数）
+        return redirect(image_url + _resize_query(resize))
+    
+    # 直接返回图像，省去一次重定向往返；Content-Location 指向图像的规范URL
+    file_path = os.path.join(folder_path, image)
+    stat = _current_stat(folder, image, file_path, get_image_stat(folder, image))
+    variant, vary, _ = _pick_variant(file_path, stat) if not resize else (None, False, False)
+    response = None
+    if resize and stat:
+        response = _send_resized(file_path, stat, resize, _image_etag(stat, resize, None))
+    elif variant is not None:
+        response = _send_variant(variant, _image_etag(stat, None, variant), stat)
+    if response is None:
+        response = _send_image_file(folder_path, folder, image, stat)
+    if vary:
+        response.vary.add('Accept')
+    response.headers['Content-Location'] = quote(image_url) + _resize_query(resize)
+    return response
+
 @images_bp.route('/random')
 def serve_random_from_all():
     """
@@ -22,10 +338,13 @@ def serve_random_from_all():
     """
     max_attempts = 3  # 最大重试次数
     attempt = 0
+    
+    # 洗牌模式下按客户端的排列依次取图（未启用时为 None，每次独立随机）
+    pick = make_picker(Config.SHUFFLE_COOKIE, '')
 
     while attempt < max_attempts:
         # 从所有文件夹中随机选择图片
-        folder, image = get_random_image_from_all_folders(Config.IMAGE_BASE, Config.IMAGE_EXTENSIONS)
+        folder, image = get_random_image_from_all_folders(Config.IMAGE_BASE, Config.IMAGE_EXTENSIONS, pick)
         
         if not folder or not image:
             abort(404)  # 无有效图像
@@ -35,8 +354,7 @@ def serve_random_from_all():
         image_path = get_safe_path(folder_path, image)
         
         if image_path and os.path.isfile(image_path):
-            # 重定向到实际图像URL
-            return redirect(f'/{folder}/{image}')
+            return _respond_with_image(folder_path, folder, image)
 
         # 文件不存在：记录日志并尝试重建缓存
         logger.warning(f"图像文件不存在: {image_path}, 尝试 {attempt + 1}/{max_attempts}")
@@ -68,18 +386,20 @@ def serve_sequential_image(folder):
 
     max_attempts = 3  # 最大重试次数
     attempt = 0
+    
+    # 洗牌模式下按客户端的排列依次取图（未启用时为 None，每次独立随机）
+    pick = make_picker(Config.SHUFFLE_COOKIE, folder)
 
     while attempt < max_attempts:
-        # 获取随机图像（真随机）
-        image = get_random_image(Config.IMAGE_BASE, folder, Config.IMAGE_EXTENSIONS)
+        # 获取随机图像（真随机或洗牌顺序）
+        image = get_random_image(Config.IMAGE_BASE, folder, Config.IMAGE_EXTENSIONS, pick)
         if not image:
             abort(404)  # 无有效图像
 
         # 检查图像文件是否存在
         image_path = get_safe_path(folder_path, image)
         if image_path and os.path.isfile(image_path):
-            # 重定向到实际图像URL
-            return redirect(f'/{folder}/{image}')
+            return _respond_with_image(folder_path, folder, image)
 
         # 文件不存在：记录日志并尝试重建缓存
         logger.warning(f"图像文件不存在: {image_path}, 尝试 {attempt + 1}/{max_attempts}")
@@ -105,14 +425,50 @@ def serve_image(folder, filename):
 
     # 验证文件路径
     file_path = get_safe_path(safe_folder, filename)
-    if not file_path or not os.path.isfile(file_path):
+    if not file_path:
+        abort(404)
+
+    # 校验信息来自文件夹索引：条件请求命中时直接返回304，不访问文件
+    stat = _get_validators(folder, filename, file_path)
+    
+    # 请求缩放时返回缩放图；否则按 Accept 选择已生成的 WebP/AVIF 变体，两者均使用独立的 ETag
+    resize = _get_resize_params(filename)
+    variant, vary, pending = _pick_variant(file_path, stat) if not resize else (None, False, False)
+    _set_image_cache_control(pending)
+    if stat is not None:
+        etag = _image_etag(stat, resize, variant)
+        response = None
+        if request.if_none_match and request.if_none_match.contains(etag):
+            response = _not_modified(etag, stat)
+        elif (not request.if_none_match and request.if_modified_since
+                and int(stat[1] // 1_000_000_000) <= request.if_modified_since.timestamp()):
+            response = _not_modified(etag, stat)
+        if response is not None:
+            if vary:
+                response.vary.add('Accept')
+            return response
+
+    # 返回文件内容时以磁盘上的大小和修改时间为准（索引可能已过期）
+    current = _current_stat(folder, filename, file_path, stat)
+    if current is None:
         # 文件不存在时使缓存失效
         invalidate_cache(folder)
         abort(404)
+    if current != stat:
+        stat = current
+        variant, vary, pending = _pick_variant(file_path, stat) if not resize else (None, False, False)
+        _set_image_cache_control(pending)
+    etag = _image_etag(stat, resize, variant)
+
+    # 发送图像文件（或其缩放图、格式变体）
+    response = None
+    if resize:
+        response = _send_resized(file_path, stat, resize, etag)
+    elif variant is not None:
+        response = _send_variant(variant, etag, stat)
+    if response is None:
+        response = _send_image_file(safe_folder, folder, filename, stat)
+    if vary:
+        response.vary.add('Accept')
+    return response
 
-    # 发送图像文件
-    return send_from_directory(
-        safe_folder,
-        filename,
-        mimetype='image'  # 通用MIME类型
-    )
\ No newline at end of file
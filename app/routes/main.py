@@ -2,10 +2,13 @@
 主路由模块
 """
 import os
-from flask import Blueprint, render_template, redirect, send_from_directory, abort
-from ..utils.image_utils import get_folder_preview
+from flask import Blueprint, render_template, redirect, send_from_directory, abort, request
+from ..utils.home_cache import get_home_cache
 from ..utils.security import get_safe_path
+from ..utils.cache import load_folder
+from ..utils.browse import get_page
 from ..config.config import Config
+from .api import browse_items
 
 # 创建蓝图
 main_bp = Blueprint('main', __name__)
@@ -15,24 +18,20 @@ def serve_main_page():
     """
     主路由：显示包含所有子文件夹列表的主页
     """
-    # 获取IMAGE_BASE下所有合法的子文件夹
-    subfolders = [d for d in os.listdir(Config.IMAGE_BASE)
-                if os.path.isdir(get_safe_path(Config.IMAGE_BASE, d))]
+    cache = get_home_cache()
     
-    # 获取每个文件夹的预览图
-    folder_previews = {}
-    for folder in subfolders:
-        preview = get_folder_preview(
-            Config.IMAGE_BASE, 
-            folder, 
-            Config.THUMBNAIL_SIZE, 
-            Config.IMAGE_EXTENSIONS
-        )
-        if preview:
-            folder_previews[folder] = preview
+    # 从缓存获取子文件夹列表和预览图（过期时由后台线程重建）
+    version, subfolders, folder_previews = cache.get()
+    
+    # 预览集合未变化时直接返回已渲染的页面
+    rendered = cache.rendered
+    if rendered and rendered[0] == version:
+        return rendered[1]
     
     # 渲染主页面模板并传入子文件夹列表和预览图
-    return render_template('MainDomain.html', subfolders=subfolders, folder_previews=folder_previews)
+    html = render_template('MainDomain.html', subfolders=subfolders, folder_previews=folder_previews)
+    cache.rendered = (version, html)
+    return html
 
 
 @main_bp.route('/favicon.ico')
@@ -51,22 +50,23 @@ def favicon():
 @main_bp.route('/browse/<path:folder>')
 def browse_images(folder):
     """
-    浏览文件夹中的所有图像
+    浏览文件夹中的图像（按页显示缩略图，后续页由 /api/browse 加载）
     """
     # 验证文件夹路径安全性
     folder_path = get_safe_path(Config.IMAGE_BASE, folder)
     if not folder_path or not os.path.isdir(folder_path):
         abort(404)
     
-    # 获取文件夹中的所有图像
-    images = []
-    for f in os.listdir(folder_path):
-        file_path = get_safe_path(folder_path, f)
-        if file_path and os.path.isfile(file_path) and any(f.lower().endswith(ext) for ext in Config.IMAGE_EXTENSIONS):
-            images.append(f)
-    
-    # 按名称排序
-    images.sort()
+    # 从共享的文件夹索引分页（已按名称排序）
+    entry = load_folder(Config.IMAGE_BASE, folder, Config.IMAGE_EXTENSIONS)
+    images = entry.images if entry else ()
+    try:
+        page, start, next_cursor = get_page(images, request.args.get('cursor'), Config.BROWSE_PAGE_SIZE)
+    except ValueError:
+        abort(400)
     
     # 渲染浏览器模板
-    return render_template('browser.html', folder=folder, images=images)
\ No newline at end of file
+    return render_template('browser.html', folder=folder,
+                           images=browse_items(folder, page, entry.stats if entry else {}),
+                           total=len(images), offset=start, next_cursor=next_cursor,
+                           page_size=Config.BROWSE_PAGE_SIZE)
\ No newline at end of file
@@ -0,0 +1,25 @@
+"""
+指标路由模块 - Prometheus 文本格式的指标端点
+"""
+import hmac
+from flask import Blueprint, Response, request, session, abort, current_app
+from ..utils.metrics import render_all
+
+# 创建蓝图（路径由 METRICS_PATH 配置，注册时作为 url_prefix）
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('')
+def metrics():
+    """
+    输出 Prometheus 指标
+
+    已登录的管理员可直接访问；采集器使用 Authorization: Bearer <METRICS_TOKEN> 访问。
+    多进程模式下计数器和直方图为所有工作进程的合计，仪表为处理本次请求的工作进程的取值。
+    """
+    if not session.get('admin_logged_in'):
+        token = current_app.config.get('METRICS_TOKEN')
+        auth = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(auth.encode(), f'Bearer {token}'.encode()):
+            abort(403)
+
+    return Response(render_all(), content_type='text/plain; version=0.0.4; charset=utf-8')
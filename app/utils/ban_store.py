@@ -0,0 +1,296 @@
+"""
+封禁存储模块 - 按IP组织的路径前缀树、按结束时间排序的过期堆及容量上限
+"""
+import time
+import heapq
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 违规记录保留时长（秒），超过后违规计数清零
+VIOLATION_TTL = 604800  # 7天
+
+# 短时间内重复违规的判定窗口（秒）
+REPEAT_WINDOW = 1800  # 30分钟
+
+# 违规记录的清理间隔（秒）
+VIOLATION_CLEANUP_INTERVAL = 60
+
+
+def progressive_duration(ban_duration: float, count: int, repeated_violation: bool) -> float:
+    """
+    计算累进封禁时长
+
+    Args:
+        ban_duration: 基础封禁时长
+        count: 违规次数（含本次）
+        repeated_violation: 是否为短时间内重复违规
+
+    Returns:
+        实际封禁时长
+    """
+    if repeated_violation:
+        # 短时间内重复违规，封禁时间翻倍（最多24倍）
+        return ban_duration * min(2 ** (count - 1), 24)
+    if count > 1:
+        # 非短时间重复但有历史违规，增加50%时长（最多12倍）
+        return ban_duration * min(1.5 * (count - 1), 12)
+    return ban_duration
+
+
+def is_severe_violation(count: int, repeated_violation: bool) -> bool:
+    """严重违规（多次违规）时升级为全局IP封禁"""
+    return count >= 5 or (repeated_violation and count >= 3)
+
+
+class _PathNode:
+    """路径前缀树节点（每个路径段一个节点）"""
+    __slots__ = ('children', 'exact_end', 'dir_end')
+
+    def __init__(self):
+        self.children: Dict[str, '_PathNode'] = {}
+        self.exact_end = 0.0  # 该路径本身的封禁结束时间
+        self.dir_end = 0.0    # 该目录（含所有子路径）的封禁结束时间
+
+
+class _IPBans:
+    """单个IP的封禁记录"""
+    __slots__ = ('root', 'global_end', 'max_end', 'paths')
+
+    def __init__(self):
+        self.root = _PathNode()
+        self.global_end = 0.0  # 全局封禁结束时间
+        self.max_end = 0.0     # 所有记录中最晚的结束时间（过期堆以此为准）
+        self.paths = 0         # 已记录的路径数
+
+
+def split_path(path: str) -> List[str]:
+    """
+    将请求路径拆分为路径段（忽略空段，/a/b/ 与 /a/b 等价）
+
+    Args:
+        path: 请求路径
+
+    Returns:
+        路径段列表
+    """
+    return [part for part in path.split('/') if part]
+
+
+class BanStore:
+    """
+    封禁存储
+
+    - 每个IP一棵路径前缀树：目录封禁沿请求路径逐段匹配，无需枚举父路径字符串
+    - 以IP最晚结束时间为键的最小堆：过期清理只处理已到期的IP，均摊 O(log n)
+    - IP数量和单个IP的路径数量有上限，超出时淘汰最早到期的IP或升级为全局封禁
+    """
+
+    def __init__(self, max_ips: int = 100000, max_paths_per_ip: int = 256):
+        """
+        初始化封禁存储
+
+        Args:
+            max_ips: 最多记录的封禁IP数量
+            max_paths_per_ip: 单个IP最多记录的封禁路径数（超过后改为全局封禁）
+        """
+        self.max_ips = max_ips
+        self.max_paths_per_ip = max_paths_per_ip
+        self._bans: Dict[str, _IPBans] = {}
+        # 过期堆：(最晚结束时间, IP)，IP的结束时间延长后旧条目在弹出时跳过
+        self._heap: List[Tuple[float, str]] = []
+        # 违规记录：{ip: (违规次数, 最后封禁时间)}，按最后封禁时间排序
+        self._violations: 'OrderedDict[str, Tuple[int, float]]' = OrderedDict()
+        self._lock = Lock()
+        self._next_violation_cleanup = 0.0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._bans)
+
+    def is_banned(self, client_ip: str, path: str, now: Optional[float] = None) -> Tuple[bool, float, float]:
+        """
+        检查指定IP和路径是否已被封禁
+
+        匹配顺序与原实现一致：精确路径、全局封禁、最具体的父目录封禁。
+
+        Args:
+            client_ip: 客户端IP
+            path: 请求路径
+            now: 当前时间（默认 time.time()）
+
+        Returns:
+            (是否被封禁, 剩余时间, 结束时间)
+        """
+        # 快速检查：IP不在记录中（绝大多数请求）无需加锁
+        bans = self._bans.get(client_ip)
+        if bans is None:
+            return False, 0, 0
+
+        if now is None:
+            now = time.time()
+        if bans.max_end <= now:
+            return False, 0, 0
+
+        # 沿路径逐段下行，记录最具体的有效目录封禁（根节点不作为目录封禁）
+        node = bans.root
+        dir_end = 0.0
+        for part in split_path(path):
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.dir_end > now:
+                dir_end = node.dir_end
+        else:
+            # 1. 精确路径匹配
+            end_time = max(node.exact_end, node.dir_end)
+            if end_time > now:
+                return True, end_time - now, end_time
+
+        # 2. 全局IP封禁
+        if bans.global_end > now:
+            return True, bans.global_end - now, bans.global_end
+
+        # 3. 目录封禁
+        if dir_end:
+            return True, dir_end - now, dir_end
+        return False, 0, 0
+
+    def add_ban(self, client_ip: str, path: str, is_directory: bool, ban_duration: float,
+                now: Optional[float] = None) -> float:
+        """
+        添加封禁记录（累进封禁：短时间内重复违规时长翻倍，严重违规升级为全局封禁）
+
+        Args:
+            client_ip: 客户端IP
+            path: 请求路径
+            is_directory: 是否为目录
+            ban_duration: 基础封禁时长
+            now: 当前时间（默认 time.time()）
+
+        Returns:
+            封禁结束时间
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            # 更新违规计数
+            count, last_time = self._violations.pop(client_ip, (0, None))
+            count += 1
+            repeated_violation = last_time is not None and now - last_time < REPEAT_WINDOW
+            self._violations[client_ip] = (count, now)
+
+            # 累进封禁策略
+            actual_ban_duration = progressive_duration(ban_duration, count, repeated_violation)
+
+            bans = self._bans.get(client_ip)
+            if bans is None or bans.max_end <= now:
+                # 新IP，或旧记录已全部过期（尚未被清理）时重新开始记录
+                is_new = bans is None
+                bans = self._bans[client_ip] = _IPBans()
+                if is_new:
+                    self._evict_locked(now)
+
+            # 已有未过期封禁时取较长的结束时间
+            end_time = now + actual_ban_duration
+            if bans.max_end > now:
+                end_time = max(end_time, bans.max_end)
+
+            if bans.paths >= self.max_paths_per_ip:
+                # 路径数量超过上限：不再记录新路径，直接全局封禁
+                bans.global_end = max(bans.global_end, end_time)
+            else:
+                node = bans.root
+                for part in split_path(path):
+                    child = node.children.get(part)
+                    if child is None:
+                        child = node.children[part] = _PathNode()
+                    node = child
+                if not node.exact_end and not node.dir_end:
+                    bans.paths += 1
+                if is_directory:
+                    node.dir_end = end_time
+                else:
+                    node.exact_end = end_time
+
+            # 严重违规（多次违规）添加全局IP封禁
+            if is_severe_violation(count, repeated_violation):
+                bans.global_end = end_time
+
+            if end_time > bans.max_end:
+                bans.max_end = end_time
+                heapq.heappush(self._heap, (end_time, client_ip))
+        return end_time
+
+    def _evict_locked(self, now: float) -> None:
+        """IP数量超过上限时淘汰最早到期的IP（调用方需持有锁）"""
+        self._expire_locked(now)
+        while len(self._bans) > self.max_ips and self._heap:
+            end_time, ip = heapq.heappop(self._heap)
+            bans = self._bans.get(ip)
+            if bans is not None and bans.max_end == end_time:
+                del self._bans[ip]
+                self.evictions += 1
+
+    def _expire_locked(self, now: float) -> int:
+        """弹出所有已到期的IP（调用方需持有锁）"""
+        removed = 0
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            end_time, ip = heapq.heappop(heap)
+            bans = self._bans.get(ip)
+            # 结束时间已被延长的旧条目直接跳过
+            if bans is not None and bans.max_end == end_time:
+                del self._bans[ip]
+                removed += 1
+        return removed
+
+    def cleanup(self, now: Optional[float] = None) -> int:
+        """
+        清理过期封禁记录和过期违规计数（只处理已到期的部分）
+
+        Args:
+            now: 当前时间（默认 time.time()）
+
+        Returns:
+            移除的IP数量
+        """
+        if now is None:
+            now = time.time()
+        # 快速检查：没有到期记录且未到违规记录清理时间时无需加锁
+        heap = self._heap
+        if (not heap or heap[0][0] > now) and now < self._next_violation_cleanup:
+            return 0
+
+        with self._lock:
+            removed = self._expire_locked(now)
+            if now >= self._next_violation_cleanup:
+                self._next_violation_cleanup = now + VIOLATION_CLEANUP_INTERVAL
+                # 违规记录按最后封禁时间排序，从最早的开始清理
+                violations = self._violations
+                while violations:
+                    _, last_time = next(iter(violations.values()))
+                    if now - last_time <= VIOLATION_TTL and len(violations) <= self.max_ips:
+                        break
+                    violations.popitem(last=False)
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取封禁统计信息
+
+        Returns:
+            包含封禁IP数、堆大小、违规记录数及淘汰次数的字典
+        """
+        with self._lock:
+            return {
+                'banned_ips': len(self._bans),
+                'heap_size': len(self._heap),
+                'violations': len(self._violations),
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,90 @@
+"""
+浏览分页模块 - 基于文件夹索引的游标分页
+
+游标是上一页最后一个文件名的 URL 安全编码。文件夹索引按名称排序，
+下一页从该文件名之后二分查找开始，翻页代价与文件夹大小无关；
+翻页期间增删文件不会导致重复或跳过其余图片（偏移量分页会）。
+"""
+import base64
+import binascii
+from bisect import bisect_right
+from typing import Dict, Optional, Sequence, Tuple
+from urllib.parse import quote, urlencode
+from .image_utils import snap_size, RESIZE_SUFFIXES
+
+
+def encode_cursor(name: str) -> str:
+    """
+    将文件名编码为游标
+
+    Args:
+        name: 文件名
+
+    Returns:
+        URL 安全的游标字符串
+    """
+    return base64.urlsafe_b64encode(name.encode('utf-8', 'surrogateescape')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> str:
+    """
+    将游标解码为文件名
+
+    Args:
+        cursor: 游标字符串
+
+    Returns:
+        文件名
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        raw = base64.b64decode(cursor + '=' * (-len(cursor) % 4), altchars=b'-_', validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError('无效的游标')
+    return raw.decode('utf-8', 'surrogateescape')
+
+
+def get_page(images: Sequence[str], cursor: Optional[str], limit: int) -> Tuple[Sequence[str], int, Optional[str]]:
+    """
+    获取一页文件名
+
+    Args:
+        images: 按名称排序的文件名序列（元组或紧凑索引视图）
+        cursor: 游标，None 表示第一页
+        limit: 每页数量
+
+    Returns:
+        (本页文件名列表, 本页第一项的序号, 下一页游标或 None)
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    start = bisect_right(images, decode_cursor(cursor)) if cursor else 0
+    page = images[start:start + limit]
+    next_cursor = encode_cursor(page[-1]) if page and start + len(page) < len(images) else None
+    return page, start, next_cursor
+
+
+def image_urls(folder: str, name: str, thumb_size: int, resize_sizes: Sequence[int]) -> Dict[str, str]:
+    """
+    生成图片原图和缩略图地址
+
+    缩略图使用缩放图接口（fit=cover，尺寸对齐到白名单），生成后缓存在磁盘；
+    GIF 等不可缩放的格式缩略图即原图。
+
+    Args:
+        folder: 文件夹名称
+        name: 文件名
+        thumb_size: 缩略图边长
+        resize_sizes: 缩放尺寸白名单
+
+    Returns:
+        {'url': 原图地址, 'thumbnail': 缩略图地址}
+    """
+    url = quote(f'/{folder}/{name}')
+    if not name.lower().endswith(RESIZE_SUFFIXES):
+        return {'url': url, 'thumbnail': url}
+    size = snap_size(thumb_size, resize_sizes)
+    return {'url': url, 'thumbnail': f"{url}?{urlencode({'w': size, 'h': size, 'fit': 'cover'})}"}
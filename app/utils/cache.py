@@ -5,22 +5,261 @@ import os
 import random
 import time
 import logging
+from bisect import bisect_right
+from heapq import merge
+from concurrent.futures import Future
 from threading import Lock
-from typing import Optional, Tuple, List, Dict, Any
+from typing import Callable, Optional, Tuple, Dict, NamedTuple, Iterable, List, Mapping, Sequence
 from .security import get_safe_path
+from .scanner import ScanEntry, scan_images, list_subfolders
+from .packed_index import PackedIndex, PackedStats
+from .metrics import registry, FOLDER_CACHE, FOLDER_SCAN_DURATION
+from .render_pool import wait_result
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 创建文件夹缓存字典（用于存储各文件夹的图像列表）
-# 结构：{folder: {'images': [...], 'timestamp': float}}
-folder_cache: Dict[str, Dict[str, Any]] = {}
-# 创建线程锁（确保多线程环境下的缓存操作安全）
-cache_lock = Lock()
-
 # 缓存过期时间（秒）
 CACHE_TTL = int(os.environ.get('CACHE_TTL', 3600))  # 默认1小时
 
+
+class FolderEntry(NamedTuple):
+    """
+    单个文件夹的缓存项（不可变）
+
+    images 和 stats 为普通的元组和字典，或指向紧凑索引（mmap）的只读视图，
+    两者接口一致。
+    """
+    images: Sequence[str]                  # 排序后的图像文件名
+    timestamp: float                       # 扫描时间
+    stats: Mapping[str, Tuple[int, int]]   # {文件名: (文件大小, 修改时间纳秒)}
+
+    @classmethod
+    def from_scan(cls, entries: Iterable[ScanEntry], timestamp: float) -> 'FolderEntry':
+        """
+        根据扫描结果构建缓存项
+
+        Args:
+            entries: 按文件名排序的 ScanEntry 序列
+            timestamp: 扫描时间
+
+        Returns:
+            FolderEntry实例
+        """
+        entries = list(entries)
+        return cls(
+            tuple(entry.name for entry in entries),
+            timestamp,
+            {entry.name: (entry.size, entry.mtime_ns) for entry in entries}
+        )
+
+    @classmethod
+    def from_packed(cls, index: PackedIndex, folder: str, timestamp: float) -> Optional['FolderEntry']:
+        """
+        根据紧凑索引构建缓存项（不复制文件名）
+
+        Args:
+            index: 紧凑索引
+            folder: 文件夹名称
+            timestamp: 扫描时间
+
+        Returns:
+            FolderEntry实例，文件夹不在索引中时返回 None
+        """
+        views = index.folder_views(folder)
+        if views is None:
+            return None
+        names, stats = views
+        return cls(names, timestamp, stats)
+
+    def refreshed(self, entries: List[ScanEntry], timestamp: float) -> 'FolderEntry':
+        """
+        根据重新扫描的结果生成缓存项
+
+        内容未变化且当前为紧凑索引视图时只更新扫描时间，继续共享映射，
+        避免每次过期重扫后都复制出一份完整的文件名列表。
+
+        Args:
+            entries: 按文件名排序的 ScanEntry 列表
+            timestamp: 扫描时间
+
+        Returns:
+            FolderEntry实例
+        """
+        if isinstance(self.stats, PackedStats) and self.stats.same_as(entries):
+            return self._replace(timestamp=timestamp)
+        return FolderEntry.from_scan(entries, timestamp)
+
+
+class GlobalImageIndex:
+    """
+    全局抽样索引：各文件夹图像数量的前缀和（不可变）
+
+    抽样时在 [0, 总数) 中取随机整数，再二分查找所属文件夹，
+    复杂度 O(log F)，无需构造全部 (文件夹, 图像) 列表。
+    """
+    __slots__ = ('folders', 'prefix')
+
+    def __init__(self, counts: Iterable[Tuple[str, int]] = ()):
+        """
+        根据各文件夹图像数量构建索引
+
+        Args:
+            counts: (文件夹名称, 图像数量) 序列
+        """
+        folders = []
+        prefix = []
+        total = 0
+        for folder, count in counts:
+            if count > 0:
+                total += count
+                folders.append(folder)
+                prefix.append(total)
+        self.folders: Tuple[str, ...] = tuple(folders)
+        self.prefix: Tuple[int, ...] = tuple(prefix)  # prefix[i] = 前 i + 1 个文件夹的图像总数
+
+    @property
+    def total(self) -> int:
+        """索引中的图像总数"""
+        return self.prefix[-1] if self.prefix else 0
+
+    def locate(self, rank: int) -> Tuple[str, int]:
+        """
+        将全局序号映射为 (文件夹, 文件夹内下标)
+
+        Args:
+            rank: 全局序号，范围 [0, total)
+
+        Returns:
+            (文件夹名称, 文件夹内下标)
+        """
+        pos = bisect_right(self.prefix, rank)
+        return self.folders[pos], rank - (self.prefix[pos - 1] if pos else 0)
+
+    def sample(self) -> Tuple[Optional[str], int]:
+        """
+        在所有图像中均匀抽样
+
+        Returns:
+            (文件夹名称, 文件夹内下标) 或 (None, 0)
+        """
+        total = self.total
+        if not total:
+            return None, 0
+        return self.locate(random.randrange(total))
+
+    def sample_many(self, count: int) -> List[Tuple[str, int]]:
+        """
+        在所有图像中不放回地均匀抽取多张
+
+        random.sample 对 range 只生成被选中的序号，复杂度 O(count log F)。
+
+        Args:
+            count: 抽取数量（超过总数时取总数）
+
+        Returns:
+            (文件夹名称, 文件夹内下标) 列表
+        """
+        return [self.locate(rank) for rank in random.sample(range(self.total), min(count, self.total))]
+
+
+def _is_top_level(folder: str) -> bool:
+    """检查文件夹是否为 IMAGE_BASE 的直接子文件夹（只有这些参与全局抽样）"""
+    return '/' not in folder and os.sep not in folder
+
+
+class CacheSnapshot:
+    """
+    文件夹缓存快照（发布后不再修改）
+
+    读请求直接引用当前快照，无需加锁；写操作基于当前快照构建新快照后整体替换。
+    """
+    __slots__ = ('folders', 'index')
+
+    def __init__(self, folders: Optional[Dict[str, FolderEntry]] = None):
+        """
+        构建快照
+
+        Args:
+            folders: {文件夹名称: FolderEntry}
+        """
+        self.folders: Dict[str, FolderEntry] = folders or {}
+        self.index = GlobalImageIndex(
+            (folder, len(entry.images)) for folder, entry in self.folders.items()
+            if _is_top_level(folder)
+        )
+
+    def get(self, folder: str) -> Optional[FolderEntry]:
+        """获取文件夹缓存项"""
+        return self.folders.get(folder)
+
+    def replace(self, updates: Dict[str, Optional[FolderEntry]]) -> 'CacheSnapshot':
+        """
+        基于当前快照生成新快照
+
+        Args:
+            updates: {文件夹名称: 新缓存项}，值为 None 表示移除
+
+        Returns:
+            新的 CacheSnapshot
+        """
+        folders = dict(self.folders)
+        for folder, entry in updates.items():
+            if entry is None or not entry.images:
+                folders.pop(folder, None)
+            else:
+                folders[folder] = entry
+        return CacheSnapshot(folders)
+
+
+# 当前发布的缓存快照（读操作直接读取引用，不加锁）
+_snapshot = CacheSnapshot()
+# 写锁：仅在构建并替换快照时持有，磁盘扫描在锁外进行
+cache_lock = Lock()
+# 正在扫描的文件夹（同一文件夹的并发未命中只扫描一次，其他请求等待同一次扫描的结果；由 cache_lock 保护）
+_scanning: Dict[str, Future] = {}
+# 需要重新扫描的顶层文件夹（缓存失效后由 /random 请求补扫，由 cache_lock 保护）
+pending_folders = set()
+# 上次列出 IMAGE_BASE 子文件夹的时间
+base_listed_at = 0.0
+# 进行中的全局索引同步（同一时间只有一个请求访问磁盘，其他请求等待其完成；由 cache_lock 保护）
+_refreshing: Optional[Future] = None
+
+
+registry.gauge('ria_cached_folders', '已缓存的文件夹数', lambda: len(_snapshot.folders))
+registry.gauge('ria_indexed_images', '全局抽样索引中的图像数', lambda: _snapshot.index.total)
+
+
+def get_snapshot() -> CacheSnapshot:
+    """
+    获取当前缓存快照
+
+    Returns:
+        CacheSnapshot实例（只读）
+    """
+    return _snapshot
+
+
+def _publish(updates: Dict[str, Optional[FolderEntry]]) -> CacheSnapshot:
+    """
+    构建并发布新快照（调用方需持有 cache_lock）
+
+    Args:
+        updates: {文件夹名称: 新缓存项}，值为 None 表示移除
+
+    Returns:
+        新发布的快照
+    """
+    global _snapshot
+    _snapshot = _snapshot.replace(updates)
+    return _snapshot
+
+
+def _is_expired(entry: FolderEntry, current_time: float) -> bool:
+    """检查缓存项是否过期"""
+    return current_time - entry.timestamp > CACHE_TTL
+
+
 def init_folder_cache(image_base, folder, image_extensions):
     """
     初始化文件夹缓存：扫描并验证图像文件
@@ -31,28 +270,91 @@ def init_folder_cache(image_base, folder, image_extensions):
         image_extensions: 支持的图像扩展名列表
         
     Returns:
-        有效文件列表或None
+        有效文件列表（含文件大小和修改时间的 ScanEntry）或None
     """
     folder_path = get_safe_path(image_base, folder)
     try:
         if not folder_path or not os.path.isdir(folder_path):
             return None
 
-        valid_files = []
-        for f in os.listdir(folder_path):
-            file_path = get_safe_path(folder_path, f)
-            # 验证文件存在且是支持的图像格式
-            if file_path and os.path.isfile(file_path) and any(f.lower().endswith(ext) for ext in image_extensions):
-                valid_files.append(f)
-
-        # 返回排序后的文件列表（确保跨平台一致性）
-        return sorted(valid_files) or None
+        # 扫描器返回按名称排序的文件列表（确保跨平台一致性），同时记录大小和修改时间
+        start = time.perf_counter()
+        valid_files = scan_images(folder_path, image_extensions, with_stat=True)
+        FOLDER_SCAN_DURATION.observe(time.perf_counter() - start)
+        return valid_files or None
     except Exception as e:
         logger.error(f"初始化缓存失败: {str(e)}")
         return None
 
 
-def get_random_image(image_base: str, folder: str, image_extensions: set) -> Optional[str]:
+def load_folder(image_base: str, folder: str, image_extensions: set) -> Optional[FolderEntry]:
+    """
+    获取文件夹缓存项，未命中或过期时扫描磁盘并发布新快照
+
+    扫描在写锁之外进行，同一文件夹的并发未命中只扫描一次：
+    其他请求等待同一次扫描的结果（包括文件夹为空或不存在的结果），不会再次扫描。
+
+    Args:
+        image_base: 图像基础目录
+        folder: 文件夹名称
+        image_extensions: 支持的图像扩展名列表
+
+    Returns:
+        FolderEntry 或 None（无有效图像）
+    """
+    current_time = time.time()
+    entry = _snapshot.get(folder)
+    if entry is not None and not _is_expired(entry, current_time):
+        FOLDER_CACHE.inc(('hit',))
+        return entry
+
+    with cache_lock:
+        # 加锁后再检查一次：其他请求可能刚完成扫描并发布
+        entry = _snapshot.get(folder)
+        if entry is not None and not _is_expired(entry, time.time()):
+            FOLDER_CACHE.inc(('hit',))
+            return entry
+        future = _scanning.get(folder)
+        owner = future is None
+        if owner:
+            future = _scanning[folder] = Future()
+
+    if not owner:
+        # 等待进行中的扫描（主线程中让出 gevent 事件循环）
+        FOLDER_CACHE.inc(('hit',))
+        return wait_result(future)
+
+    try:
+        if entry is not None:
+            logger.info(f"缓存已过期，重新加载: {folder}")
+            FOLDER_CACHE.inc(('rescan',))
+        else:
+            FOLDER_CACHE.inc(('miss',))
+
+        images = init_folder_cache(image_base, folder, image_extensions)
+        if not images:
+            entry = None
+        elif entry is not None:
+            entry = entry.refreshed(images, time.time())
+        else:
+            entry = FolderEntry.from_scan(images, time.time())
+
+        with cache_lock:
+            _publish({folder: entry})
+            if _is_top_level(folder):
+                pending_folders.discard(folder)
+            del _scanning[folder]
+    except BaseException as e:
+        with cache_lock:
+            _scanning.pop(folder, None)
+        future.set_exception(e)
+        raise
+    future.set_result(entry)
+    return entry
+
+
+def get_random_image(image_base: str, folder: str, image_extensions: set,
+                     pick: Optional[Callable[[int], int]] = None) -> Optional[str]:
     """
     获取文件夹中的随机图像（真随机）
     
@@ -60,86 +362,253 @@ def get_random_image(image_base: str, folder: str, image_extensions: set) -> Opt
         image_base: 图像基础目录
         folder: 文件夹名称
         image_extensions: 支持的图像扩展名列表
+        pick: 根据图像数量选择下标的函数（如洗牌取图），默认每次独立随机
         
     Returns:
         随机图像文件名或None
     """
-    with cache_lock:  # 线程安全操作
-        current_time = time.time()
-        
-        # 检查缓存是否存在或已过期
-        if folder in folder_cache:
-            cache_entry = folder_cache[folder]
-            # 检查缓存是否过期
-            if current_time - cache_entry.get('timestamp', 0) > CACHE_TTL:
-                logger.info(f"缓存已过期，重新加载: {folder}")
-                del folder_cache[folder]
-        
-        # 如果缓存中没有该文件夹，初始化缓存
-        if folder not in folder_cache:
+    entry = load_folder(image_base, folder, image_extensions)
+    if entry is None:
+        return None  # 无有效图像
+
+    if pick is not None:
+        return entry.images[pick(len(entry.images))]
+
+    # 真随机：每次都随机选择一个图像
+    return random.choice(entry.images)
+
+
+def get_random_images(image_base: str, folder: str, image_extensions: set, count: int) -> List[str]:
+    """
+    从文件夹中不放回地随机选择多张图像
+
+    Args:
+        image_base: 图像基础目录
+        folder: 文件夹名称
+        image_extensions: 支持的图像扩展名列表
+        count: 选择数量（超过图像数时取图像数）
+
+    Returns:
+        互不相同的图像文件名列表
+    """
+    entry = load_folder(image_base, folder, image_extensions)
+    if entry is None:
+        return []
+
+    # random.sample 按下标抽取，不复制整个文件名序列
+    return random.sample(entry.images, min(count, len(entry.images)))
+
+
+def _refresh_global_index(image_base, image_extensions):
+    """
+    同步全局抽样索引
+
+    仅在首次使用、超过 CACHE_TTL 或有文件夹缓存失效时才访问磁盘，
+    且只扫描尚未缓存的文件夹；扫描在写锁之外进行。
+    同一时间只有一个请求执行同步，并发的请求等待其发布新快照后再抽样，
+    不会读到只完成了一半的索引。同步失败时待补扫的文件夹放回队列，
+    列举时间也不更新，下次请求会重试。
+
+    Args:
+        image_base: 图像基础目录
+        image_extensions: 支持的图像扩展名列表
+    """
+    global base_listed_at, _refreshing
+
+    current_time = time.time()
+    if not pending_folders and current_time - base_listed_at <= CACHE_TTL:
+        return
+
+    with cache_lock:
+        future = _refreshing
+        owner = future is None
+        if owner:
+            relist = current_time - base_listed_at > CACHE_TTL
+            to_scan = set(pending_folders)
+            pending_folders.clear()
+            future = _refreshing = Future()
+
+    if not owner:
+        # 等待进行中的同步（主线程中让出 gevent 事件循环）
+        wait_result(future)
+        return
+
+    try:
+        updates: Dict[str, Optional[FolderEntry]] = {}
+        if relist:
+            # 重新列出子文件夹，发现新增或删除的文件夹
+            subfolders = set(list_subfolders(image_base))
+            snapshot = _snapshot
+            for folder in snapshot.folders:
+                if _is_top_level(folder) and folder not in subfolders:
+                    updates[folder] = None
+            to_scan.update(d for d in subfolders if d not in snapshot.folders)
+
+        for folder in to_scan:
             images = init_folder_cache(image_base, folder, image_extensions)
-            if not images:
-                return None  # 无有效图像
-            # 存储图像列表到缓存（带时间戳）
-            folder_cache[folder] = {
-                'images': images,
-                'timestamp': current_time
-            }
-
-        cache = folder_cache[folder]
-        if not cache['images']:
-            del folder_cache[folder]  # 空列表则删除缓存项
-            return None
+            updates[folder] = FolderEntry.from_scan(images, time.time()) if images else None
 
-        # 真随机：每次都随机选择一个图像
-        return random.choice(cache['images'])
+        with cache_lock:
+            if updates:
+                _publish(updates)
+            if relist:
+                base_listed_at = current_time
+            _refreshing = None
+    except BaseException as e:
+        with cache_lock:
+            pending_folders.update(to_scan)
+            _refreshing = None
+        if not isinstance(e, Exception):
+            future.set_exception(e)
+            raise
+        # 磁盘访问失败时继续使用现有快照抽样
+        logger.error(f"同步全局索引失败: {str(e)}")
+    future.set_result(None)
 
 
-def get_random_image_from_all_folders(image_base, image_extensions):
+def get_random_image_from_all_folders(image_base, image_extensions, pick=None):
     """
-    从所有文件夹中随机选择一张图片
+    从所有文件夹中随机选择一张图片（所有图片等概率）
     
     Args:
         image_base: 图像基础目录
         image_extensions: 支持的图像扩展名列表
+        pick: 根据图片总数选择全局序号的函数（如洗牌取图），默认每次独立随机
         
     Returns:
         (文件夹名称, 图像文件名) 或 (None, None)
     """
+    _refresh_global_index(image_base, image_extensions)
+
+    # 读取当前快照并按前缀和抽样，O(log F)
+    snapshot = _snapshot
+    if pick is not None and snapshot.index.total:
+        folder, offset = snapshot.index.locate(pick(snapshot.index.total))
+    else:
+        folder, offset = snapshot.index.sample()
+    if folder is None:
+        logger.warning("没有找到任何图片")
+        return None, None
+
+    return folder, snapshot.folders[folder].images[offset]
+
+
+def get_random_images_from_all_folders(image_base, image_extensions, count):
+    """
+    从所有文件夹中不放回地随机选择多张图片（所有图片等概率）
+
+    Args:
+        image_base: 图像基础目录
+        image_extensions: 支持的图像扩展名列表
+        count: 选择数量（超过图片总数时取总数）
+
+    Returns:
+        互不相同的 (文件夹名称, 图像文件名) 列表
+    """
+    _refresh_global_index(image_base, image_extensions)
+
+    snapshot = _snapshot
+    return [(folder, snapshot.folders[folder].images[offset])
+            for folder, offset in snapshot.index.sample_many(count)]
+
+
+def seed_cache(folders: Dict[str, List[ScanEntry]], packed: Optional[PackedIndex] = None) -> int:
+    """
+    批量写入已知的文件夹图像列表（用于启动预热）
+
+    所有文件夹合并为一次快照发布，并视为刚完成一次 IMAGE_BASE 列举。
+
+    Args:
+        folders: {顶层文件夹名称: 按文件名排序的 ScanEntry 列表}
+        packed: 由相同数据生成的紧凑索引，提供时缓存项直接引用索引视图
+
+    Returns:
+        写入的文件夹数量
+    """
+    global base_listed_at
+
+    current_time = time.time()
+    updates = {}
+    for folder, entries in folders.items():
+        entry = FolderEntry.from_packed(packed, folder, current_time) if packed is not None else None
+        updates[folder] = entry or FolderEntry.from_scan(entries, current_time)
     with cache_lock:
-        # 获取所有子文件夹
-        try:
-            subfolders = [d for d in os.listdir(image_base)
-                         if os.path.isdir(get_safe_path(image_base, d))]
-        except Exception as e:
-            logger.error(f"获取子文件夹列表失败: {str(e)}")
-            return None, None
-        
-        if not subfolders:
-            logger.warning("没有找到任何子文件夹")
-            return None, None
-        
-        # 收集所有文件夹中的所有图片
-        all_images = []  # 格式: [(folder, image), ...]
-        
-        for folder in subfolders:
-            # 如果缓存中没有该文件夹，初始化缓存
-            if folder not in folder_cache:
-                images = init_folder_cache(image_base, folder, image_extensions)
-                if images:
-                    folder_cache[folder] = {'images': images}
-            
-            # 从缓存中获取图片列表
-            if folder in folder_cache and folder_cache[folder]['images']:
-                for image in folder_cache[folder]['images']:
-                    all_images.append((folder, image))
-        
-        if not all_images:
-            logger.warning("没有找到任何图片")
-            return None, None
-        
-        # 真随机：随机选择一张图片
-        return random.choice(all_images)
+        # 预热结果覆盖整个 IMAGE_BASE，未出现的顶层文件夹视为无图像
+        for folder in _snapshot.folders:
+            if _is_top_level(folder) and folder not in updates:
+                updates[folder] = None
+        _publish(updates)
+        pending_folders.difference_update(updates)
+        base_listed_at = current_time
+    return len(folders)
+
+
+def apply_folder_changes(changes: Dict[str, Dict[str, Optional[Tuple[int, int]]]]) -> int:
+    """
+    将文件增删改增量直接应用到缓存快照（无需重新扫描目录）
+
+    所有文件夹的变化合并为一次快照发布；发生变化的文件夹若引用紧凑索引，
+    会复制为普通的元组和字典（其他文件夹继续共享映射）；未缓存的文件夹不做处理，
+    首次访问时再扫描（顶层文件夹会加入 /random 的补扫队列）。
+
+    Args:
+        changes: {文件夹名称: {文件名: (文件大小, 修改时间纳秒)，文件已删除时为 None}}
+
+    Returns:
+        实际更新的文件夹数量
+    """
+    updates: Dict[str, Optional[FolderEntry]] = {}
+    with cache_lock:
+        snapshot = _snapshot
+        for folder, files in changes.items():
+            entry = snapshot.get(folder)
+            if entry is None:
+                if _is_top_level(folder) and any(st is not None for st in files.values()):
+                    pending_folders.add(folder)
+                continue
+
+            removed = {name for name, st in files.items() if st is None and name in entry.stats}
+            present = {name: st for name, st in files.items() if st is not None}
+            added = sorted(name for name in present if name not in entry.stats)
+            modified = [name for name, st in present.items() if name in entry.stats and entry.stats[name] != st]
+            if not added and not removed and not modified:
+                continue
+
+            # 紧凑索引的文件夹按顺序读取全部条目，避免对每个文件名二分查找
+            stats = dict(entry.stats.items())
+            for name in removed:
+                del stats[name]
+            stats.update(present)
+
+            if added or removed:
+                # 两个有序序列归并，保持文件列表排序
+                kept = (name for name in entry.images if name not in removed)
+                images = tuple(merge(kept, added))
+            else:
+                images = entry.images
+            updates[folder] = FolderEntry(images, entry.timestamp, stats) if images else None
+
+        if updates:
+            _publish(updates)
+            logger.info(f"已增量更新 {len(updates)} 个文件夹缓存")
+    return len(updates)
+
+
+def get_image_stat(folder: str, filename: str) -> Optional[Tuple[int, int]]:
+    """
+    从缓存快照中查询图像的大小和修改时间（不访问磁盘）
+
+    Args:
+        folder: 文件夹名称
+        filename: 图像文件名
+
+    Returns:
+        (文件大小, 修改时间纳秒) 或 None（未缓存）
+    """
+    entry = _snapshot.get(folder)
+    if entry is None:
+        return None
+    return entry.stats.get(filename)
 
 
 def invalidate_cache(folder: str) -> None:
@@ -150,9 +619,12 @@ def invalidate_cache(folder: str) -> None:
         folder: 文件夹名称
     """
     with cache_lock:
-        if folder in folder_cache:
+        if folder in _snapshot.folders:
             logger.info(f"使缓存失效: {folder}")
-            del folder_cache[folder]
+            _publish({folder: None})
+        # 下次 /random 时补扫
+        if _is_top_level(folder):
+            pending_folders.add(folder)
 
 
 def cleanup_expired_cache() -> int:
@@ -163,19 +635,14 @@ def cleanup_expired_cache() -> int:
         清理的缓存项数量
     """
     current_time = time.time()
-    expired_count = 0
     
     with cache_lock:
-        folders_to_remove = []
-        for folder, cache_entry in folder_cache.items():
-            if current_time - cache_entry.get('timestamp', 0) > CACHE_TTL:
-                folders_to_remove.append(folder)
-        
-        for folder in folders_to_remove:
-            del folder_cache[folder]
-            expired_count += 1
+        expired = [folder for folder, entry in _snapshot.folders.items()
+                   if _is_expired(entry, current_time)]
         
-        if expired_count > 0:
-            logger.info(f"已清理 {expired_count} 个过期缓存项")
+        if expired:
+            _publish({folder: None for folder in expired})
+            pending_folders.update(f for f in expired if _is_top_level(f))
+            logger.info(f"已清理 {len(expired)} 个过期缓存项")
     
-    return expired_count
\ No newline at end of file
+    return len(expired)
@@ -0,0 +1,405 @@
+"""
+磁盘缓存工具模块 - 提供按字节数限制的 LRU 磁盘缓存
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Set, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 源文件映射日志（缓存目录下，每行一个 JSON 数组 [缓存键, 源文件路径]）
+SOURCES_FILE = 'sources.log'
+
+# 映射日志中失效的行超过有效行数的两倍再加上此数量时，启动时压缩重写
+SOURCES_COMPACT_SLACK = 1000
+
+
+class DiskLRUCache:
+    """
+    按内容键存储的磁盘缓存
+
+    缓存文件以 `<key><suffix>` 的形式按键前两位分目录存放，
+    内存中维护一个 LRU 顺序表，总字节数超过上限时淘汰最久未使用的文件。
+    缓存项与源文件的对应关系追加写入映射日志，重启后仍可按源文件失效。
+
+    多个进程共享同一缓存目录时，各进程通过 sync 定期与目录同步，
+    按目录中全部文件的总字节数淘汰，所有进程共同遵守同一上限。
+    """
+
+    def __init__(self, directory: str, max_bytes: int, name: str = 'cache'):
+        """
+        初始化磁盘缓存
+
+        Args:
+            directory: 缓存目录
+            max_bytes: 缓存总字节数上限
+            name: 缓存名称（用于日志）
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.name = name
+        # 结构：{key: (文件路径, 字节数)}，按访问顺序排列
+        self._entries: 'OrderedDict[str, Tuple[str, int]]' = OrderedDict()
+        # 源文件到缓存键的映射（用于按源文件失效）
+        self._sources: Dict[str, Set[str]] = {}
+        self._key_sources: Dict[str, str] = {}
+        self._lock = Lock()
+        # 映射日志的读取位置及文件标识（日志被压缩重写后从头读取）
+        self._sources_path = os.path.join(self.directory, SOURCES_FILE)
+        self._sources_offset = 0
+        self._sources_file_id: Optional[Tuple[int, int]] = None
+        self._sync_lock = Lock()
+        self._closed = threading.Event()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load_existing()
+
+    @staticmethod
+    def make_key(file_path: str, stat_result: os.stat_result, *params) -> str:
+        """
+        根据源文件路径、修改时间、大小及附加参数生成缓存键
+
+        Args:
+            file_path: 源文件路径
+            stat_result: 源文件的 os.stat 结果
+            *params: 影响缓存内容的附加参数（如缩略图尺寸）
+
+        Returns:
+            十六进制缓存键
+        """
+        return DiskLRUCache.make_key_from(file_path, stat_result.st_size, stat_result.st_mtime_ns, *params)
+
+    @staticmethod
+    def make_key_from(file_path: str, size: int, mtime_ns: int, *params) -> str:
+        """
+        根据源文件路径、大小、修改时间（如来自文件夹索引）及附加参数生成缓存键
+
+        Args:
+            file_path: 源文件路径
+            size: 源文件大小
+            mtime_ns: 源文件修改时间（纳秒）
+            *params: 影响缓存内容的附加参数
+
+        Returns:
+            十六进制缓存键
+        """
+        raw = '|'.join([
+            os.path.abspath(file_path),
+            str(mtime_ns),
+            str(size),
+            repr(params),
+        ])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _scan_files(self) -> List[Tuple[float, str, str, int]]:
+        """
+        扫描缓存目录中的缓存文件
+
+        Returns:
+            按修改时间排序的 (修改时间, 缓存键, 文件路径, 字节数) 列表
+        """
+        found = []
+        os.makedirs(self.directory, exist_ok=True)
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_file() or entry.name.startswith('.'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # 扫描期间被其他进程淘汰
+                    continue
+                found.append((st.st_mtime, entry.name.split('.', 1)[0], entry.path, st.st_size))
+        found.sort()
+        return found
+
+    def _load_existing(self) -> None:
+        """扫描缓存目录，恢复上次运行留下的缓存文件（按修改时间排序）及其源文件映射"""
+        try:
+            found = self._scan_files()
+            sources = self._read_sources()
+        except OSError as e:
+            logger.error(f"加载{self.name}缓存目录失败: {str(e)}")
+            return
+
+        with self._lock:
+            for _, key, path, size in found:
+                self._entries[key] = (path, size)
+                self.total_bytes += size
+            for key, source in sources:
+                if key in self._entries:
+                    self._link_source_locked(key, source)
+            self._evict_locked()
+            linked = len(self._key_sources)
+
+        if found:
+            logger.info(f"已加载{self.name}缓存: {len(found)} 个文件, {self.total_bytes} 字节")
+        if len(sources) > 2 * linked + SOURCES_COMPACT_SLACK:
+            self._compact_sources()
+
+    def _read_sources(self) -> List[Tuple[str, str]]:
+        """
+        从上次读到的位置起读取映射日志（只处理完整的行，其他进程正在追加的行留到下次）
+
+        Returns:
+            (缓存键, 源文件路径) 列表
+        """
+        try:
+            with open(self._sources_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                file_id = (st.st_dev, st.st_ino)
+                if file_id != self._sources_file_id or st.st_size < self._sources_offset:
+                    # 日志已被压缩重写
+                    self._sources_file_id = file_id
+                    self._sources_offset = 0
+                f.seek(self._sources_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        end = data.rfind(b'\n') + 1
+        self._sources_offset += end
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                key, source = json.loads(line)
+            except (ValueError, TypeError):
+                continue
+            records.append((key, source))
+        return records
+
+    def _append_source(self, key: str, source: str) -> None:
+        """追加一条映射（单次 O_APPEND 写入，多个进程同时追加时各行保持完整）"""
+        line = (json.dumps([key, source]) + '\n').encode('utf-8')
+        try:
+            fd = os.open(self._sources_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.warning(f"写入{self.name}缓存映射日志失败: {str(e)}")
+
+    def _compact_sources(self) -> None:
+        """只保留仍在缓存中的映射，重写映射日志（重写期间其他进程追加的行可能丢失，只影响提前失效）"""
+        with self._lock:
+            lines = [json.dumps([key, source]) + '\n' for key, source in self._key_sources.items()]
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self._sources_path)
+        except OSError as e:
+            logger.warning(f"压缩{self.name}缓存映射日志失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def sync(self) -> None:
+        """
+        与缓存目录同步（多个进程共享缓存目录时定期调用）
+
+        其他进程新写入的文件加入 LRU 顺序表末尾（视为最近使用），已被其他进程删除的
+        文件从表中移除，并读取新增的源文件映射；之后按目录中全部文件的总字节数淘汰。
+        """
+        with self._sync_lock:
+            try:
+                found = self._scan_files()
+                sources = self._read_sources()
+            except OSError as e:
+                logger.error(f"同步{self.name}缓存目录失败: {str(e)}")
+                return
+
+        on_disk = {key: (path, size) for _, key, path, size in found}
+        with self._lock:
+            for key in [key for key in self._entries if key not in on_disk]:
+                # 扫描之后本进程新写入的文件仍保留
+                if not os.path.exists(self._entries[key][0]):
+                    self._forget_locked(key)
+            for key, (path, size) in on_disk.items():
+                if key not in self._entries:
+                    self._entries[key] = (path, size)
+                    self.total_bytes += size
+            for key, source in sources:
+                if key in self._entries:
+                    self._link_source_locked(key, source)
+            self._evict_locked()
+
+    def start_sync(self, interval: float) -> None:
+        """
+        启动后台线程，每隔 interval 秒调用一次 sync
+
+        Args:
+            interval: 同步间隔（秒）
+        """
+        def sync_loop():
+            while not self._closed.wait(interval):
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.error(f"同步{self.name}缓存目录失败: {str(e)}")
+
+        threading.Thread(target=sync_loop, name='disk-cache-sync', daemon=True).start()
+
+    def close(self) -> None:
+        """停止后台同步线程"""
+        self._closed.set()
+
+    def _path_for(self, key: str, suffix: str) -> str:
+        """返回缓存键对应的文件路径"""
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存文件路径或None（未命中）
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, data: bytes, suffix: str = '', source: Optional[str] = None) -> str:
+        """
+        写入缓存（先写临时文件再原子重命名）
+
+        Args:
+            key: 缓存键
+            data: 缓存内容
+            suffix: 缓存文件后缀（如 .jpeg）
+            source: 源文件路径（用于按源文件失效）
+
+        Returns:
+            缓存文件路径
+        """
+        path = self._path_for(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self._entries[key] = (path, len(data))
+            self.total_bytes += len(data)
+            if source:
+                source = os.path.abspath(source)
+                self._link_source_locked(key, source)
+            self._evict_locked()
+        if source:
+            self._append_source(key, source)
+        return path
+
+    def discard(self, key: str) -> None:
+        """
+        移除单个缓存项（如缓存文件已被外部删除）
+
+        Args:
+            key: 缓存键
+        """
+        with self._lock:
+            self._remove_locked(key)
+
+    def invalidate(self, source: str) -> int:
+        """
+        使某个源文件的所有缓存项失效
+
+        Args:
+            source: 源文件路径
+
+        Returns:
+            移除的缓存项数量
+        """
+        source = os.path.abspath(source)
+        with self._lock:
+            keys = self._sources.pop(source, set())
+            for key in keys:
+                self._key_sources.pop(key, None)
+                self._remove_locked(key)
+        if keys:
+            logger.debug(f"{self.name}缓存失效: {source} ({len(keys)} 项)")
+        return len(keys)
+
+    def _link_source_locked(self, key: str, source: str) -> None:
+        """记录缓存项对应的源文件（调用方需持有锁）"""
+        self._sources.setdefault(source, set()).add(key)
+        self._key_sources[key] = source
+
+    def _forget_locked(self, key: str) -> Optional[str]:
+        """
+        从表中移除缓存项，不删除文件（调用方需持有锁）
+
+        Returns:
+            缓存文件路径，未缓存时返回 None
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.total_bytes -= entry[1]
+        source = self._key_sources.pop(key, None)
+        if source and source in self._sources:
+            self._sources[source].discard(key)
+            if not self._sources[source]:
+                del self._sources[source]
+        return entry[0]
+
+    def _remove_locked(self, key: str) -> None:
+        """移除缓存项并删除文件（调用方需持有锁）"""
+        path = self._forget_locked(key)
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict_locked(self) -> None:
+        """淘汰最久未使用的缓存项直到总字节数不超过上限（调用方需持有锁）"""
+        while self.total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove_locked(key)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            包含命中、未命中、淘汰次数及容量信息的字典
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -2,29 +2,84 @@
 文件监控相关工具模块
 """
 import os
+import stat
+import time
 import logging
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from .cache import invalidate_cache
+from .cache import invalidate_cache, apply_folder_changes
+from .image_utils import invalidate_derived_images
+from .home_cache import mark_home_dirty
+from .scanner import is_image_name
+from .metrics import MONITOR_EVENTS, MONITOR_FILES
 
 # 配置日志
 logger = logging.getLogger(__name__)
 logger.propagate = True  # 允许日志传播到根记录器，但不添加额外的处理器
 
+def apply_monitor_event(event):
+    """
+    在当前进程中应用一条文件监控事件
+    
+    事件由 FolderChangeHandler 产生，均为可序列化的元组，
+    多进程模式下由主进程通过管道广播给各工作进程：
+    
+    - ('files', {文件夹: {文件名: (大小, 修改时间纳秒) 或 None}})：增量更新文件夹缓存
+    - ('folder', 文件夹或None)：文件夹整体失效
+    - ('derived', [原图路径, ...])：这些原图的缩略图、变体等生成物失效
+    - ('home', None)：主页文件夹列表变化
+    
+    Args:
+        event: (事件类型, 数据)
+    """
+    kind, data = event
+    MONITOR_EVENTS.inc((kind,))
+    if kind == 'files':
+        MONITOR_FILES.inc(amount=sum(len(files) for files in data.values()))
+        apply_folder_changes(data)
+        mark_home_dirty()
+    elif kind == 'folder':
+        if data is not None:
+            invalidate_cache(data)
+        mark_home_dirty()
+    elif kind == 'derived':
+        for path in data:
+            invalidate_derived_images(path)
+    elif kind == 'home':
+        mark_home_dirty()
+    else:
+        logger.warning(f"未知的文件监控事件: {kind}")
+
+
 class FolderChangeHandler(FileSystemEventHandler):
     """
     增强的文件系统事件处理器：处理文件创建、删除、修改和移动事件
     """
-    def __init__(self, image_base, image_extensions):
+    def __init__(self, image_base, image_extensions, debounce=0.5, max_delay=5.0, sink=None):
         """
         初始化处理器
         
         Args:
             image_base: 图像基础目录
             image_extensions: 支持的图片扩展名集合
+            debounce: 事件静默多久后提交变化（秒）
+            max_delay: 持续有事件时最长延迟多久提交（秒）
+            sink: 事件接收函数，默认在当前进程中应用（apply_monitor_event）
         """
         self.image_base = os.path.abspath(image_base)
         self.image_extensions = image_extensions
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.sink = sink or apply_monitor_event
+        # 待提交的变化：{文件夹相对路径: {文件名: 生成物是否需要失效}}，同一文件的多次事件只保留一项
+        self._pending = {}
+        self._first_event_at = 0.0
+        self._last_event_at = 0.0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._flush_thread = threading.Thread(target=self._flush_loop, name='file-monitor-flush', daemon=True)
+        self._flush_thread.start()
         super().__init__()
 
     def _is_image_file(self, file_path):
@@ -37,7 +92,14 @@ class FolderChangeHandler(FileSystemEventHandler):
         Returns:
             是否为图片文件
         """
-        return any(file_path.lower().endswith(ext) for ext in self.image_extensions)
+        return is_image_name(file_path, self.image_extensions)
+
+    def _emit(self, kind, data=None):
+        """将事件交给接收函数"""
+        try:
+            self.sink((kind, data))
+        except Exception as e:
+            logger.error(f"处理文件监控事件时出错: {kind}, 错误: {str(e)}")
 
     def on_deleted(self, event):
         """
@@ -45,7 +107,10 @@ class FolderChangeHandler(FileSystemEventHandler):
         """
         if not event.is_directory:
             if self._is_image_file(event.src_path):
-                self._handle_file_event(os.path.dirname(event.src_path))
+                self._handle_file_event(event.src_path, derived=True)
+        else:
+            # 文件夹被删除时整体失效
+            self._handle_folder_event(event.src_path)
 
     def on_created(self, event):
         """
@@ -53,7 +118,10 @@ class FolderChangeHandler(FileSystemEventHandler):
         """
         if not event.is_directory:
             if self._is_image_file(event.src_path):
-                self._handle_file_event(os.path.dirname(event.src_path))
+                self._handle_file_event(event.src_path)
+        else:
+            # 文件夹增删影响主页的文件夹列表
+            self._emit('home')
 
     def on_modified(self, event):
         """
@@ -61,7 +129,7 @@ class FolderChangeHandler(FileSystemEventHandler):
         """
         if not event.is_directory:
             if self._is_image_file(event.src_path):
-                self._handle_file_event(os.path.dirname(event.src_path))
+                self._handle_file_event(event.src_path, derived=True)
 
     def on_moved(self, event):
         """
@@ -70,47 +138,166 @@ class FolderChangeHandler(FileSystemEventHandler):
         if not event.is_directory:
             # 源文件或目标文件是图片文件时才处理
             if self._is_image_file(event.src_path):
-                self._handle_file_event(os.path.dirname(event.src_path))
+                self._handle_file_event(event.src_path, derived=True)
             if self._is_image_file(event.dest_path):
-                self._handle_file_event(os.path.dirname(event.dest_path))
+                self._handle_file_event(event.dest_path, derived=True)
+        else:
+            # 文件夹被移动时新旧路径都整体失效
+            self._handle_folder_event(event.src_path)
+            self._handle_folder_event(event.dest_path)
 
-    def _handle_file_event(self, folder_path):
+    def _get_rel_folder(self, folder_path):
         """
-        处理文件事件：使父目录缓存失效
+        获取相对于IMAGE_BASE的文件夹路径
         
         Args:
             folder_path: 文件夹路径
+            
+        Returns:
+            相对路径，根目录或无效路径时返回None
+        """
+        folder_path = os.path.abspath(folder_path)
+        
+        # 如果文件夹路径就是 image_base 本身，跳过处理
+        if folder_path == self.image_base:
+            logger.debug(f"跳过根目录的文件事件: {folder_path}")
+            return None
+        
+        rel_path = os.path.relpath(folder_path, self.image_base)
+        
+        # 如果 rel_path 是 '.' 或位于 image_base 之外，说明有问题，跳过
+        if rel_path == '.' or rel_path.startswith('..'):
+            logger.debug(f"跳过无效的相对路径: {folder_path}")
+            return None
+        return rel_path
+
+    def _handle_file_event(self, file_path, derived=False):
+        """
+        处理文件事件：记录变化，由后台线程合并后增量更新缓存
+        
+        Args:
+            file_path: 发生变化的图片文件路径
+            derived: 原图的生成物（缩略图、变体等）是否需要失效（删除、修改、移动时）
         """
         try:
-            folder_path = os.path.abspath(folder_path)
-            
-            # 如果文件夹路径就是 image_base 本身，跳过处理
-            if folder_path == self.image_base:
-                logger.debug(f"跳过根目录的缓存失效: {folder_path}")
+            rel_path = self._get_rel_folder(os.path.dirname(file_path))
+            if rel_path is None:
                 return
             
-            # 获取相对于IMAGE_BASE的文件夹路径
-            rel_path = os.path.relpath(folder_path, self.image_base)
+            now = time.monotonic()
+            with self._cond:
+                if not self._pending:
+                    self._first_event_at = now
+                self._last_event_at = now
+                names = self._pending.setdefault(rel_path, {})
+                name = os.path.basename(file_path)
+                names[name] = names.get(name, False) or derived
+                self._cond.notify()
+        except Exception as e:
+            logger.error(f"处理文件事件时出错: {str(e)}")
+
+    def _handle_folder_event(self, folder_path):
+        """
+        处理文件夹事件：使该文件夹缓存整体失效
+        
+        Args:
+            folder_path: 发生变化的文件夹路径
+        """
+        try:
+            rel_path = self._get_rel_folder(folder_path)
+            if rel_path is not None:
+                logger.info(f"检测到文件夹变化，使缓存失效: {rel_path}")
+                rel_path = rel_path.replace(os.sep, '/')
+            self._emit('folder', rel_path)
+        except Exception as e:
+            logger.error(f"处理文件夹事件时出错: {str(e)}")
+
+    def _flush_loop(self):
+        """
+        后台提交线程：事件静默 debounce 秒或累计 max_delay 秒后批量提交
+        """
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                
+                # 等待事件静默，但不超过最长延迟
+                while True:
+                    deadline = min(self._last_event_at + self.debounce,
+                                   self._first_event_at + self.max_delay)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self._stopped:
+                        break
+                    self._cond.wait(remaining)
+                
+                batch = self._pending
+                self._pending = {}
             
-            # 如果 rel_path 是 '.'，说明有问题，跳过
-            if rel_path == '.':
-                logger.debug(f"跳过无效的相对路径: {folder_path}")
-                return
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """
+        提交一批合并后的变化
+        
+        每个文件只 stat 一次，因此同一文件的创建、修改、删除事件
+        无论顺序如何都以磁盘最终状态为准；需要失效的生成物也合并为一个事件，
+        复制一个文件产生的多次修改事件只失效一次。
+        
+        Args:
+            batch: {文件夹相对路径: {文件名: 生成物是否需要失效}}
+        """
+        try:
+            changes = {}
+            derived = []
+            for rel_path, names in batch.items():
+                folder_path = os.path.join(self.image_base, rel_path)
+                changes[rel_path.replace(os.sep, '/')] = {
+                    name: self._stat_file(os.path.join(folder_path, name)) for name in names
+                }
+                derived.extend(os.path.join(folder_path, name) for name, flag in names.items() if flag)
             
-            # 使缓存失效
-            logger.info(f"检测到文件变化，使缓存失效: {rel_path}")
-            invalidate_cache(rel_path)
+            file_count = sum(len(names) for names in batch.values())
+            logger.info(f"检测到文件变化: {len(batch)} 个文件夹, {file_count} 个文件")
+            if derived:
+                self._emit('derived', derived)
+            self._emit('files', changes)
         except Exception as e:
-            logger.error(f"处理文件事件时出错: {str(e)}")
+            logger.error(f"提交文件变化时出错: {str(e)}")
 
+    @staticmethod
+    def _stat_file(file_path):
+        """
+        获取文件大小和修改时间
+        
+        Returns:
+            (文件大小, 修改时间纳秒)，文件不存在或不是普通文件时返回None
+        """
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return st.st_size, st.st_mtime_ns
 
-def setup_file_monitor(image_base, image_extensions=None):
+    def stop(self):
+        """停止后台提交线程"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+def setup_file_monitor(image_base, image_extensions=None, debounce=0.5, max_delay=5.0, sink=None):
     """
     设置文件监控
     
     Args:
         image_base: 图像基础目录
         image_extensions: 支持的图片扩展名集合，默认为常见图片格式
+        debounce: 事件静默多久后提交变化（秒）
+        max_delay: 持续有事件时最长延迟多久提交（秒）
+        sink: 事件接收函数，默认在当前进程中应用
         
     Returns:
         Observer实例
@@ -122,11 +309,13 @@ def setup_file_monitor(image_base, image_extensions=None):
     # 创建文件系统观察者
     observer = Observer()
     # 安排事件处理器监视IMAGE_BASE目录（递归监视）
+    handler = FolderChangeHandler(image_base, image_extensions, debounce, max_delay, sink)
     observer.schedule(
-        FolderChangeHandler(image_base, image_extensions), 
+        handler, 
         image_base, 
         recursive=True
     )
+    observer.handler = handler
     
     try:
         observer.start()
@@ -134,4 +323,31 @@ def setup_file_monitor(image_base, image_extensions=None):
     except Exception as e:
         logger.error(f"启动文件监控失败: {str(e)}")
     
-    return observer
\ No newline at end of file
+    return observer
+
+def attach_event_stream(conn):
+    """
+    从管道接收主进程广播的文件监控事件并在当前进程中应用（多进程模式的工作进程使用）
+    
+    Args:
+        conn: multiprocessing Connection（只读端）
+        
+    Returns:
+        接收线程
+    """
+    def receive_loop():
+        while True:
+            try:
+                event = conn.recv()
+            except (EOFError, OSError):
+                # 主进程已退出或管道已关闭
+                logger.info("文件监控事件管道已关闭")
+                return
+            try:
+                apply_monitor_event(event)
+            except Exception as e:
+                logger.error(f"应用文件监控事件时出错: {str(e)}")
+    
+    thread = threading.Thread(target=receive_loop, name='file-monitor-receiver', daemon=True)
+    thread.start()
+    return thread
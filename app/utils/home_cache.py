@@ -0,0 +1,191 @@
+"""
+主页缓存工具模块 - 缓存主页的文件夹列表与预览图，并在后台重建
+"""
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+from .image_utils import get_folder_preview
+from .render_pool import wait_result
+from .scanner import list_subfolders
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class HomePageCache:
+    """
+    主页预览集合缓存
+
+    请求只读取内存中已构建好的预览集合；文件变化或轮换间隔到期后，
+    由后台线程重新生成，期间继续返回旧数据。
+    """
+
+    def __init__(self, image_base, thumbnail_size, image_extensions, rotate_interval):
+        """
+        初始化主页缓存
+
+        Args:
+            image_base: 图像基础目录
+            thumbnail_size: 缩略图尺寸
+            image_extensions: 支持的图像扩展名集合
+            rotate_interval: 预览图轮换间隔（秒），0 表示只在文件变化时重建
+        """
+        self.image_base = image_base
+        self.thumbnail_size = thumbnail_size
+        self.image_extensions = image_extensions
+        self.rotate_interval = rotate_interval
+        # 当前预览集合：(版本号, 子文件夹列表, {文件夹: 预览数据})
+        # 版本号每次重建递增，用于判断渲染结果是否过期
+        self._data: Optional[Tuple[int, List[str], Dict[str, dict]]] = None
+        self._version = 0
+        self._built_at = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        # 首次构建（并发的首次请求等待同一次构建）
+        self._initial: Optional[Future] = None
+        # 渲染结果缓存：(版本号, HTML)
+        self.rendered: Optional[Tuple[int, str]] = None
+
+    def build(self) -> Tuple[List[str], Dict[str, dict]]:
+        """
+        扫描所有文件夹并生成预览集合
+
+        Returns:
+            (子文件夹列表, {文件夹: 预览数据})
+        """
+        start = time.time()
+        subfolders = list_subfolders(self.image_base)
+
+        folder_previews = {}
+        for folder in subfolders:
+            preview = get_folder_preview(
+                self.image_base,
+                folder,
+                self.thumbnail_size,
+                self.image_extensions
+            )
+            if preview:
+                folder_previews[folder] = preview
+
+        logger.info(f"主页预览已重建: {len(subfolders)} 个文件夹, 耗时 {time.time() - start:.2f}秒")
+        return subfolders, folder_previews
+
+    def _publish(self, data) -> None:
+        """发布新的预览集合（调用方需持有锁）"""
+        self._version += 1
+        self._data = (self._version,) + data
+        self._built_at = time.time()
+
+    def _rebuild_in_background(self) -> None:
+        """后台重建线程主体"""
+        try:
+            while True:
+                with self._lock:
+                    self._dirty = False
+                data = self.build()
+                with self._lock:
+                    self._publish(data)
+                    # 重建期间再次收到变化通知则继续重建
+                    if not self._dirty:
+                        self._rebuilding = False
+                        return
+        except Exception as e:
+            logger.error(f"后台重建主页预览失败: {str(e)}")
+            with self._lock:
+                self._rebuilding = False
+
+    def _is_stale(self) -> bool:
+        """检查预览集合是否需要重建（调用方需持有锁）"""
+        if self._dirty:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._built_at > self.rotate_interval
+
+    def get(self) -> Tuple[int, List[str], Dict[str, dict]]:
+        """
+        获取主页预览集合
+
+        首次调用时同步构建（构建期间不持有锁：生成缩略图时会让出 gevent 事件循环，
+        同一线程中的其他请求再获取锁会阻塞整个服务器），并发的首次请求等待同一次构建；
+        之后过期时触发后台重建并立即返回当前数据。
+
+        Returns:
+            (版本号, 子文件夹列表, {文件夹: 预览数据})
+        """
+        if self._data is None:
+            with self._lock:
+                future = self._initial
+                owner = future is None and self._data is None
+                if owner:
+                    future = self._initial = Future()
+                    self._dirty = False
+            if owner:
+                try:
+                    data = self.build()
+                except Exception as e:
+                    with self._lock:
+                        self._initial = None
+                    future.set_exception(e)
+                    raise
+                with self._lock:
+                    self._publish(data)
+                future.set_result(None)
+            elif future is not None:
+                wait_result(future)
+            return self._data
+
+        with self._lock:
+            if self._is_stale() and not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild_in_background,
+                                 name='home-cache-rebuild', daemon=True).start()
+            return self._data
+
+    def mark_dirty(self) -> None:
+        """标记预览集合需要重建（由文件监控调用）"""
+        with self._lock:
+            self._dirty = True
+
+
+# 主页缓存实例（由 setup_home_cache 在应用启动时初始化）
+home_cache: Optional[HomePageCache] = None
+
+
+def setup_home_cache(image_base, thumbnail_size, image_extensions, rotate_interval):
+    """
+    初始化主页缓存
+
+    Args:
+        image_base: 图像基础目录
+        thumbnail_size: 缩略图尺寸
+        image_extensions: 支持的图像扩展名集合
+        rotate_interval: 预览图轮换间隔（秒）
+
+    Returns:
+        HomePageCache实例
+    """
+    global home_cache
+    home_cache = HomePageCache(image_base, thumbnail_size, image_extensions, rotate_interval)
+    return home_cache
+
+
+def get_home_cache() -> HomePageCache:
+    """
+    获取主页缓存实例（未初始化时按默认配置创建）
+
+    Returns:
+        HomePageCache实例
+    """
+    if home_cache is None:
+        from ..config.config import Config
+        return setup_home_cache(Config.IMAGE_BASE, Config.THUMBNAIL_SIZE,
+                                Config.IMAGE_EXTENSIONS, Config.HOME_ROTATE_INTERVAL)
+    return home_cache
+
+
+def mark_home_dirty() -> None:
+    """通知主页缓存文件已变化"""
+    if home_cache is not None:
+        home_cache.mark_dirty()
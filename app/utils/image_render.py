@@ -0,0 +1,124 @@
+"""
+图像渲染模块 - 纯 Pillow 的解码、缩放与编码函数
+
+这些函数在图像处理进程池的子进程中执行，只依赖 Pillow 和标准库，
+参数和返回值均可序列化（路径、尺寸、字节）。
+"""
+from io import BytesIO
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# 缩略图可直接保存的格式，其余格式统一转为 JPEG
+THUMBNAIL_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+
+def render_thumbnail(file_path, thumbnail_size):
+    """
+    解码原图并生成缩略图
+
+    Args:
+        file_path: 原图路径
+        thumbnail_size: 缩略图尺寸
+
+    Returns:
+        (缩略图字节, 图像格式)
+    """
+    with Image.open(file_path) as img:
+        img_format = img.format if img.format in THUMBNAIL_FORMATS else 'JPEG'
+        img.thumbnail(thumbnail_size)
+        if img_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        buffer = BytesIO()
+        img.save(buffer, format=img_format)
+    return buffer.getvalue(), img_format
+
+
+def render_variant(file_path, img_format, quality):
+    """
+    将原图重新编码为指定格式（如 WEBP、AVIF）
+
+    Args:
+        file_path: 原图路径
+        img_format: 目标格式
+        quality: 编码质量（1-100）
+
+    Returns:
+        编码后的字节
+    """
+    with Image.open(file_path) as img:
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        buffer = BytesIO()
+        img.save(buffer, format=img_format, quality=quality)
+    return buffer.getvalue()
+
+
+def render_resized(file_path, width, height, fit):
+    """
+    解码原图并缩放（不放大）
+
+    Args:
+        file_path: 原图路径
+        width: 目标宽度，0 表示按高度等比缩放
+        height: 目标高度，0 表示按宽度等比缩放
+        fit: 缩放方式（contain / cover）
+
+    Returns:
+        (缩放图字节, 图像格式)
+    """
+    with Image.open(file_path) as img:
+        img_format = img.format if img.format in THUMBNAIL_FORMATS else 'JPEG'
+        if fit == 'cover' and width and height:
+            # 裁剪框不超过原图，避免放大
+            scale = min(1.0, img.width / width, img.height / height)
+            box = (max(1, int(width * scale)), max(1, int(height * scale)))
+            img = ImageOps.fit(img, box, Image.LANCZOS)
+        else:
+            img.thumbnail((width or img.width, height or img.height), Image.LANCZOS)
+        if img_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        buffer = BytesIO()
+        if img_format in ('JPEG', 'WEBP'):
+            img.save(buffer, format=img_format, quality=85)
+        else:
+            img.save(buffer, format=img_format)
+    return buffer.getvalue(), img_format
+
+
+def verify_image(file_path):
+    """
+    校验文件是否为 Pillow 可识别的完整图像（批量导入时使用）
+
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        错误信息，有效图像返回 None
+    """
+    try:
+        with Image.open(file_path) as img:
+            img.verify()
+    except UnidentifiedImageError:
+        return '无法识别的图像格式'
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+def read_dimensions(file_path):
+    """
+    读取图像的显示尺寸（只解析文件头，不解码像素；EXIF 方向为旋转 90° 时交换宽高）
+
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        (宽度, 高度)，无法识别时返回 None
+    """
+    try:
+        with Image.open(file_path) as img:
+            width, height = img.size
+            if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                width, height = height, width
+    except Exception:
+        return None
+    return width, height
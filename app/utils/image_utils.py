@@ -4,14 +4,294 @@
 import os
 import base64
 import random
-from io import BytesIO
-from PIL import Image
+import mimetypes
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
 import logging
 from .security import get_safe_path
+from .disk_cache import DiskLRUCache
+from .cache import load_folder
+from .image_render import render_thumbnail, render_resized, read_dimensions
+from .render_pool import RenderBusyError, run_render, wait_result
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 缩略图磁盘缓存（由 setup_thumbnail_cache 在应用启动时初始化）
+thumbnail_cache: Optional[DiskLRUCache] = None
+
+# 所有由原图生成的磁盘缓存（原图变化时统一失效）
+_derived_caches: List[DiskLRUCache] = []
+
+# 缩放图磁盘缓存（由 setup_resize_cache 在应用启动时初始化）
+resize_cache: Optional[DiskLRUCache] = None
+
+# 正在生成的缩放图和缩略图（同一缓存键的并发请求只生成一次）
+_render_lock = threading.Lock()
+_in_flight: Dict[str, Future] = {}
+
+# 支持的缩放方式：contain（等比缩放至框内）、cover（等比缩放并居中裁剪填满）
+RESIZE_FITS = ('contain', 'cover')
+
+# 可以缩放的原图后缀（GIF 可能是动图，缩放会丢失动画）
+RESIZE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp')
+
+# 图像尺寸缓存：{(路径, 文件大小, 修改时间纳秒): (宽度, 高度)}，条目数上限 DIMENSIONS_CACHE_SIZE
+DIMENSIONS_CACHE_SIZE = 50000
+_dimensions: 'OrderedDict[Tuple[str, int, int], Optional[Tuple[int, int]]]' = OrderedDict()
+_dimensions_lock = threading.Lock()
+
+
+def setup_thumbnail_cache(cache_dir, max_bytes):
+    """
+    初始化缩略图磁盘缓存
+
+    Args:
+        cache_dir: 缓存根目录
+        max_bytes: 缩略图缓存字节数上限
+
+    Returns:
+        DiskLRUCache实例
+    """
+    global thumbnail_cache
+    if thumbnail_cache is not None:
+        unregister_derived_cache(thumbnail_cache)
+    thumbnail_cache = DiskLRUCache(os.path.join(cache_dir, 'thumbnails'), max_bytes, name='缩略图')
+    register_derived_cache(thumbnail_cache)
+    return thumbnail_cache
+
+
+def register_derived_cache(cache):
+    """
+    注册由原图生成的磁盘缓存，原图变化时由 invalidate_derived_images 统一失效
+
+    Args:
+        cache: DiskLRUCache实例
+    """
+    if cache not in _derived_caches:
+        _derived_caches.append(cache)
+
+
+def unregister_derived_cache(cache):
+    """
+    取消注册磁盘缓存
+
+    Args:
+        cache: DiskLRUCache实例
+    """
+    if cache in _derived_caches:
+        _derived_caches.remove(cache)
+        cache.close()
+
+
+def start_cache_sync(interval):
+    """
+    为所有由原图生成的磁盘缓存启动后台目录同步（多进程共享缓存目录时使用）
+
+    Args:
+        interval: 同步间隔（秒）
+    """
+    for cache in _derived_caches:
+        cache.start_sync(interval)
+
+
+def setup_resize_cache(cache_dir, max_bytes):
+    """
+    初始化缩放图磁盘缓存
+
+    Args:
+        cache_dir: 缓存根目录
+        max_bytes: 缩放图缓存字节数上限
+
+    Returns:
+        DiskLRUCache实例
+    """
+    global resize_cache
+    if resize_cache is not None:
+        unregister_derived_cache(resize_cache)
+    resize_cache = DiskLRUCache(os.path.join(cache_dir, 'resized'), max_bytes, name='缩放图')
+    register_derived_cache(resize_cache)
+    return resize_cache
+
+
+def _get_thumbnail_cache():
+    """获取缩略图缓存（未初始化时使用默认配置）"""
+    if thumbnail_cache is None:
+        return setup_thumbnail_cache(os.environ.get('CACHE_DIR', 'cache'), 256 * 1024 * 1024)
+    return thumbnail_cache
+
+
+def snap_size(value, sizes: Sequence[int]) -> int:
+    """
+    将请求的尺寸向上取整到白名单中的尺寸（超过最大值时取最大值）
+
+    Args:
+        value: 请求的尺寸（正整数）
+        sizes: 升序排列的尺寸白名单
+
+    Returns:
+        白名单中的尺寸
+    """
+    for size in sizes:
+        if size >= value:
+            return size
+    return sizes[-1]
+
+
+def _render_to_cache(cache, key, description, render, file_path, *args) -> Optional[str]:
+    """
+    生成图像并写入磁盘缓存（同一缓存键的并发请求只生成一次，其他请求等待同一结果）
+
+    Args:
+        cache: 写入的磁盘缓存
+        key: 缓存键
+        description: 日志中的生成物描述（如"缩放图"）
+        render: image_render 模块中返回 (图像数据, 格式) 的渲染函数
+        file_path: 原图路径
+        *args: 渲染函数的其他参数
+
+    Returns:
+        缓存文件路径，生成失败时返回 None
+
+    Raises:
+        RenderBusyError: 图像处理队列已满或超时
+    """
+    with _render_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _in_flight[key] = future
+    if owner:
+        try:
+            data, img_format = run_render(render, file_path, *args)
+            future.set_result(cache.put(key, data, suffix='.' + img_format.lower(), source=file_path))
+        except RenderBusyError as e:
+            future.set_exception(e)
+        except Exception as e:
+            logger.error(f"生成{description}失败: {file_path}, 错误: {str(e)}")
+            future.set_result(None)
+        finally:
+            with _render_lock:
+                _in_flight.pop(key, None)
+    return wait_result(future)
+
+
+def get_resized(file_path, stat, width, height, fit) -> Optional[Tuple[str, str]]:
+    """
+    获取缩放图（优先从磁盘缓存读取，未命中时在图像处理进程池中生成）
+
+    Args:
+        file_path: 原图路径
+        stat: 原图的 (文件大小, 修改时间纳秒)
+        width: 目标宽度（已对齐白名单），0 表示不限
+        height: 目标高度（已对齐白名单），0 表示不限
+        fit: 缩放方式
+
+    Returns:
+        (缩放图文件路径, MIME类型) 或 None
+
+    Raises:
+        RenderBusyError: 图像处理队列已满或超时
+    """
+    cache = resize_cache
+    if cache is None:
+        return None
+
+    key = DiskLRUCache.make_key_from(file_path, stat[0], stat[1], 'resize', width, height, fit)
+    cached_path = cache.get(key)
+    if cached_path is not None and not os.path.isfile(cached_path):
+        # 缓存文件已被外部删除
+        cache.discard(key)
+        cached_path = None
+
+    if cached_path is None:
+        cached_path = _render_to_cache(cache, key, f'缩放图 ({width}x{height} {fit})',
+                                       render_resized, file_path, width, height, fit)
+        if cached_path is None:
+            return None
+
+    mimetype = mimetypes.guess_type(cached_path)[0] or 'image/jpeg'
+    return cached_path, mimetype
+
+
+def get_thumbnail(file_path, thumbnail_size) -> Optional[Tuple[str, str]]:
+    """
+    获取图像缩略图（优先从磁盘缓存读取）
+
+    缓存键由 (路径, 修改时间, 大小, 缩略图尺寸) 组成，原图变化后自动失效。
+
+    Args:
+        file_path: 原图路径
+        thumbnail_size: 缩略图尺寸
+
+    Returns:
+        (缩略图文件路径, MIME类型) 或 None
+
+    Raises:
+        RenderBusyError: 图像处理队列已满或超时
+    """
+    cache = _get_thumbnail_cache()
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+
+    key = DiskLRUCache.make_key(file_path, st, tuple(thumbnail_size))
+    cached_path = cache.get(key)
+    if cached_path is None or not os.path.isfile(cached_path):
+        if cached_path is not None:
+            # 缓存文件已被外部删除
+            cache.discard(key)
+        # 同一缩略图的并发请求（如浏览页首次加载）只生成一次
+        cached_path = _render_to_cache(cache, key, '缩略图', render_thumbnail, file_path, thumbnail_size)
+        if cached_path is None:
+            return None
+
+    mimetype = mimetypes.guess_type(cached_path)[0] or 'image/jpeg'
+    return cached_path, mimetype
+
+
+def invalidate_derived_images(file_path):
+    """
+    使某个原图的所有生成物（缩略图、格式变体等）缓存失效
+
+    Args:
+        file_path: 原图路径
+    """
+    for cache in list(_derived_caches):
+        cache.invalidate(file_path)
+
+
+def get_image_dimensions(file_path, stat) -> Optional[Tuple[int, int]]:
+    """
+    获取图像的显示尺寸（结果按文件大小和修改时间缓存，原图变化后自动重新读取）
+
+    只解析文件头，开销很小，直接在请求线程中执行。
+
+    Args:
+        file_path: 原图路径
+        stat: 原图的 (文件大小, 修改时间纳秒)
+
+    Returns:
+        (宽度, 高度)，无法识别时返回 None
+    """
+    key = (file_path, stat[0], stat[1])
+    with _dimensions_lock:
+        if key in _dimensions:
+            _dimensions.move_to_end(key)
+            return _dimensions[key]
+
+    dimensions = read_dimensions(file_path)
+    with _dimensions_lock:
+        _dimensions[key] = dimensions
+        while len(_dimensions) > DIMENSIONS_CACHE_SIZE:
+            _dimensions.popitem(last=False)
+    return dimensions
+
+
 def get_folder_preview(image_base, folder, thumbnail_size, image_extensions):
     """
     获取文件夹的预览图像
@@ -29,34 +309,39 @@ def get_folder_preview(image_base, folder, thumbnail_size, image_extensions):
     if not folder_path or not os.path.isdir(folder_path):
         return None
     
-    # 获取文件夹中的所有图像
-    images = []
-    for f in os.listdir(folder_path):
-        file_path = get_safe_path(folder_path, f)
-        if file_path and os.path.isfile(file_path) and any(f.lower().endswith(ext) for ext in image_extensions):
-            images.append(f)
-    
-    if not images:
+    # 从共享的文件夹索引获取所有图像
+    entry = load_folder(image_base, folder, image_extensions)
+    if not entry:
         return None
+    images = entry.images
     
     # 随机选择一张图片作为预览
     preview_image = random.choice(images)
     preview_path = get_safe_path(folder_path, preview_image)
     
-    try:
-        # 创建缩略图
-        img = Image.open(preview_path)
-        img.thumbnail(thumbnail_size)
-        
-        # 转换为base64
-        buffer = BytesIO()
-        img.save(buffer, format=img.format or 'JPEG')
-        img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    # 缓存文件可能在返回路径之后被其他进程淘汰，此时重新获取一次
+    for _ in range(2):
+        try:
+            thumbnail = get_thumbnail(preview_path, thumbnail_size)
+        except RenderBusyError as e:
+            logger.warning(f"生成预览图失败: {folder}, {str(e)}")
+            return None
+        if not thumbnail:
+            return None
         
-        return {
-            'data': f"data:image/{img.format.lower() if img.format else 'jpeg'};base64,{img_str}",
-            'count': len(images)
-        }
-    except Exception as e:
-        logger.error(f"创建预览图失败: {str(e)}")
-        return None
\ No newline at end of file
+        try:
+            # 读取缓存的缩略图并转换为base64
+            thumbnail_path, mimetype = thumbnail
+            with open(thumbnail_path, 'rb') as f:
+                img_str = base64.b64encode(f.read()).decode('utf-8')
+            
+            return {
+                'data': f"data:{mimetype};base64,{img_str}",
+                'count': len(images)
+            }
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            logger.error(f"创建预览图失败: {str(e)}")
+            return None
+    return None
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""
+索引预热工具模块 - 启动时并行扫描所有文件夹，并持久化索引快照以加速重启
+"""
+import os
+import gzip
+import json
+import time
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from .cache import seed_cache
+from .packed_index import build_packed_index
+from .scanner import ScanEntry, scan_images, list_subfolders
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 快照格式版本（格式变化时递增，旧快照将被忽略）
+SNAPSHOT_VERSION = 2
+
+
+def load_index_snapshot(snapshot_path, image_base, image_extensions) -> Dict[str, dict]:
+    """
+    读取磁盘上的索引快照
+
+    Args:
+        snapshot_path: 快照文件路径
+        image_base: 图像基础目录
+        image_extensions: 支持的图像扩展名集合
+
+    Returns:
+        {文件夹名称: {'mtime_ns': 目录修改时间, 'images': [[文件名, 大小, 修改时间], ...]}}，
+        无效时返回空字典
+    """
+    if not snapshot_path or not os.path.isfile(snapshot_path):
+        return {}
+    try:
+        with gzip.open(snapshot_path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        logger.warning(f"读取索引快照失败，将完整扫描: {str(e)}")
+        return {}
+
+    # 图像目录或扩展名配置变化时快照作废
+    if (data.get('version') != SNAPSHOT_VERSION
+            or data.get('image_base') != os.path.abspath(image_base)
+            or data.get('extensions') != sorted(image_extensions)):
+        logger.info("索引快照与当前配置不匹配，将完整扫描")
+        return {}
+    return data.get('folders', {})
+
+
+def save_index_snapshot(snapshot_path, image_base, image_extensions, folders: Dict[str, dict]) -> None:
+    """
+    写入索引快照（先写临时文件再原子替换）
+
+    Args:
+        snapshot_path: 快照文件路径
+        image_base: 图像基础目录
+        image_extensions: 支持的图像扩展名集合
+        folders: {文件夹名称: {'mtime_ns': 目录修改时间, 'images': [[文件名, 大小, 修改时间], ...]}}
+    """
+    data = {
+        'version': SNAPSHOT_VERSION,
+        'image_base': os.path.abspath(image_base),
+        'extensions': sorted(image_extensions),
+        'created_at': time.time(),
+        'folders': folders,
+    }
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+            f.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        os.replace(tmp_path, snapshot_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _scan_folder(image_base, folder, image_extensions) -> Optional[dict]:
+    """
+    扫描单个文件夹（在线程池中运行）
+
+    目录修改时间在扫描前读取：扫描期间发生的变化会让下次启动时
+    修改时间不一致，从而重新扫描。
+
+    Returns:
+        {'mtime_ns': 目录修改时间, 'images': [[文件名, 大小, 修改时间], ...]} 或 None
+    """
+    folder_path = os.path.join(image_base, folder)
+    try:
+        mtime_ns = os.stat(folder_path).st_mtime_ns
+        images = [list(entry) for entry in scan_images(folder_path, image_extensions, with_stat=True)]
+    except OSError as e:
+        logger.error(f"预热扫描失败: {folder}, 错误: {str(e)}")
+        return None
+    return {'mtime_ns': mtime_ns, 'images': images}
+
+
+def warm_up_index(image_base, image_extensions, workers=8, snapshot_path=None, packed_path=None) -> int:
+    """
+    预热文件夹索引
+
+    读取索引快照后，只重新扫描目录修改时间发生变化的文件夹（线程池并行），
+    结果一次性写入文件夹缓存并保存新的快照。指定 packed_path 时先生成紧凑索引文件，
+    缓存项直接引用其只读映射（多进程模式下 fork 出的工作进程共享同一映射）。
+
+    Args:
+        image_base: 图像基础目录
+        image_extensions: 支持的图像扩展名集合
+        workers: 并行扫描线程数
+        snapshot_path: 索引快照路径，为空时不读写快照
+        packed_path: 紧凑索引文件路径，为空时使用普通的内存索引
+
+    Returns:
+        已索引的图像总数
+    """
+    start = time.time()
+    try:
+        subfolders = list_subfolders(image_base)
+    except OSError as e:
+        logger.error(f"索引预热失败: {str(e)}")
+        return 0
+
+    cached = load_index_snapshot(snapshot_path, image_base, image_extensions)
+    folders: Dict[str, dict] = {}
+    to_scan: List[str] = []
+    reused = 0
+    for folder in subfolders:
+        record = cached.get(folder)
+        try:
+            mtime_ns = os.stat(os.path.join(image_base, folder)).st_mtime_ns
+        except OSError:
+            continue
+        if record and record.get('mtime_ns') == mtime_ns:
+            folders[folder] = record
+            reused += 1
+        else:
+            to_scan.append(folder)
+
+    if to_scan:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='index-warmup') as pool:
+            results = pool.map(lambda f: _scan_folder(image_base, f, image_extensions), to_scan)
+            for folder, record in zip(to_scan, results):
+                if record is not None:
+                    folders[folder] = record
+
+    entries = {folder: [ScanEntry(*item) for item in record['images']]
+               for folder, record in folders.items() if record['images']}
+    packed = build_packed_index(packed_path, entries) if packed_path else None
+    seed_cache(entries, packed)
+    total = sum(len(record['images']) for record in folders.values())
+    logger.info(f"索引预热完成: {len(folders)} 个文件夹, {total} 张图片, "
+                f"复用快照 {reused} 个, 重新扫描 {len(to_scan)} 个, "
+                f"耗时 {time.time() - start:.2f}秒")
+
+    if snapshot_path and (to_scan or set(cached) != set(folders)):
+        try:
+            save_index_snapshot(snapshot_path, image_base, image_extensions, folders)
+        except Exception as e:
+            logger.error(f"保存索引快照失败: {str(e)}")
+    return total
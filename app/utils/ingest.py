@@ -0,0 +1,422 @@
+"""
+批量导入模块 - 将多个上传文件或 zip/tar 压缩包中的图像导入文件夹
+
+每个文件先流式写入目标文件夹中的隐藏临时文件（.ingest-*.part，不是图片后缀，
+文件监控不会处理半写入的文件），在图像处理进程池中校验通过后原子重命名为最终文件名；
+全部完成后整批变化一次性应用到文件夹缓存，不必等待文件监控逐个提交。
+"""
+import os
+import time
+import logging
+import tarfile
+import zipfile
+import tempfile
+from collections import deque
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from werkzeug.utils import secure_filename
+from .cache import apply_folder_changes
+from .home_cache import mark_home_dirty
+from .image_render import verify_image
+from .image_utils import invalidate_derived_images
+from .render_pool import RenderBusyError, submit_render, wait_result, wait_seconds
+from .scanner import is_image_name
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 临时文件名前缀和后缀（与最终文件位于同一目录，保证重命名是原子操作）
+TEMP_PREFIX = '.ingest-'
+TEMP_SUFFIX = '.part'
+
+# 流式复制的缓冲区大小
+COPY_BUFFER = 1024 * 1024
+
+# 同时在进程池中校验的文件数（其余文件继续接收，等待最早提交的校验完成）
+MAX_IN_FLIGHT = 8
+
+# 进程池被其他请求占满时的退避重试间隔（秒），每次翻倍直到上限
+BUSY_RETRY_DELAY = 0.05
+BUSY_RETRY_MAX_DELAY = 1.0
+
+# 支持的压缩包文件名后缀
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# 直接以压缩包作为请求体时支持的 Content-Type
+ARCHIVE_MIMETYPES = {
+    'application/zip': 'zip',
+    'application/x-zip-compressed': 'zip',
+    'application/x-tar': 'tar',
+    'application/x-gtar': 'tar',
+    'application/gzip': 'tar',
+    'application/x-gzip': 'tar',
+    'application/x-bzip2': 'tar',
+    'application/x-xz': 'tar',
+}
+
+
+class IngestError(Exception):
+    """导入请求无效（如文件数超过上限）"""
+
+
+def is_archive_name(name: str) -> bool:
+    """检查文件名是否为支持的压缩包"""
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def create_temp_file(folder_path: str):
+    """
+    在目标文件夹中创建隐藏的临时文件
+
+    Args:
+        folder_path: 目标文件夹路径
+
+    Returns:
+        可读写的文件对象（name 属性为临时文件路径）
+    """
+    return tempfile.NamedTemporaryFile('wb+', dir=folder_path, prefix=TEMP_PREFIX,
+                                       suffix=TEMP_SUFFIX, delete=False)
+
+
+def atomic_save(file_storage, file_path: str) -> None:
+    """
+    保存上传文件：先写入同目录临时文件再原子重命名（文件监控不会看到半写入的文件）
+
+    Args:
+        file_storage: werkzeug FileStorage
+        file_path: 目标文件路径
+    """
+    with create_temp_file(os.path.dirname(file_path)) as tmp:
+        tmp_path = tmp.name
+        try:
+            file_storage.save(tmp)
+        except Exception:
+            tmp.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, file_path)
+
+
+class BulkIngest:
+    """
+    一次批量导入
+
+    用法：依次调用 add_upload / add_stream / add_archive 等加入文件，最后调用 commit
+    重命名并提交到缓存；无论成功与否都应调用 cleanup 删除剩余的临时文件。
+    """
+
+    def __init__(self, folder_path: str, folder: str, image_extensions, max_files: int = 10000,
+                 max_file_bytes: int = 50 * 1024 * 1024, timeout: float = 30.0):
+        """
+        初始化批量导入
+
+        Args:
+            folder_path: 目标文件夹路径
+            folder: 目标文件夹名称（缓存中的键）
+            image_extensions: 支持的图片扩展名集合
+            max_files: 单次导入的图像数上限
+            max_file_bytes: 单个文件大小上限（字节）
+            timeout: 等待单个文件校验的超时时间（秒）
+        """
+        self.folder_path = folder_path
+        self.folder = folder
+        self.image_extensions = image_extensions
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.timeout = timeout
+        self.skipped: List[Tuple[str, str]] = []
+        self._accepted = 0
+        # 校验中的文件：(文件名, 临时文件路径, 大小, Future)
+        self._pending = deque()
+        # 校验通过、等待重命名的文件：{文件名: (临时文件路径, 大小)}（同名文件以最后一个为准）
+        self._ready: Dict[str, Tuple[str, int]] = {}
+        self._temps = set()
+        self._started = time.perf_counter()
+
+    def _temp_file(self):
+        """创建临时文件并登记（cleanup 时删除未重命名的临时文件）"""
+        tmp = create_temp_file(self.folder_path)
+        self._temps.add(tmp.name)
+        return tmp
+
+    def _discard(self, path: str) -> None:
+        """删除临时文件"""
+        self._temps.discard(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _skip(self, name: str, reason: str) -> None:
+        self.skipped.append((name, reason))
+
+    def _accept_name(self, name: str) -> Optional[str]:
+        """
+        检查并清理文件名（压缩包中的目录层级被忽略）
+
+        Returns:
+            安全的文件名，不是支持的图片时返回 None
+        """
+        filename = secure_filename(os.path.basename(name.replace('\\', '/')))
+        if not filename or not is_image_name(filename, self.image_extensions):
+            self._skip(name, '不支持的文件类型')
+            return None
+        if self._accepted >= self.max_files:
+            raise IngestError(f"单次导入最多 {self.max_files} 张图片")
+        return filename
+
+    def stream_factory(self, total_content_length, content_type, filename, content_length=None):
+        """
+        multipart 解析器的文件流工厂：图片和压缩包直接写入目标文件夹的临时文件，其他文件丢弃
+
+        Returns:
+            可写的文件对象
+        """
+        if filename and (is_image_name(filename, self.image_extensions) or is_archive_name(filename)):
+            return self._temp_file()
+        return open(os.devnull, 'wb+')
+
+    def add_upload(self, file_storage) -> None:
+        """
+        加入一个由 stream_factory 接收的上传文件（图片或压缩包）
+
+        Args:
+            file_storage: werkzeug FileStorage
+        """
+        name = file_storage.filename or ''
+        stream = file_storage.stream
+        path = getattr(stream, 'name', None)
+        if path not in self._temps:
+            stream.close()
+            if name:
+                self._skip(name, '不支持的文件类型')
+            return
+
+        if is_archive_name(name):
+            try:
+                stream.seek(0)
+                self.add_archive(stream, name)
+            finally:
+                stream.close()
+                self._discard(path)
+            return
+
+        stream.close()
+        filename = self._accept_name(name)
+        if filename is None:
+            self._discard(path)
+            return
+        size = os.path.getsize(path)
+        if size > self.max_file_bytes:
+            self._skip(name, '文件过大')
+            self._discard(path)
+            return
+        self._submit(filename, path, size)
+
+    def add_stream(self, name: str, stream: BinaryIO) -> None:
+        """
+        从流中读取一个文件写入临时文件并提交校验
+
+        Args:
+            name: 原始文件名（可含目录）
+            stream: 可读的二进制流
+        """
+        filename = self._accept_name(name)
+        if filename is None:
+            return
+        tmp = self._temp_file()
+        size = 0
+        try:
+            with tmp:
+                while True:
+                    chunk = stream.read(COPY_BUFFER)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        break
+                    tmp.write(chunk)
+        except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError, RuntimeError) as e:
+            self._skip(name, f'读取失败: {str(e)}')
+            self._discard(tmp.name)
+            return
+        if size > self.max_file_bytes:
+            self._skip(name, '文件过大')
+            self._discard(tmp.name)
+            return
+        self._submit(filename, tmp.name, size)
+
+    def add_archive(self, fileobj: BinaryIO, name: str = '') -> None:
+        """
+        导入可随机访问的 zip 或 tar 压缩包（zip 的目录位于文件末尾，必须可 seek）
+
+        Args:
+            fileobj: 压缩包文件对象
+            name: 压缩包文件名（用于判断格式和错误报告）
+        """
+        try:
+            if name.lower().endswith('.zip') or zipfile.is_zipfile(fileobj):
+                fileobj.seek(0)
+                with zipfile.ZipFile(fileobj) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir():
+                            continue
+                        if info.file_size > self.max_file_bytes:
+                            self._skip(info.filename, '文件过大')
+                            continue
+                        if not is_image_name(info.filename, self.image_extensions):
+                            self._skip(info.filename, '不支持的文件类型')
+                            continue
+                        try:
+                            with archive.open(info) as src:
+                                self.add_stream(info.filename, src)
+                        except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                            # 损坏或加密的条目
+                            self._skip(info.filename, f'读取失败: {str(e)}')
+            else:
+                fileobj.seek(0)
+                with tarfile.open(fileobj=fileobj, mode='r:*') as archive:
+                    self._add_tar_members(archive)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+            self._skip(name or '压缩包', f'无法读取压缩包: {str(e)}')
+
+    def add_archive_stream(self, stream: BinaryIO, kind: str) -> None:
+        """
+        导入请求体中的压缩包：tar 边接收边解包，zip 先写入临时文件再读取
+
+        Args:
+            stream: 请求体流
+            kind: 'zip' 或 'tar'
+        """
+        if kind == 'zip':
+            tmp = self._temp_file()
+            try:
+                with tmp:
+                    while True:
+                        chunk = stream.read(COPY_BUFFER)
+                        if not chunk:
+                            break
+                        tmp.write(chunk)
+                with open(tmp.name, 'rb') as f:
+                    self.add_archive(f, 'upload.zip')
+            finally:
+                self._discard(tmp.name)
+            return
+
+        try:
+            with tarfile.open(fileobj=stream, mode='r|*') as archive:
+                self._add_tar_members(archive)
+        except (tarfile.TarError, EOFError, OSError) as e:
+            self._skip('压缩包', f'无法读取压缩包: {str(e)}')
+
+    def _add_tar_members(self, archive: tarfile.TarFile) -> None:
+        """导入 tar 中的普通文件（忽略目录、链接和设备文件）"""
+        for member in archive:
+            if not member.isfile():
+                continue
+            if member.size > self.max_file_bytes:
+                self._skip(member.name, '文件过大')
+                continue
+            src = archive.extractfile(member)
+            if src is not None:
+                self.add_stream(member.name, src)
+
+    def _submit(self, filename: str, path: str, size: int) -> None:
+        """
+        提交校验；校验中的文件达到上限时先等待最早提交的一个
+
+        进程池繁忙时不在当前线程中解码图片：先等待本次导入已提交的校验腾出位置，
+        没有可等待的校验时退避重试，超过 timeout 秒仍然繁忙则跳过该文件。
+        """
+        self._accepted += 1
+        while len(self._pending) >= MAX_IN_FLIGHT:
+            self._collect_one()
+        deadline = time.monotonic() + self.timeout
+        delay = BUSY_RETRY_DELAY
+        while True:
+            try:
+                future = submit_render(verify_image, path)
+                break
+            except RenderBusyError as e:
+                if self._pending:
+                    self._collect_one()
+                    continue
+                if time.monotonic() + delay > deadline:
+                    self._skip(filename, f'图像处理繁忙: {str(e)}')
+                    self._discard(path)
+                    return
+                wait_seconds(delay)
+                delay = min(delay * 2, BUSY_RETRY_MAX_DELAY)
+        self._pending.append((filename, path, size, future))
+
+    def _collect_one(self) -> None:
+        """等待最早提交的校验结果"""
+        filename, path, size, future = self._pending.popleft()
+        try:
+            error = wait_result(future, self.timeout)
+        except Exception as e:
+            error = f'校验失败: {str(e) or type(e).__name__}'
+        if error is not None:
+            self._skip(filename, f'不是有效的图片: {error}')
+            self._discard(path)
+            return
+        previous = self._ready.pop(filename, None)
+        if previous is not None:
+            self._discard(previous[0])
+        self._ready[filename] = (path, size)
+
+    def commit(self) -> dict:
+        """
+        等待全部校验完成，重命名为最终文件名，并将整批变化一次性应用到缓存
+
+        Returns:
+            导入结果（导入数、跳过的文件、字节数、耗时及吞吐量）
+        """
+        while self._pending:
+            self._collect_one()
+
+        changes: Dict[str, Optional[Tuple[int, int]]] = {}
+        total_bytes = 0
+        for filename, (path, size) in sorted(self._ready.items()):
+            target = os.path.join(self.folder_path, filename)
+            replaced = os.path.exists(target)
+            try:
+                os.replace(path, target)
+                st = os.stat(target)
+            except OSError as e:
+                self._skip(filename, f'保存失败: {str(e)}')
+                self._discard(path)
+                continue
+            self._temps.discard(path)
+            if replaced:
+                # 覆盖已有图片时使其缩略图、变体等生成物失效
+                invalidate_derived_images(target)
+            changes[filename] = (st.st_size, st.st_mtime_ns)
+            total_bytes += size
+        self._ready.clear()
+
+        if changes:
+            apply_folder_changes({self.folder: changes})
+            mark_home_dirty()
+
+        elapsed = time.perf_counter() - self._started
+        result = {
+            'folder': self.folder,
+            'saved': len(changes),
+            'skipped': [{'name': name, 'reason': reason} for name, reason in self.skipped],
+            'bytes': total_bytes,
+            'seconds': round(elapsed, 3),
+            'files_per_second': round(len(changes) / elapsed, 1) if elapsed > 0 else None,
+            'mb_per_second': round(total_bytes / 1048576 / elapsed, 2) if elapsed > 0 else None,
+        }
+        logger.info(f"批量导入完成: {self.folder}, 导入 {result['saved']} 张, 跳过 {len(self.skipped)} 个, "
+                    f"{total_bytes} 字节, 耗时 {result['seconds']}秒 "
+                    f"({result['files_per_second']} 文件/秒, {result['mb_per_second']} MB/秒)")
+        return result
+
+    def cleanup(self) -> None:
+        """删除未重命名的临时文件（导入失败或部分文件被跳过时）"""
+        for filename, path, size, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        for path in list(self._temps):
+            self._discard(path)
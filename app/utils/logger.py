@@ -1,9 +1,17 @@
 """
 日志工具模块 - 提供统一的日志配置
+
+日志记录在请求线程中只做入队（QueueHandler），格式化和写入由后台线程批量完成，
+请求处理不再因控制台或日志文件的磁盘 I/O 而阻塞。
 """
 import os
+import json
+import queue
+import atexit
+import random
 import logging
-from logging.handlers import RotatingFileHandler
+import datetime
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import time
 from flask import request
 
@@ -37,18 +45,176 @@ class RequestFormatter(logging.Formatter):
             
         return super().format(record)
 
+class JsonFormatter(logging.Formatter):
+    """紧凑的单行 JSON 日志格式（便于日志采集系统解析）"""
+    
+    # 记录中存在时输出的附加字段
+    FIELDS = ('request_id', 'remote_addr', 'method', 'path', 'status', 'duration_ms', 'size')
+    
+    def format(self, record):
+        """格式化为单行 JSON"""
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None and value != '-':
+                data[field] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+class RequestContextFilter(logging.Filter):
+    """
+    在产生日志的请求线程中记录请求信息
+    
+    日志由后台线程格式化时已不在请求上下文中，因此入队前先把请求ID、
+    客户端IP、方法和路径写入日志记录。
+    """
+    
+    def filter(self, record):
+        """补充请求信息（始终返回 True）"""
+        if hasattr(record, 'request_id'):
+            return True
+        from flask import has_request_context, g
+        if has_request_context():
+            record.request_id = g.get('request_id') or request.headers.get('X-Request-ID', '-')
+            record.remote_addr = g.get('client_ip') or request.remote_addr
+            record.method = request.method
+            record.path = request.path
+        return True
+
+class BatchFlushMixin:
+    """写入每条记录后不立即 flush，由 BatchQueueListener 每批 flush 一次"""
+    
+    def flush(self):
+        pass
+    
+    def flush_batch(self):
+        super().flush()
+
+class BatchStreamHandler(BatchFlushMixin, logging.StreamHandler):
+    """批量 flush 的控制台处理器"""
+
+class BatchRotatingFileHandler(BatchFlushMixin, RotatingFileHandler):
+    """批量 flush 的按大小轮转文件处理器"""
+
+class DroppingQueueHandler(QueueHandler):
+    """队列已满时丢弃日志记录并计数（请求线程永不阻塞）"""
+    
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BatchQueueListener(QueueListener):
+    """
+    批量写入的日志队列监听器
+    
+    每次取出队列中已积压的全部记录（最多 batch_size 条）依次写入，
+    然后每个处理器只 flush 一次；批次未满时等待 flush_interval 秒再取下一批，
+    避免每条记录都唤醒写入线程并争用 GIL。
+    """
+    
+    def __init__(self, log_queue, *handlers, batch_size=512, flush_interval=0.1):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+    
+    def _monitor(self):
+        log_queue = self.queue
+        while True:
+            batch = [log_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stopping = False
+            for record in batch:
+                if record is self._sentinel:
+                    stopping = True
+                else:
+                    self.handle(record)
+            for handler in self.handlers:
+                flush_batch = getattr(handler, 'flush_batch', handler.flush)
+                try:
+                    flush_batch()
+                except Exception:
+                    pass
+            if stopping:
+                return
+            if len(batch) < self.batch_size:
+                time.sleep(self.flush_interval)
+
+# 当前进程的日志队列监听器（由 setup_logger 创建，shutdown_logger 停止）
+_listeners = []
+
+# 成功图片请求访问日志的采样率
+_access_sample_rate = 1.0
+
+def _start_queue(target_logger, handlers, queue_size):
+    """
+    将日志记录器的处理器移到后台监听线程，记录器只保留一个队列处理器
+    
+    Args:
+        target_logger: 日志记录器
+        handlers: 实际写入的处理器列表
+        queue_size: 队列容量（超出时丢弃）
+    """
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    target_logger.addHandler(queue_handler)
+    
+    listener = BatchQueueListener(log_queue, *handlers)
+    listener.start()
+    _listeners.append(listener)
+
+def shutdown_logger():
+    """停止后台写入线程（写完队列中剩余的日志）"""
+    while _listeners:
+        listener = _listeners.pop()
+        try:
+            # fork 出的子进程中父进程的线程不存在，直接丢弃
+            if listener._thread is not None and listener._thread.is_alive():
+                listener.stop()
+        except Exception:
+            pass
+
+atexit.register(shutdown_logger)
+
 def setup_logger(app, config):
     """
     设置应用日志
     
     Args:
-        app: Flask应用实例
+        app: Flask应用实例（多进程模式的主进程中为 None）
         config: 配置类
     """
+    global _access_sample_rate
+    
     # 确保日志目录存在
     if not os.path.exists('logs'):
         os.mkdir('logs')
     
+    # 重复调用时（如多进程模式的工作进程）先停止旧的写入线程
+    shutdown_logger()
+    use_queue = getattr(config, 'LOG_QUEUE', True)
+    queue_size = getattr(config, 'LOG_QUEUE_SIZE', 10000)
+    _access_sample_rate = getattr(config, 'ACCESS_LOG_SAMPLE_RATE', 1.0)
+    stream_handler_class = BatchStreamHandler if use_queue else logging.StreamHandler
+    file_handler_class = BatchRotatingFileHandler if use_queue else RotatingFileHandler
+    
     # 创建根日志记录器
     logger = logging.getLogger()
     
@@ -61,71 +227,89 @@ def setup_logger(app, config):
     logger.setLevel(log_level)
     
     # 创建控制台处理器
-    console_handler = logging.StreamHandler()
+    console_handler = stream_handler_class()
     console_handler.setLevel(log_level)
     
-    # 创建详细的日志格式
-    verbose_formatter = RequestFormatter(
-        '[%(asctime)s] [%(levelname)s] %(name)s:%(lineno)d - %(message)s'
-    )
+    # 创建日志格式（text：详细文本；json：单行 JSON）
+    if getattr(config, 'LOG_FORMAT', 'text') == 'json':
+        verbose_formatter = JsonFormatter()
+        access_formatter = JsonFormatter()
+    else:
+        verbose_formatter = RequestFormatter(
+            '[%(asctime)s] [%(levelname)s] %(name)s:%(lineno)d - %(message)s'
+        )
+        access_formatter = RequestFormatter(
+            '[%(asctime)s] [ACCESS] %(remote_addr)s - %(method)s %(path)s - %(message)s'
+        )
     
     # 设置控制台处理器格式
     console_handler.setFormatter(verbose_formatter)
-    
-    # 添加控制台处理器到根日志记录器
-    logger.addHandler(console_handler)
+    root_handlers = [console_handler]
     
     # 创建访问日志记录器（所有环境都需要）
     access_logger = logging.getLogger('access')
     access_logger.propagate = False  # 不传播到父记录器
+    for handler in access_logger.handlers[:]:
+        access_logger.removeHandler(handler)
     access_logger.setLevel(log_level)
     
     # 创建访问日志控制台处理器
-    access_console_handler = logging.StreamHandler()
+    access_console_handler = stream_handler_class()
     access_console_handler.setLevel(log_level)
-    access_formatter = RequestFormatter(
-        '[%(asctime)s] [ACCESS] %(remote_addr)s - %(method)s %(path)s - %(message)s'
-    )
     access_console_handler.setFormatter(access_formatter)
-    access_logger.addHandler(access_console_handler)
+    access_handlers = [access_console_handler]
     
     # 在生产环境中添加文件处理器
     if not config.DEBUG:
         # 创建按大小轮转的文件处理器
-        file_handler = RotatingFileHandler(
+        file_handler = file_handler_class(
             'logs/random_images_api.log',
             maxBytes=10485760,  # 10MB
             backupCount=10
         )
         file_handler.setLevel(log_level)
         file_handler.setFormatter(verbose_formatter)
-        logger.addHandler(file_handler)
+        root_handlers.append(file_handler)
         
         # 创建错误日志文件处理器
-        error_file_handler = RotatingFileHandler(
+        error_file_handler = file_handler_class(
             'logs/error.log',
             maxBytes=10485760,  # 10MB
             backupCount=10
         )
         error_file_handler.setLevel(logging.ERROR)
         error_file_handler.setFormatter(verbose_formatter)
-        logger.addHandler(error_file_handler)
+        root_handlers.append(error_file_handler)
         
         # 创建访问日志文件处理器
-        access_file_handler = RotatingFileHandler(
+        access_file_handler = file_handler_class(
             'logs/access.log',
             maxBytes=10485760,  # 10MB
             backupCount=10
         )
         access_file_handler.setLevel(log_level)
         access_file_handler.setFormatter(access_formatter)
-        access_logger.addHandler(access_file_handler)
+        access_handlers.append(access_file_handler)
+    
+    # 挂载处理器：队列模式下由后台线程批量写入，否则直接写入
+    if use_queue:
+        _start_queue(logger, root_handlers, queue_size)
+        _start_queue(access_logger, access_handlers, queue_size)
+    else:
+        context_filter = RequestContextFilter()
+        for handler in root_handlers + access_handlers:
+            handler.addFilter(context_filter)
+        for handler in root_handlers:
+            logger.addHandler(handler)
+        for handler in access_handlers:
+            access_logger.addHandler(handler)
     
     # 设置Flask应用日志处理器
-    app.logger.handlers = []
-    app.logger.propagate = False  # 防止日志传播到根记录器
-    for handler in logger.handlers:
-        app.logger.addHandler(handler)
+    if app is not None:
+        app.logger.handlers = []
+        app.logger.propagate = False  # 防止日志传播到根记录器
+        for handler in logger.handlers:
+            app.logger.addHandler(handler)
     
     # 设置Werkzeug日志处理器
     werkzeug_logger = logging.getLogger('werkzeug')
@@ -137,4 +321,25 @@ def setup_logger(app, config):
     # 记录应用启动信息（只记录一次）
     logger.info(f"Random Images API 启动于 {'开发' if config.DEBUG else '生产'}环境")
     
-    return logger
\ No newline at end of file
+    return logger
+
+def log_request_completion(response, duration):
+    """
+    记录请求完成（每个请求一条访问日志，含状态码和耗时）
+    
+    成功的图片请求按 ACCESS_LOG_SAMPLE_RATE 采样，错误和其他页面始终记录。
+    
+    Args:
+        response: 响应对象
+        duration: 请求处理耗时（秒）
+    """
+    status = response.status_code
+    if (_access_sample_rate < 1.0 and status < 400 and request.blueprint == 'images'
+            and random.random() >= _access_sample_rate):
+        return
+    
+    duration_ms = round(duration * 1000, 2)
+    logging.getLogger('access').info(
+        f"请求完成: {request.method} {request.path} - 状态码: {status} - 耗时: {duration_ms}ms",
+        extra={'status': status, 'duration_ms': duration_ms, 'size': response.content_length}
+    )
@@ -0,0 +1,526 @@
+"""
+指标模块 - 分片计数器、直方图及 Prometheus 文本格式输出
+
+每个线程写入自己的分片（只有该线程修改），记录指标时不加锁；
+采集时复制各分片并求和。gevent 的 greenlet 都运行在主线程中，共用同一分片，
+greenlet 之间不会在一次字典更新的中途切换。
+
+多进程模式下各工作进程定期把计数器和直方图写入共享目录中的快照文件，
+采集请求由任一工作进程处理时汇总所有进程的数据；已退出进程的数据由主进程
+合并到归档文件中，汇总值不会因工作进程重启而回退。
+"""
+import os
+import json
+import math
+import uuid
+import logging
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 请求耗时分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 响应大小分桶（字节）
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# 目录扫描耗时分桶（秒）
+SCAN_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+# 已退出工作进程的指标归档文件（共享目录下）
+ARCHIVE_FILE = 'exited.json'
+
+
+def _escape(value: str) -> str:
+    """转义标签值"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    """格式化标签，如 {endpoint="images.random",status="200"}"""
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    """格式化样本值"""
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+class _Sharded:
+    """按线程分片的存储（每个线程只修改自己的分片）"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        """获取当前线程的分片（首次使用时注册，仅此时加锁）"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _snapshots(self) -> List[dict]:
+        """复制所有分片（dict.copy 在持有 GIL 时完成，不会读到修改中的字典）"""
+        with self._lock:
+            shards = list(self._shards)
+        return [shard.copy() for shard in shards]
+
+
+class Counter(_Sharded):
+    """单调递增计数器"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+        初始化计数器
+
+        Args:
+            name: 指标名称（以 _total 结尾）
+            documentation: 说明
+            labelnames: 标签名
+        """
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        """
+        增加计数
+
+        Args:
+            labels: 标签值（顺序与 labelnames 一致）
+            amount: 增加量
+        """
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        """汇总各分片"""
+        totals: Dict[Tuple[str, ...], float] = {}
+        for shard in self._snapshots():
+            self.merge(totals, shard)
+        return totals
+
+    @staticmethod
+    def merge(totals: dict, values: dict) -> None:
+        """把 values 累加到 totals 中"""
+        for labels, value in values.items():
+            totals[labels] = totals.get(labels, 0) + value
+
+    def render(self, others: Sequence[dict] = (), local: bool = True) -> List[str]:
+        """
+        输出样本行
+
+        Args:
+            others: 其他进程的 collect() 结果，与本进程的数据相加
+            local: 是否包含本进程的当前数据（为 False 时只汇总 others）
+        """
+        totals = self.collect() if local else {}
+        for values in others:
+            self.merge(totals, values)
+        lines = []
+        for labels, value in sorted(totals.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Sharded):
+    """直方图（各分桶计数、总和及样本数）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float],
+                 labelnames: Sequence[str] = ()):
+        """
+        初始化直方图
+
+        Args:
+            name: 指标名称
+            documentation: 说明
+            buckets: 分桶上限（升序，不含 +Inf）
+            labelnames: 标签名
+        """
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()) -> None:
+        """
+        记录一个样本
+
+        Args:
+            value: 样本值
+            labels: 标签值
+        """
+        shard = self._shard()
+        data = shard.get(labels)
+        if data is None:
+            # [各分桶计数..., +Inf 计数, 总和]
+            data = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def collect(self) -> Dict[Tuple[str, ...], List[float]]:
+        """汇总各分片"""
+        totals: Dict[Tuple[str, ...], List[float]] = {}
+        for shard in self._snapshots():
+            self.merge(totals, shard)
+        return totals
+
+    @staticmethod
+    def merge(totals: dict, values: dict) -> None:
+        """把 values 逐个分桶累加到 totals 中"""
+        for labels, data in values.items():
+            total = totals.get(labels)
+            if total is None:
+                totals[labels] = list(data)
+            elif len(total) == len(data):
+                for i, value in enumerate(data):
+                    total[i] += value
+
+    def render(self, others: Sequence[dict] = (), local: bool = True) -> List[str]:
+        """
+        输出样本行
+
+        Args:
+            others: 其他进程的 collect() 结果，与本进程的数据相加
+            local: 是否包含本进程的当前数据（为 False 时只汇总 others）
+        """
+        totals = self.collect() if local else {}
+        for values in others:
+            self.merge(totals, values)
+        lines = []
+        bounds = [_format_value(float(b)) for b in self.buckets] + ['+Inf']
+        for labels, data in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, data):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_str} {_format_value(data[-1])}')
+            lines.append(f'{self.name}_count{label_str} {cumulative}')
+        return lines
+
+
+class GaugeFunc:
+    """采集时调用函数取值的仪表（如封禁表大小、缓存条目数）"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], Optional[float]]):
+        """
+        初始化仪表
+
+        Args:
+            name: 指标名称
+            documentation: 说明
+            func: 返回当前值的函数，返回 None 时不输出
+        """
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def render(self, others: Sequence[dict] = (), local: bool = True) -> List[str]:
+        """输出当前进程的取值（仪表反映进程状态，不跨进程相加）"""
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.error(f"采集指标失败: {self.name}, 错误: {str(e)}")
+            return []
+        if value is None:
+            return []
+        return [f'{self.name} {_format_value(value)}']
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """注册指标（同名指标只保留第一个，重复创建应用时不会重复注册）"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, buckets, labelnames=()) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets, labelnames))
+
+    def gauge(self, name, documentation, func) -> GaugeFunc:
+        """注册仪表（同名时替换取值函数）"""
+        gauge = self.register(GaugeFunc(name, documentation, func))
+        gauge.func = func
+        return gauge
+
+    def snapshot(self) -> Dict[str, Dict[Tuple[str, ...], object]]:
+        """
+        获取本进程所有计数器和直方图的当前值
+
+        Returns:
+            {指标名称: collect() 结果}
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.collect() for metric in metrics if hasattr(metric, 'collect')}
+
+    def render(self, others: Sequence[Dict[str, dict]] = (), local: bool = True) -> str:
+        """
+        输出 Prometheus 文本格式（text/plain; version=0.0.4）
+
+        Args:
+            others: 其他进程的 snapshot() 结果，计数器和直方图与本进程的数据相加
+            local: 计数器和直方图是否包含本进程的当前数据（为 False 时只汇总 others）
+
+        Returns:
+            指标文本
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render([other[metric.name] for other in others if metric.name in other], local))
+        return '\n'.join(lines) + '\n'
+
+
+# 全局指标注册表
+registry = Registry()
+
+# 多进程模式下本进程的快照文件（由 setup_metrics_share 设置）
+_share_path: Optional[str] = None
+
+
+def _dump(snapshot: Dict[str, dict]) -> dict:
+    """快照转换为可写入 JSON 的结构（标签元组转为列表）"""
+    return {name: [[list(labels), value] for labels, value in values.items()]
+            for name, values in snapshot.items()}
+
+
+def _load(data: dict) -> Dict[str, dict]:
+    """从 JSON 结构还原快照"""
+    return {name: {tuple(labels): value for labels, value in values}
+            for name, values in data.items()}
+
+
+def _write_json(path: str, data: dict) -> None:
+    """先写临时文件再原子重命名，读取方不会读到写了一半的文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_json(path: str) -> Optional[dict]:
+    """读取 JSON 文件，不存在或已损坏时返回 None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def setup_metrics_share(directory: str, interval: float = 5.0) -> None:
+    """
+    多进程模式的工作进程中调用：每隔 interval 秒把本进程的指标写入共享目录
+
+    Args:
+        directory: 共享目录（由主进程在启动时清空）
+        interval: 写入间隔（秒）
+    """
+    global _share_path
+    os.makedirs(directory, exist_ok=True)
+    # 文件名带随机后缀，进程号被复用时不会与已归档的旧进程混淆
+    _share_path = os.path.join(directory, f'worker-{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+
+    def write_loop():
+        while True:
+            write_snapshot()
+            time.sleep(interval)
+
+    threading.Thread(target=write_loop, name='metrics-share', daemon=True).start()
+
+
+def write_snapshot() -> None:
+    """把本进程的指标写入共享目录（未启用多进程共享时不处理；工作进程退出前也会调用）"""
+    if _share_path is None:
+        return
+    try:
+        _write_json(_share_path, _dump(registry.snapshot()))
+    except Exception as e:
+        logger.error(f"写入指标快照失败: {str(e)}")
+
+
+def read_shared_snapshots() -> List[Dict[str, dict]]:
+    """
+    读取所有工作进程（含本进程及已退出进程的归档）的指标快照
+
+    Returns:
+        snapshot() 结果列表，未启用多进程共享时为空
+    """
+    if _share_path is None:
+        return []
+    directory = os.path.dirname(_share_path)
+    archive = _read_json(os.path.join(directory, ARCHIVE_FILE)) or {}
+    archived = set(archive.get('files', ()))
+    snapshots = [_load(archive['metrics'])] if archive.get('metrics') else []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return snapshots
+    for name in names:
+        # 归档文件中已包含的进程跳过（主进程先写归档再删除进程文件）
+        if not name.startswith('worker-') or name in archived:
+            continue
+        data = _read_json(os.path.join(directory, name))
+        if data is not None:
+            snapshots.append(_load(data))
+    return snapshots
+
+
+def render_all() -> str:
+    """
+    输出所有进程汇总后的 Prometheus 文本（单进程模式下即本进程的指标）
+
+    多进程模式下先写出本进程的快照，再只汇总快照文件：每个文件中的值只增不减，
+    因此无论由哪个工作进程处理，相继的采集结果都不会回退。
+
+    Returns:
+        指标文本
+    """
+    if _share_path is None:
+        return registry.render()
+    write_snapshot()
+    return registry.render(read_shared_snapshots(), local=False)
+
+
+def reset_shared_snapshots(directory: str) -> None:
+    """
+    主进程启动时调用：清空上次运行留下的指标快照
+
+    Args:
+        directory: 共享目录
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith('worker-') or name == ARCHIVE_FILE:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def archive_worker_snapshot(directory: str, pid: int) -> None:
+    """
+    主进程回收工作进程后调用：把该进程最后一次写入的指标合并到归档文件
+
+    Args:
+        directory: 共享目录
+        pid: 已退出的工作进程号
+    """
+    prefix = f'worker-{pid}-'
+    try:
+        names = [name for name in os.listdir(directory) if name.startswith(prefix) and name.endswith('.json')]
+    except OSError:
+        return
+    if not names:
+        return
+
+    path = os.path.join(directory, ARCHIVE_FILE)
+    archive = _read_json(path) or {}
+    totals = _load(archive.get('metrics') or {})
+    for name in names:
+        data = _read_json(os.path.join(directory, name))
+        if data is None:
+            continue
+        for metric_name, values in _load(data).items():
+            # 直方图的值为分桶列表，计数器为数值
+            merge = Histogram.merge if any(isinstance(v, list) for v in values.values()) else Counter.merge
+            merge(totals.setdefault(metric_name, {}), values)
+    # 只保留仍存在的进程文件名（其余已在之前删除）
+    files = [name for name in archive.get('files', ()) if os.path.exists(os.path.join(directory, name))]
+    try:
+        _write_json(path, {'files': files + names, 'metrics': _dump(totals)})
+    except Exception as e:
+        logger.error(f"归档工作进程指标失败: {pid}, 错误: {str(e)}")
+        return
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+# 请求
+REQUEST_DURATION = registry.histogram(
+    'ria_request_duration_seconds', '请求处理耗时（按端点）', LATENCY_BUCKETS, ('endpoint',))
+REQUESTS = registry.counter(
+    'ria_requests_total', '请求数（按端点和状态码）', ('endpoint', 'status'))
+RESPONSE_SIZE = registry.histogram(
+    'ria_response_size_bytes', '响应大小（按端点，不含流式响应）', SIZE_BUCKETS, ('endpoint',))
+
+# 文件夹缓存
+FOLDER_CACHE = registry.counter(
+    'ria_folder_cache_total', '文件夹缓存查询结果（hit / miss / rescan）', ('result',))
+FOLDER_SCAN_DURATION = registry.histogram(
+    'ria_folder_scan_duration_seconds', '文件夹扫描耗时', SCAN_BUCKETS)
+
+# 封禁
+BAN_CHECKS = registry.counter(
+    'ria_ban_checks_total', '封禁检查次数（按结果）', ('result',))
+BANS_ADDED = registry.counter(
+    'ria_bans_added_total', '新增封禁次数')
+
+# 文件监控
+MONITOR_EVENTS = registry.counter(
+    'ria_file_monitor_events_total', '应用的文件监控事件（按类型）', ('kind',))
+MONITOR_FILES = registry.counter(
+    'ria_file_monitor_files_total', '文件监控提交的文件变化数')
+
+
+def observe_request(endpoint: Optional[str], status: int, duration: float, size: Optional[int]) -> None:
+    """
+    记录一次请求的耗时、状态码和响应大小
+
+    Args:
+        endpoint: 端点名称（未匹配路由时为 None）
+        status: 状态码
+        duration: 处理耗时（秒）
+        size: 响应大小（流式响应为 None）
+    """
+    endpoint = endpoint or 'none'
+    REQUESTS.inc((endpoint, str(status)))
+    REQUEST_DURATION.observe(duration, (endpoint,))
+    if size is not None:
+        RESPONSE_SIZE.observe(size, (endpoint,))
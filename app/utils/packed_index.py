@@ -0,0 +1,328 @@
+"""
+紧凑索引模块 - 所有文件名打包为一个连续字节块，写入文件后以只读 mmap 方式共享
+
+文件布局（本机字节序，索引文件属于本机缓存，每次启动预热时重建）：
+
+    头部        魔数、版本、文件夹数、图像数、文件夹表长度、文件名块长度
+    文件夹表    JSON: [[文件夹名称, 起始序号, 结束序号], ...]，按 8 字节对齐
+    偏移数组    uint64 × (图像数 + 1)，第 i 个文件名为 块[偏移[i]:偏移[i + 1]]
+    大小数组    uint64 × 图像数
+    修改时间    int64 × 图像数
+    文件名块    UTF-8 编码的文件名依次拼接
+
+同一文件夹的图像占用连续的序号区间且按文件名排序，UTF-8 字节序与 Python
+字符串的码点序一致，因此可以直接在字节上二分查找。随机抽样只需一次整数抽取
+和一次切片解码；多进程模式下各工作进程共享同一份页缓存，不再各自持有
+数百万个 str 对象。
+"""
+import os
+import json
+import mmap
+import struct
+import logging
+import tempfile
+from array import array
+from collections.abc import ItemsView, Mapping, Sequence
+from typing import Dict, Iterator, List, Optional, Tuple
+from .scanner import ScanEntry
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 文件魔数与格式版本（格式变化时递增）
+PACKED_MAGIC = b'RIAPACK\0'
+PACKED_VERSION = 1
+
+# 头部：魔数、版本、文件夹数、图像数、文件夹表长度、文件名块长度
+_HEADER = struct.Struct('=8sIIQQQ')
+
+# 文件名编码（保留 os.scandir 对非 UTF-8 文件名返回的代理字符）
+_ENCODING = 'utf-8'
+_ERRORS = 'surrogatepass'
+
+
+def _align(n: int) -> int:
+    """向上对齐到 8 字节"""
+    return (n + 7) & ~7
+
+
+class PackedIndex:
+    """
+    只读的紧凑文件名索引（基于 mmap）
+
+    对象被回收时映射随之释放；已发布到缓存快照中的视图持有索引引用，
+    替换索引文件（os.replace）不影响仍在使用旧映射的进程。
+    """
+
+    def __init__(self, path: str):
+        """
+        打开并映射索引文件
+
+        Args:
+            path: 索引文件路径
+
+        Raises:
+            ValueError: 文件格式无效
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        mm = self._mm
+        if len(mm) < _HEADER.size:
+            raise ValueError(f"索引文件不完整: {path}")
+        magic, version, folder_count, count, table_size, blob_size = _HEADER.unpack_from(mm, 0)
+        if magic != PACKED_MAGIC or version != PACKED_VERSION:
+            raise ValueError(f"索引文件格式不匹配: {path}")
+
+        pos = _HEADER.size
+        table = json.loads(mm[pos:pos + table_size].decode('utf-8'))
+        pos = _align(pos + table_size)
+        # {文件夹名称: (起始序号, 结束序号)}
+        self.folders: Dict[str, Tuple[int, int]] = {folder: (start, end) for folder, start, end in table}
+
+        view = memoryview(mm)
+        self._offsets = view[pos:pos + (count + 1) * 8].cast('Q')
+        pos += (count + 1) * 8
+        self._sizes = view[pos:pos + count * 8].cast('Q')
+        pos += count * 8
+        self._mtimes = view[pos:pos + count * 8].cast('q')
+        pos += count * 8
+        self._blob_start = pos
+        if pos + blob_size > len(mm) or len(self.folders) != folder_count:
+            raise ValueError(f"索引文件不完整: {path}")
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def name(self, i: int) -> str:
+        """解码第 i 个文件名"""
+        offsets = self._offsets
+        base = self._blob_start
+        return self._mm[base + offsets[i]:base + offsets[i + 1]].decode(_ENCODING, _ERRORS)
+
+    def stat(self, i: int) -> Tuple[int, int]:
+        """第 i 个图像的 (文件大小, 修改时间纳秒)"""
+        return self._sizes[i], self._mtimes[i]
+
+    def find(self, start: int, end: int, name: str) -> int:
+        """
+        在 [start, end) 区间内二分查找文件名
+
+        Args:
+            start: 起始序号
+            end: 结束序号
+            name: 文件名
+
+        Returns:
+            序号，未找到时返回 -1
+        """
+        try:
+            key = name.encode(_ENCODING, _ERRORS)
+        except UnicodeError:
+            return -1
+        mm = self._mm
+        offsets = self._offsets
+        base = self._blob_start
+        lo, hi = start, end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mm[base + offsets[mid]:base + offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < end and mm[base + offsets[lo]:base + offsets[lo + 1]] == key:
+            return lo
+        return -1
+
+    def folder_views(self, folder: str) -> Optional[Tuple['PackedNames', 'PackedStats']]:
+        """
+        获取文件夹的只读视图
+
+        Args:
+            folder: 文件夹名称
+
+        Returns:
+            (文件名序列, {文件名: (大小, 修改时间)} 映射)，文件夹不在索引中时返回 None
+        """
+        bounds = self.folders.get(folder)
+        if bounds is None:
+            return None
+        start, end = bounds
+        return PackedNames(self, start, end), PackedStats(self, start, end)
+
+    def mapped_bytes(self) -> int:
+        """映射的文件大小（字节）"""
+        return len(self._mm)
+
+
+class PackedNames(Sequence):
+    """文件夹内按名称排序的文件名序列（按需解码，可直接用于 random.choice）"""
+    __slots__ = ('_index', '_start', '_end')
+
+    def __init__(self, index: PackedIndex, start: int, end: int):
+        self._index = index
+        self._start = start
+        self._end = end
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = self._end - self._start
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('PackedNames index out of range')
+        return self._index.name(self._start + i)
+
+    def __iter__(self) -> Iterator[str]:
+        name = self._index.name
+        for i in range(self._start, self._end):
+            yield name(i)
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self._index.find(self._start, self._end, name) >= 0
+
+
+class PackedStats(Mapping):
+    """文件夹内 {文件名: (文件大小, 修改时间纳秒)} 的只读映射（二分查找）"""
+    __slots__ = ('_index', '_start', '_end')
+
+    def __init__(self, index: PackedIndex, start: int, end: int):
+        self._index = index
+        self._start = start
+        self._end = end
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __getitem__(self, name: str) -> Tuple[int, int]:
+        i = self._index.find(self._start, self._end, name) if isinstance(name, str) else -1
+        if i < 0:
+            raise KeyError(name)
+        return self._index.stat(i)
+
+    def __iter__(self) -> Iterator[str]:
+        name = self._index.name
+        for i in range(self._start, self._end):
+            yield name(i)
+
+    def items(self) -> '_PackedItems':
+        """按文件名顺序遍历 (文件名, (文件大小, 修改时间纳秒))，顺序读取无需逐个查找"""
+        return _PackedItems(self)
+
+    def same_as(self, entries: List[ScanEntry]) -> bool:
+        """
+        检查扫描结果与索引内容是否完全一致（顺序比较，无需查找）
+
+        Args:
+            entries: 按文件名排序的 ScanEntry 列表
+
+        Returns:
+            是否一致
+        """
+        if len(entries) != len(self):
+            return False
+        index = self._index
+        for i, entry in zip(range(self._start, self._end), entries):
+            if index.stat(i) != (entry.size, entry.mtime_ns) or index.name(i) != entry.name:
+                return False
+        return True
+
+
+class _PackedItems(ItemsView):
+    """PackedStats 的条目视图：遍历时按下标顺序读取文件名和大小、修改时间"""
+    __slots__ = ()
+
+    def __iter__(self) -> Iterator[Tuple[str, Tuple[int, int]]]:
+        stats = self._mapping
+        index = stats._index
+        name, stat = index.name, index.stat
+        for i in range(stats._start, stats._end):
+            yield name(i), stat(i)
+
+
+def write_packed_index(path: str, folders: Dict[str, Sequence]) -> int:
+    """
+    写入紧凑索引文件（先写临时文件再原子替换）
+
+    文件名块直接流式写入文件，内存中只保留三个定长数组。
+
+    Args:
+        path: 索引文件路径
+        folders: {文件夹名称: 按文件名排序的 ScanEntry 序列}
+
+    Returns:
+        写入的图像总数
+    """
+    table = []
+    count = 0
+    for folder in sorted(folders):
+        n = len(folders[folder])
+        if n:
+            table.append([folder, count, count + n])
+            count += n
+    # 文件夹名称按 ASCII 转义写入（同样保留代理字符）
+    table_bytes = json.dumps(table, separators=(',', ':')).encode('ascii')
+
+    arrays_start = _align(_HEADER.size + len(table_bytes))
+    blob_start = arrays_start + (count + 1) * 8 + count * 16
+
+    offsets = array('Q', [0])
+    sizes = array('Q')
+    mtimes = array('q')
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            # 先写文件名块（位于定长数组之后），同时收集偏移、大小和修改时间
+            f.seek(blob_start)
+            blob_size = 0
+            for folder, _, _ in table:
+                for entry in folders[folder]:
+                    data = entry.name.encode(_ENCODING, _ERRORS)
+                    f.write(data)
+                    blob_size += len(data)
+                    offsets.append(blob_size)
+                    sizes.append(max(entry.size, 0))
+                    mtimes.append(entry.mtime_ns)
+
+            f.seek(0)
+            f.write(_HEADER.pack(PACKED_MAGIC, PACKED_VERSION, len(table), count, len(table_bytes), blob_size))
+            f.write(table_bytes)
+            f.write(b'\0' * (arrays_start - _HEADER.size - len(table_bytes)))
+            offsets.tofile(f)
+            sizes.tofile(f)
+            mtimes.tofile(f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+def build_packed_index(path: str, folders: Dict[str, Sequence]) -> Optional[PackedIndex]:
+    """
+    写入并打开紧凑索引
+
+    Args:
+        path: 索引文件路径
+        folders: {文件夹名称: 按文件名排序的 ScanEntry 序列}
+
+    Returns:
+        PackedIndex实例，失败时返回 None（调用方改用普通的内存索引）
+    """
+    try:
+        write_packed_index(path, folders)
+        index = PackedIndex(path)
+    except Exception as e:
+        logger.error(f"生成紧凑索引失败，使用内存索引: {str(e)}")
+        return None
+    logger.info(f"紧凑索引已生成: {len(index)} 张图片, {index.mapped_bytes()} 字节 ({path})")
+    return index
@@ -0,0 +1,285 @@
+"""
+多进程服务模块 - 主进程预先 fork 多个 gevent 工作进程共享监听端口
+
+主进程负责：创建监听套接字、预热文件夹索引（工作进程 fork 后直接继承）、
+运行唯一的文件监控并把变化广播给各工作进程、重启异常退出的工作进程、
+收到 SIGHUP 时平滑重启所有工作进程、收到 SIGTERM/SIGINT 时优雅退出。
+"""
+import os
+import time
+import errno
+import signal
+import socket
+import logging
+import threading
+import multiprocessing
+from typing import Dict, Tuple
+from .file_monitor import setup_file_monitor, apply_monitor_event, attach_event_stream
+from .logger import shutdown_logger
+from .metrics import write_snapshot, reset_shared_snapshots, archive_worker_snapshot
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 工作进程异常退出后，两次重启之间的最短间隔（秒），避免崩溃循环占满CPU
+RESTART_INTERVAL = 1.0
+
+
+def create_listener(host, port, backlog=2048, reuse_port=False) -> socket.socket:
+    """
+    创建监听套接字
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        backlog: 连接队列长度
+        reuse_port: 是否设置 SO_REUSEPORT（每个工作进程各自绑定同一端口）
+
+    Returns:
+        已开始监听的套接字
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class PreforkServer:
+    """
+    预派生多进程服务器
+
+    工作进程在 fork 之后才创建 Flask 应用（后台线程无法跨 fork 保留），
+    文件夹索引在主进程中预热后随 fork 以写时复制方式共享。
+    """
+
+    def __init__(self, app_factory, config, workers, host='0.0.0.0', port=50721,
+                 graceful_timeout=30.0, reuse_port=False):
+        """
+        初始化多进程服务器
+
+        Args:
+            app_factory: 工作进程中创建应用的函数，签名为 app_factory(config, file_monitor=False)
+            config: 配置类
+            workers: 工作进程数
+            host: 监听地址
+            port: 监听端口
+            graceful_timeout: 优雅退出时等待进行中请求的最长时间（秒）
+            reuse_port: 是否使用 SO_REUSEPORT 由内核在各工作进程间分配连接
+        """
+        self.app_factory = app_factory
+        self.config = config
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.graceful_timeout = graceful_timeout
+        self.reuse_port = reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        self.listener = None
+        # 工作进程：{pid: (代数, 事件管道发送端)}
+        self._children: Dict[int, Tuple[int, object]] = {}
+        self._generation = 0
+        self._stopping = False
+        self._reload = False
+        # 当前代工作进程是否已全部启动过（之后的补充视为崩溃重启，需要限速）
+        self._generation_started = False
+        self._last_restart = 0.0
+        # fork 与事件广播互斥，避免子进程继承到被其他线程持有的锁
+        self._fork_lock = threading.Lock()
+        self._monitor = None
+
+    def _broadcast(self, event) -> None:
+        """文件监控事件：主进程自身应用（供之后 fork 的进程继承），并发送给所有工作进程"""
+        with self._fork_lock:
+            apply_monitor_event(event)
+            for pid, (_, conn) in list(self._children.items()):
+                try:
+                    conn.send(event)
+                except (OSError, EOFError):
+                    # 工作进程已退出，由主循环回收
+                    pass
+
+    def _spawn_worker(self) -> int:
+        """fork 一个工作进程"""
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        with self._fork_lock:
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    writer.close()
+                    for _, conn in self._children.values():
+                        conn.close()
+                    self._children.clear()
+                    self._run_worker(reader)
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else 1
+                except BaseException:
+                    logger.exception("工作进程异常退出")
+                    code = 1
+                finally:
+                    # os._exit 不会执行 atexit，需主动写完剩余日志
+                    shutdown_logger()
+                    os._exit(code)
+            reader.close()
+            self._children[pid] = (self._generation, writer)
+        logger.info(f"工作进程已启动: pid={pid} (第 {self._generation} 代)")
+        return pid
+
+    def _run_worker(self, conn) -> None:
+        """工作进程主体：创建应用并在共享的监听套接字上提供服务"""
+        import gevent
+        from .wsgi_server import WSGIServer
+
+        gevent.reinit()
+        # 中断信号由主进程统一处理；SIGTERM 触发优雅退出
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+        app = self.app_factory(self.config, file_monitor=False)
+        attach_event_stream(conn)
+
+        listener = self.listener
+        if listener is None:
+            listener = create_listener(self.host, self.port, reuse_port=True)
+        server = WSGIServer(listener, app, log=None)
+
+        def graceful_stop():
+            logger.info(f"工作进程 {os.getpid()} 正在退出...")
+            server.stop(timeout=self.graceful_timeout)
+
+        gevent.signal_handler(signal.SIGTERM, lambda: gevent.spawn(graceful_stop))
+        try:
+            server.serve_forever()
+        finally:
+            # 退出前写出最后的指标，由主进程合并到归档
+            write_snapshot()
+            render_pool = getattr(app, 'render_pool', None)
+            if render_pool is not None:
+                render_pool.shutdown()
+
+    def _reap(self) -> None:
+        """回收已退出的工作进程，异常退出的（本代）工作进程由主循环补充"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            child = self._children.pop(pid, None)
+            if child is None:
+                continue
+            child[1].close()
+            if self.config.METRICS_ENABLED:
+                archive_worker_snapshot(self.config.METRICS_DIR, pid)
+            code = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+            if child[0] == self._generation and not self._stopping:
+                logger.warning(f"工作进程异常退出: pid={pid}, 退出码={code}")
+            else:
+                logger.info(f"工作进程已退出: pid={pid}")
+
+    def _current_workers(self):
+        """当前代的工作进程"""
+        return [pid for pid, (generation, _) in self._children.items() if generation == self._generation]
+
+    def _maintain(self) -> None:
+        """保持当前代的工作进程数量（崩溃重启限速）"""
+        missing = self.workers - len(self._current_workers())
+        for _ in range(missing):
+            if self._generation_started:
+                now = time.monotonic()
+                if now - self._last_restart < RESTART_INTERVAL:
+                    return
+                self._last_restart = now
+            self._spawn_worker()
+        self._generation_started = True
+
+    def _signal_workers(self, pids, sig) -> None:
+        """向工作进程发送信号（忽略已退出的进程）"""
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def _do_reload(self) -> None:
+        """平滑重启：先启动新一代工作进程，再让旧进程处理完进行中的请求后退出"""
+        old = list(self._children)
+        self._generation += 1
+        self._generation_started = False
+        logger.info(f"收到重载信号，启动第 {self._generation} 代工作进程")
+        for _ in range(self.workers):
+            self._spawn_worker()
+        self._generation_started = True
+        self._signal_workers(old, signal.SIGTERM)
+
+    def _handle_signal(self, signum, frame) -> None:
+        """主进程信号处理：只设置标志，由主循环处理"""
+        if signum == signal.SIGHUP:
+            self._reload = True
+        elif signum in (signal.SIGTERM, signal.SIGINT):
+            self._stopping = True
+
+    def run(self) -> None:
+        """启动主进程：监听端口、启动文件监控、派生工作进程并进入监督循环"""
+        if not self.reuse_port:
+            self.listener = create_listener(self.host, self.port)
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._handle_signal)
+        # SIGCHLD 只用于唤醒主循环（time.sleep 在信号后会继续，回收由轮询完成）
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        config = self.config
+        if config.METRICS_ENABLED:
+            # 指标从本次启动开始累计
+            reset_shared_snapshots(config.METRICS_DIR)
+        self._monitor = setup_file_monitor(config.IMAGE_BASE, config.IMAGE_EXTENSIONS,
+                                           config.MONITOR_DEBOUNCE, config.MONITOR_MAX_DELAY,
+                                           sink=self._broadcast)
+        logger.info(f"主进程 {os.getpid()} 启动于 {self.host}:{self.port}，工作进程数: {self.workers}"
+                    f"{'（SO_REUSEPORT）' if self.reuse_port else ''}")
+
+        try:
+            while not self._stopping:
+                self._reap()
+                if self._reload:
+                    self._reload = False
+                    self._do_reload()
+                self._maintain()
+                time.sleep(0.2)
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        """通知所有工作进程优雅退出，超时后强制结束"""
+        logger.info("正在停止所有工作进程...")
+        self._stopping = True
+        self._signal_workers(list(self._children), signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self._children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        if self._children:
+            logger.warning(f"强制结束未退出的工作进程: {list(self._children)}")
+            self._signal_workers(list(self._children), signal.SIGKILL)
+            for pid in list(self._children):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+                self._children.pop(pid)[1].close()
+
+        if self._monitor is not None:
+            self._monitor.stop()
+            self._monitor.handler.stop()
+            self._monitor.join()
+        if self.listener is not None:
+            self.listener.close()
+        logger.info("主进程已停止")
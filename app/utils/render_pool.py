@@ -0,0 +1,237 @@
+"""
+图像处理进程池模块 - 将 CPU 密集的 Pillow 解码/编码移出 gevent 事件循环
+"""
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Optional
+
+import time
+
+try:
+    from gevent import get_hub, sleep as gevent_sleep
+except ImportError:  # 未安装 gevent 时只使用阻塞等待
+    get_hub = gevent_sleep = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class RenderBusyError(RuntimeError):
+    """图像处理队列已满或等待超时"""
+
+
+def wait_result(future, timeout=None):
+    """
+    等待 concurrent.futures.Future 的结果
+
+    在主线程（gevent 服务器所在线程）中，阻塞等待交给 gevent 线程池完成，
+    当前 greenlet 让出控制权；在后台线程中直接阻塞等待。
+
+    Args:
+        future: Future 对象
+        timeout: 超时时间（秒）
+
+    Returns:
+        Future 的结果
+    """
+    if get_hub is not None and threading.current_thread() is threading.main_thread():
+        return get_hub().threadpool.spawn(future.result, timeout).get()
+    return future.result(timeout)
+
+
+def wait_seconds(seconds: float) -> None:
+    """
+    等待一段时间（如进程池繁忙时退避重试）
+
+    在主线程中让出 gevent 事件循环，其他连接可以继续处理；在后台线程中直接阻塞。
+
+    Args:
+        seconds: 等待时间（秒）
+    """
+    if gevent_sleep is not None and threading.current_thread() is threading.main_thread():
+        gevent_sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+
+class RenderPool:
+    """
+    图像处理进程池
+
+    任务在独立进程中执行，等待结果时通过 wait_result 让出事件循环，
+    其他连接可以继续处理。
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 64, timeout: float = 30.0):
+        """
+        初始化进程池
+
+        Args:
+            workers: 子进程数
+            max_pending: 排队及执行中的任务数上限（超过时立即拒绝）
+            timeout: 等待单个任务结果的超时时间（秒）
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        # spawn 启动的子进程不继承父进程的线程、锁和 gevent 状态
+        self._executor = ProcessPoolExecutor(max_workers=workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _task_done(self, future) -> None:
+        """任务完成回调（在进程池管理线程中执行）"""
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    def submit(self, func, *args) -> Future:
+        """
+        提交任务到进程池，不等待结果
+
+        Args:
+            func: 模块级函数（需可被子进程导入）
+            *args: 可序列化的参数
+
+        Returns:
+            Future 对象（通过 wait_result 等待）
+
+        Raises:
+            RenderBusyError: 队列已满
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise RenderBusyError(f"图像处理队列已满 ({self.pending}/{self.max_pending})")
+            self.pending += 1
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(self._task_done)
+        return future
+
+    def run(self, func, *args, timeout: Optional[float] = None):
+        """
+        在进程池中执行函数并等待结果
+
+        Args:
+            func: 模块级函数（需可被子进程导入）
+            *args: 可序列化的参数
+            timeout: 超时时间（秒），为空时使用默认值
+
+        Returns:
+            函数返回值
+
+        Raises:
+            RenderBusyError: 队列已满或等待超时
+        """
+        future = self.submit(func, *args)
+        try:
+            return wait_result(future, timeout or self.timeout)
+        except FutureTimeoutError:
+            # 子进程中的任务无法中断，结果完成后丢弃
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise RenderBusyError(f"图像处理超时 ({timeout or self.timeout}秒)")
+
+    def stats(self):
+        """
+        获取进程池统计信息
+
+        Returns:
+            包含执行中、完成、拒绝及超时次数的字典
+        """
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
+
+    def shutdown(self) -> None:
+        """关闭进程池（不等待排队中的任务）"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 进程池实例（由 setup_render_pool 在应用启动时初始化，为 None 时在当前线程中直接执行）
+render_pool: Optional[RenderPool] = None
+
+
+def setup_render_pool(workers=2, max_pending=64, timeout=30.0) -> Optional[RenderPool]:
+    """
+    初始化图像处理进程池
+
+    Args:
+        workers: 子进程数，0 表示不使用进程池（在请求线程中直接处理）
+        max_pending: 排队及执行中的任务数上限
+        timeout: 等待单个任务结果的超时时间（秒）
+
+    Returns:
+        RenderPool实例或None
+    """
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown()
+        render_pool = None
+    if workers <= 0:
+        return None
+
+    render_pool = RenderPool(workers, max_pending, timeout)
+    logger.info(f"图像处理进程池已启动: {workers} 个进程, 队列上限 {max_pending}")
+    return render_pool
+
+
+def run_render(func, *args):
+    """
+    执行图像处理函数（已初始化进程池时在子进程中执行）
+
+    Args:
+        func: image_render 模块中的渲染函数
+        *args: 可序列化的参数
+
+    Returns:
+        函数返回值
+
+    Raises:
+        RenderBusyError: 队列已满或等待超时
+    """
+    if render_pool is None:
+        return func(*args)
+    return render_pool.run(func, *args)
+
+
+def submit_render(func, *args) -> Future:
+    """
+    提交图像处理任务，不等待结果（未初始化进程池时在当前线程中直接执行）
+
+    Args:
+        func: image_render 模块中的函数
+        *args: 可序列化的参数
+
+    Returns:
+        Future 对象
+
+    Raises:
+        RenderBusyError: 队列已满
+    """
+    if render_pool is not None:
+        return render_pool.submit(func, *args)
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
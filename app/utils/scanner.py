@@ -0,0 +1,109 @@
+"""
+目录扫描工具模块 - 基于 os.scandir 的统一图像目录扫描
+"""
+import os
+import logging
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class ScanEntry(NamedTuple):
+    """扫描得到的图像文件信息"""
+    name: str       # 文件名
+    size: int       # 文件大小（字节），未获取时为 0
+    mtime_ns: int   # 修改时间（纳秒），未获取时为 0
+
+
+@lru_cache(maxsize=32)
+def _suffixes(extensions: frozenset) -> Tuple[str, ...]:
+    """将扩展名集合预处理为小写后缀元组（供 str.endswith 一次匹配）"""
+    return tuple(ext.lower() for ext in extensions)
+
+
+def get_image_suffixes(image_extensions: Iterable[str]) -> Tuple[str, ...]:
+    """
+    获取预处理后的图像后缀元组
+
+    Args:
+        image_extensions: 支持的图像扩展名集合
+
+    Returns:
+        小写后缀元组
+    """
+    return _suffixes(frozenset(image_extensions))
+
+
+def is_image_name(name: str, image_extensions: Iterable[str]) -> bool:
+    """
+    检查文件名是否为支持的图像格式
+
+    Args:
+        name: 文件名
+        image_extensions: 支持的图像扩展名集合
+
+    Returns:
+        是否为图像文件名
+    """
+    return name.lower().endswith(get_image_suffixes(image_extensions))
+
+
+def scan_images(folder_path: str, image_extensions: Iterable[str], with_stat: bool = False) -> List[ScanEntry]:
+    """
+    扫描文件夹中的图像文件
+
+    使用 os.scandir 返回的 DirEntry 类型信息判断是否为文件，普通文件无需
+    额外的 stat 调用；with_stat 为 True 时每个图像文件只 stat 一次。
+    目录项名称不含路径分隔符，因此无需逐项做路径遍历检查。
+
+    Args:
+        folder_path: 文件夹路径（调用方需已通过 get_safe_path 校验）
+        image_extensions: 支持的图像扩展名集合
+        with_stat: 是否获取文件大小和修改时间
+
+    Returns:
+        按文件名排序的 ScanEntry 列表
+    """
+    suffixes = get_image_suffixes(image_extensions)
+    entries = []
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            name = entry.name
+            if not name.lower().endswith(suffixes):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                if with_stat:
+                    st = entry.stat()
+                    entries.append(ScanEntry(name, st.st_size, st.st_mtime_ns))
+                else:
+                    entries.append(ScanEntry(name, 0, 0))
+            except OSError:
+                # 扫描期间文件被删除
+                continue
+    entries.sort()
+    return entries
+
+
+def list_subfolders(image_base: str) -> List[str]:
+    """
+    列出图像基础目录下的所有子文件夹
+
+    Args:
+        image_base: 图像基础目录
+
+    Returns:
+        子文件夹名称列表
+    """
+    folders = []
+    with os.scandir(image_base) as it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    folders.append(entry.name)
+            except OSError:
+                continue
+    return folders
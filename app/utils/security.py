@@ -2,16 +2,19 @@
 安全相关工具模块
 """
 import os
-import time
 import ipaddress
 import logging
-from flask import request
+from bisect import bisect_right
+from functools import lru_cache
+from flask import request, g, current_app
+from .ban_store import BanStore
+from .metrics import registry, BAN_CHECKS, BANS_ADDED
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 存储封禁信息（结构：{ip: {path: (end_time, is_directory)}}）
-ban_records = {}
+# 封禁存储（由 setup_ban_store 在应用启动时替换为配置的状态后端）
+ban_store = BanStore()
 
 def get_safe_path(base, *paths):
     """
@@ -32,6 +35,29 @@ def get_safe_path(base, *paths):
     return full_path  # 安全路径
 
 
+def setup_ban_store(store):
+    """
+    设置封禁存储（进程内 BanStore 或共享状态后端）
+    
+    Args:
+        store: 提供 is_banned / add_ban / cleanup 的封禁存储
+        
+    Returns:
+        封禁存储
+    """
+    global ban_store
+    ban_store = store
+    return ban_store
+
+
+def _banned_ip_count():
+    """封禁表中的IP数量（Redis 后端无此统计时返回 None）"""
+    return ban_store.stats().get('banned_ips')
+
+
+registry.gauge('ria_banned_ips', '封禁表中的IP数量', _banned_ip_count)
+
+
 def is_banned(client_ip, path, ban_duration):
     """
     检查指定IP和路径是否已被封禁
@@ -44,53 +70,11 @@ def is_banned(client_ip, path, ban_duration):
     Returns:
         (是否被封禁, 剩余时间, 结束时间)
     """
-    # 快速检查：如果IP不在记录中，直接返回
-    if client_ip not in ban_records:
-        return False, 0, 0
-
-    current_time = time.time()
-    ip_records = ban_records[client_ip]
-
-    # 1. 检查精确路径匹配（优化：直接查询字典）
-    if path in ip_records:
-        end_time, _ = ip_records[path]
-        if current_time < end_time:
-            return True, max(0, end_time - current_time), end_time
-
-    # 2. 检查全局IP封禁（新增功能：全局IP封禁）
-    if '*' in ip_records:
-        end_time, _ = ip_records['*']
-        if current_time < end_time:
-            return True, max(0, end_time - current_time), end_time
-
-    # 3. 检查目录封禁（优化：预处理路径）
-    # 规范化请求路径，移除尾部斜杠以便一致性比较
-    normalized_path = path.rstrip('/')
-    path_parts = normalized_path.split('/')
-    
-    # 构建可能的父目录路径列表，从最具体到最一般
-    possible_parent_paths = []
-    for i in range(len(path_parts), 0, -1):
-        parent_path = '/'.join(path_parts[:i])
-        if parent_path:
-            possible_parent_paths.append(parent_path)
-            possible_parent_paths.append(parent_path + '/')
-    
-    # 检查所有可能的父目录路径
-    for parent_path in possible_parent_paths:
-        if parent_path in ip_records:
-            end_time, is_directory = ip_records[parent_path]
-            if is_directory and current_time < end_time:
-                return True, max(0, end_time - current_time), end_time
-
-    return False, 0, 0
+    result = ban_store.is_banned(client_ip, path)
+    BAN_CHECKS.inc(('banned',) if result[0] else ('allowed',))
+    return result
 
 
-# 存储IP违规计数（用于智能封禁）
-ip_violation_counts = {}
-# 存储最后一次封禁时间（用于累进封禁）
-last_ban_times = {}
-
 def add_ban(client_ip, path, is_directory, ban_duration):
     """
     添加封禁记录，实现智能封禁机制
@@ -104,105 +88,98 @@ def add_ban(client_ip, path, is_directory, ban_duration):
     Returns:
         封禁结束时间
     """
-    current_time = time.time()
-    
-    # 更新违规计数
-    if client_ip not in ip_violation_counts:
-        ip_violation_counts[client_ip] = 1
-    else:
-        ip_violation_counts[client_ip] += 1
-    
-    # 计算智能封禁时长（累进制）
-    violation_count = ip_violation_counts[client_ip]
-    
-    # 检查是否是短时间内重复违规（30分钟内）
-    repeated_violation = False
-    if client_ip in last_ban_times:
-        time_since_last_ban = current_time - last_ban_times[client_ip]
-        if time_since_last_ban < 1800:  # 30分钟
-            repeated_violation = True
-    
-    # 记录本次封禁时间
-    last_ban_times[client_ip] = current_time
-    
-    # 计算实际封禁时长
-    actual_ban_duration = ban_duration
-    
-    # 累进封禁策略
-    if repeated_violation:
-        # 短时间内重复违规，封禁时间翻倍
-        actual_ban_duration = ban_duration * min(2 ** (violation_count - 1), 24)  # 最多封禁24倍时长
-    elif violation_count > 1:
-        # 非短时间重复但有历史违规，增加50%时长
-        actual_ban_duration = ban_duration * min(1.5 * (violation_count - 1), 12)  # 最多增加12倍
-    
-    # 获取该IP的封禁结束时间（如果已有封禁则使用相同结束时间）
-    if client_ip in ban_records:
-        # 查找该IP现有的最长封禁结束时间
-        ip_records = ban_records[client_ip]
-        existing_end_time = None
-        
-        for record in ip_records.values():
-            if record[0] > current_time and (existing_end_time is None or record[0] > existing_end_time):
-                existing_end_time = record[0]
-        
-        # 如果已有封禁时间，取较长的一个
-        if existing_end_time:
-            end_time = max(existing_end_time, current_time + actual_ban_duration)
-        else:
-            end_time = current_time + actual_ban_duration
-    else:
-        # 新IP封禁
-        end_time = current_time + actual_ban_duration
-        ban_records[client_ip] = {}
-    
-    # 添加封禁记录
-    ban_records[client_ip][path] = (end_time, is_directory)
-    
-    # 对于严重违规（多次违规），考虑添加全局IP封禁
-    if violation_count >= 5 or (repeated_violation and violation_count >= 3):
-        ban_records[client_ip]['*'] = (end_time, False)  # 全局封禁标记
-    
-    return end_time
+    BANS_ADDED.inc()
+    return ban_store.add_ban(client_ip, path, is_directory, ban_duration)
 
 
 def cleanup_bans():
     """
-    清理过期封禁记录和过期违规计数
+    清理过期封禁记录和过期违规计数（只处理已到期的部分，可在每个请求中调用）
+    """
+    ban_store.cleanup()
+
+
+class TrustedProxyMatcher:
+    """
+    可信代理匹配器
+
+    启动时将可信代理 CIDR 列表编译为按起始地址排序、合并后的整数区间（IPv4/IPv6 分开），
+    查询时二分查找；重复出现的 remote_addr 由 LRU 缓存直接返回结果。
     """
-    current_time = time.time()
-    ips_to_remove = []
-    
-    # 清理封禁记录
-    for ip, records in list(ban_records.items()):
-        # 移除过期记录
-        valid_records = {}
-        for path, (end_time, is_directory) in records.items():
-            if end_time > current_time:
-                valid_records[path] = (end_time, is_directory)
-
-        # 更新或移除IP记录
-        if valid_records:
-            ban_records[ip] = valid_records
-        else:
-            ips_to_remove.append(ip)
-
-    # 移除无记录的IP
-    for ip in ips_to_remove:
-        del ban_records[ip]
-    
-    # 清理过期违规计数（超过7天的违规记录）
-    ips_to_reset = []
-    for ip, last_time in list(last_ban_times.items()):
-        if current_time - last_time > 604800:  # 7天 = 604800秒
-            ips_to_reset.append(ip)
-    
-    # 重置过期违规计数
-    for ip in ips_to_reset:
-        if ip in ip_violation_counts:
-            del ip_violation_counts[ip]
-        if ip in last_ban_times:
-            del last_ban_times[ip]
+
+    def __init__(self, trusted_proxies=None, cache_size=4096):
+        """
+        编译可信代理列表
+
+        Args:
+            trusted_proxies: 可信代理列表（CIDR格式），如 ['192.168.1.0/24', '10.0.0.0/8']
+            cache_size: remote_addr 判定结果的 LRU 缓存大小
+        """
+        intervals = {4: [], 6: []}
+        for proxy_range in trusted_proxies or []:
+            try:
+                network = ipaddress.ip_network(proxy_range, strict=False)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"无效的可信代理配置: {proxy_range}, 错误: {e}")
+                continue
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+        # 排序并合并重叠或相邻的区间
+        self._starts = {}
+        self._ends = {}
+        for version, ranges in intervals.items():
+            merged = []
+            for start, end in sorted(ranges):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self._starts[version] = [start for start, _ in merged]
+            self._ends[version] = [end for _, end in merged]
+        self.enabled = any(self._starts.values())
+        self.is_trusted = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, remote_addr):
+        """判断地址是否属于可信代理（无效地址视为不可信）"""
+        try:
+            addr = ipaddress.ip_address(remote_addr)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"无效的客户端IP: {remote_addr}, 错误: {e}")
+            return False
+        if addr.version == 6 and addr.ipv4_mapped is not None:
+            addr = addr.ipv4_mapped
+        starts = self._starts[addr.version]
+        value = int(addr)
+        i = bisect_right(starts, value) - 1
+        return i >= 0 and value <= self._ends[addr.version][i]
+
+
+@lru_cache(maxsize=4096)
+def _is_valid_ip(value):
+    """检查字符串是否为有效的IP地址（带缓存）"""
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+
+@lru_cache(maxsize=32)
+def _compile_trusted_proxies(trusted_proxies):
+    """将可信代理列表编译为匹配器（按列表内容缓存）"""
+    return TrustedProxyMatcher(list(trusted_proxies))
+
+
+# 按优先级检查的代理头（仅当请求来自可信代理时）
+PROXY_HEADERS = (
+    'X-Real-IP',         # 优先检查X-Real-IP
+    'X-Forwarded-For',
+    'CF-Connecting-IP',  # Cloudflare
+    'True-Client-IP',    # Akamai/Cloudflare
+    'X-Client-IP',       # Amazon CloudFront
+    'Fastly-Client-IP',  # Fastly
+    'X-Cluster-Client-IP'
+)
 
 
 def get_real_ip(trusted_proxies=None):
@@ -210,61 +187,50 @@ def get_real_ip(trusted_proxies=None):
     获取客户端真实IP地址，支持多种代理头（安全版本）
     
     Args:
-        trusted_proxies: 可信代理IP列表（CIDR格式），如 ['192.168.1.0/24', '10.0.0.0/8']
+        trusted_proxies: TrustedProxyMatcher，或可信代理IP列表（CIDR格式），如 ['192.168.1.0/24', '10.0.0.0/8']
     
     Returns:
         客户端IP地址
     """
-    # 如果没有配置可信代理，只信任直接连接的IP
-    if not trusted_proxies:
-        return request.remote_addr
-    
-    # 检查请求是否来自可信代理
     remote_addr = request.remote_addr
-    is_trusted = False
     
-    try:
-        client_ip = ipaddress.ip_address(remote_addr)
-        for proxy_range in trusted_proxies:
-            try:
-                if client_ip in ipaddress.ip_network(proxy_range, strict=False):
-                    is_trusted = True
-                    break
-            except (ValueError, TypeError) as e:
-                logger.warning(f"无效的可信代理配置: {proxy_range}, 错误: {e}")
-                continue
-    except (ValueError, TypeError) as e:
-        logger.warning(f"无效的客户端IP: {remote_addr}, 错误: {e}")
+    # 如果没有配置可信代理，只信任直接连接的IP
+    if not trusted_proxies:
         return remote_addr
+    matcher = trusted_proxies
+    if not isinstance(matcher, TrustedProxyMatcher):
+        matcher = _compile_trusted_proxies(tuple(trusted_proxies))
     
     # 如果不是来自可信代理，返回直接连接的IP
-    if not is_trusted:
+    if not matcher.enabled or not matcher.is_trusted(remote_addr):
         return remote_addr
     
-    # 按优先级检查各种代理头（仅当来自可信代理时）
-    headers_to_check = [
-        'X-Real-IP',         # 优先检查X-Real-IP
-        'X-Forwarded-For',
-        'CF-Connecting-IP',  # Cloudflare
-        'True-Client-IP',    # Akamai/Cloudflare
-        'X-Client-IP',       # Amazon CloudFront
-        'Fastly-Client-IP',  # Fastly
-        'X-Cluster-Client-IP'
-    ]
-    
-    for header in headers_to_check:
-        if header in request.headers:
-            value = request.headers.get(header, '')
-            if value:
-                # 如果是逗号分隔的列表（如X-Forwarded-For），取第一个值
-                ip = value.split(',')[0].strip()
-                # 验证IP格式
-                try:
-                    ipaddress.ip_address(ip)
-                    return ip
-                except ValueError:
-                    logger.warning(f"无效的IP地址在头 {header}: {ip}")
-                    continue
+    for header in PROXY_HEADERS:
+        value = request.headers.get(header, '')
+        if value:
+            # 如果是逗号分隔的列表（如X-Forwarded-For），取第一个值
+            ip = value.split(',')[0].strip()
+            # 验证IP格式
+            if _is_valid_ip(ip):
+                return ip
+            logger.warning(f"无效的IP地址在头 {header}: {ip}")
     
     # 如果没有找到有效的代理头，使用远程地址
     return remote_addr
+
+
+def get_client_ip():
+    """
+    获取当前请求的客户端IP（每个请求只解析一次，结果保存在 g.client_ip）
+    
+    使用应用启动时编译的可信代理匹配器（app.proxy_matcher），
+    限流器、封禁检查和错误处理共用同一结果。
+    
+    Returns:
+        客户端IP地址
+    """
+    client_ip = g.get('client_ip')
+    if client_ip is None:
+        client_ip = get_real_ip(getattr(current_app, 'proxy_matcher', None))
+        g.client_ip = client_ip
+    return client_ip
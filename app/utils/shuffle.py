@@ -0,0 +1,156 @@
+"""
+洗牌取图模块 - 每个客户端按自己的随机排列依次取图
+
+每个客户端（X-Client-Key 请求头、Cookie 或 IP）在每个文件夹上只保存一个计数器：
+第 k 次取图时，k 除以图片数得到轮次和轮内序号，再用以（客户端, 文件夹, 轮次）为种子的
+Feistel 置换把序号映射为图片下标。排列按需计算，不需要保存打乱后的列表，
+每次取图 O(1) 时间、每个客户端 O(1) 状态；一轮取完之前不会重复，下一轮换一个排列。
+计数器保存在共享状态后端中，配置 Redis 时多个进程共用同一进度。
+文件夹图片数变化后排列随之改变，当前一轮可能出现少量重复。
+"""
+import hashlib
+import random
+from typing import Optional
+from flask import request
+from .security import get_client_ip
+
+# 客户端标识请求头（API 调用方可用固定的令牌代替 Cookie）
+CLIENT_KEY_HEADER = 'X-Client-Key'
+
+# Feistel 轮数（4 轮即可使置换与随机排列难以区分）
+FEISTEL_ROUNDS = 4
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN64 = 0x9E3779B97F4A7C15
+
+# 洗牌取图器（由 setup_shuffle_bag 在应用启动时初始化）
+shuffle_bag: Optional['ShuffleBag'] = None
+
+
+def _mix64(x: int) -> int:
+    """splitmix64 混合函数：把 64 位整数均匀打散"""
+    x &= _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+def permute(index: int, n: int, seed: int) -> int:
+    """
+    [0, n) 上由种子确定的随机置换
+
+    在不小于 n 的 2^(2h) 定义域上做平衡 Feistel 置换，结果不小于 n 时继续置换
+    （循环行走），定义域小于 4n，平均不超过 4 次即可落回 [0, n)。
+
+    Args:
+        index: 序号，范围 [0, n)
+        n: 定义域大小
+        seed: 64 位种子
+
+    Returns:
+        置换后的下标
+    """
+    if n <= 1:
+        return 0
+    half = ((n - 1).bit_length() + 1) // 2
+    mask = (1 << half) - 1
+    x = index
+    while True:
+        left, right = x >> half, x & mask
+        for r in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ (_mix64(seed + r * _GOLDEN64 + right) & mask)
+        x = (left << half) | right
+        if x < n:
+            return x
+
+
+class ShuffleBag:
+    """基于共享状态后端计数器的洗牌取图器"""
+
+    def __init__(self, backend, ttl: float):
+        """
+        初始化洗牌取图器
+
+        Args:
+            backend: 提供 incr(键, 过期秒数) 的状态后端
+            ttl: 客户端进度的保留时间（秒）
+        """
+        self.backend = backend
+        self.ttl = ttl
+
+    def draw(self, client_key: str, scope: str, n: int) -> int:
+        """
+        为客户端取下一张图的下标
+
+        Args:
+            client_key: 客户端标识
+            scope: 取图范围（文件夹名称，全局随机使用空字符串）
+            n: 图片数量
+
+        Returns:
+            [0, n) 中的下标；状态后端不可用时退化为独立随机
+        """
+        digest = hashlib.blake2b(f'{client_key}\0{scope}'.encode('utf-8', 'surrogateescape'),
+                                 digest_size=16).digest()
+        position = self.backend.incr('shuffle:' + digest.hex(), self.ttl)
+        if position is None:
+            return random.randrange(n)
+        round_, index = divmod(position - 1, n)
+        seed = _mix64(int.from_bytes(digest[:8], 'little') ^ _mix64(round_))
+        return permute(index, n, seed)
+
+
+def setup_shuffle_bag(backend, ttl):
+    """
+    初始化洗牌取图器
+
+    Args:
+        backend: 共享状态后端，None 表示不启用（每次独立随机）
+        ttl: 客户端进度的保留时间（秒）
+
+    Returns:
+        ShuffleBag实例或 None
+    """
+    global shuffle_bag
+    shuffle_bag = ShuffleBag(backend, ttl) if backend is not None else None
+    return shuffle_bag
+
+
+def get_client_key(cookie_name: str = '') -> str:
+    """
+    获取当前请求的客户端标识：X-Client-Key 请求头、指定的 Cookie，都没有时使用客户端IP
+
+    同一IP下的多个客户端共用一个排列，各自看到的仍是排列的一部分，一轮内同样不会重复。
+
+    Args:
+        cookie_name: 标识客户端的 Cookie 名称（如站点的会话 Cookie），留空不使用
+
+    Returns:
+        客户端标识
+    """
+    token = request.headers.get(CLIENT_KEY_HEADER)
+    if token:
+        return 'k:' + token[:256]
+    if cookie_name:
+        cookie = request.cookies.get(cookie_name)
+        if cookie:
+            return 'c:' + cookie[:256]
+    return 'ip:' + get_client_ip()
+
+
+def make_picker(cookie_name: str, scope: str):
+    """
+    生成按当前客户端洗牌顺序取下标的函数（未初始化时返回 None，即独立随机）
+
+    Args:
+        cookie_name: 标识客户端的 Cookie 名称（留空不使用）
+        scope: 取图范围（文件夹名称，全局随机使用空字符串）
+
+    Returns:
+        pick(n) -> 下标 的函数或 None
+    """
+    bag = shuffle_bag
+    if bag is None:
+        return None
+    client_key = get_client_key(cookie_name)
+    return lambda n: bag.draw(client_key, scope, n)
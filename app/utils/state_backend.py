@@ -0,0 +1,431 @@
+"""
+共享状态后端模块 - 封禁记录、违规计数、限流存储及通用计数器的可插拔后端
+
+- memory：进程内存储（默认），单进程部署使用
+- redis：多个进程/多台机器共享封禁与限流状态，写入使用管道合并往返，
+  读取带有短时本地缓存；Redis 调用交给 gevent 线程池执行，不阻塞事件循环
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Optional, Tuple
+from .ban_store import (BanStore, split_path, progressive_duration, is_severe_violation,
+                        VIOLATION_TTL, REPEAT_WINDOW)
+
+try:
+    import redis
+except ImportError:  # 未安装 redis 时只能使用内存后端
+    redis = None
+
+try:
+    from gevent import get_hub
+except ImportError:  # 未安装 gevent 时直接阻塞调用
+    get_hub = None
+
+try:
+    from limits.storage import RedisStorage
+except ImportError:  # 未安装 limits 时不提供限流存储
+    RedisStorage = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 封禁哈希中的记录字段（其余字段为 f:<路径> / d:<路径>）
+_BOOKKEEPING_FIELDS = ('__max', '*')
+
+
+def _run_blocking(func, *args):
+    """
+    执行阻塞的 Redis 调用
+
+    在主线程（gevent 服务器所在线程）中交给 gevent 线程池执行，当前 greenlet
+    让出控制权，其他连接可以继续处理；在后台线程中直接调用。
+
+    Args:
+        func: 要调用的函数
+        *args: 函数参数
+
+    Returns:
+        函数的返回值
+    """
+    if get_hub is not None and threading.current_thread() is threading.main_thread():
+        return get_hub().threadpool.spawn(func, *args).get()
+    return func(*args)
+
+
+if RedisStorage is not None:
+    class GeventRedisStorage(RedisStorage):
+        """
+        在 gevent 线程池中执行 Redis 调用的限流存储
+
+        flask-limiter 的 Redis 存储每个请求都会同步访问 Redis，直接在事件循环中调用时
+        一次往返会阻塞进程内所有连接。地址使用 gevent+redis:// 等前缀注册到 limits，
+        连接时去掉前缀交给 RedisStorage，限流相关的调用均通过 _run_blocking 执行。
+        """
+
+        STORAGE_SCHEME = ['gevent+redis', 'gevent+rediss', 'gevent+redis+unix']
+        URI_PREFIX = 'gevent+'
+
+        def __init__(self, uri: str, **options):
+            super().__init__(uri[len(self.URI_PREFIX):], **options)
+
+        def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+            return _run_blocking(super().incr, key, expiry, amount)
+
+        def get(self, key: str) -> int:
+            return _run_blocking(super().get, key)
+
+        def get_expiry(self, key: str) -> float:
+            return _run_blocking(super().get_expiry, key)
+
+        def clear(self, key: str) -> None:
+            return _run_blocking(super().clear, key)
+
+        def check(self) -> bool:
+            return _run_blocking(super().check)
+
+        def reset(self):
+            return _run_blocking(super().reset)
+
+        def acquire_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+            return _run_blocking(super().acquire_entry, key, limit, expiry, amount)
+
+        def get_moving_window(self, key: str, limit: int, expiry: int):
+            return _run_blocking(super().get_moving_window, key, limit, expiry)
+
+        def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+            return _run_blocking(super().acquire_sliding_window_entry, key, limit, expiry, amount)
+
+        def get_sliding_window(self, key: str, expiry: int):
+            return _run_blocking(super().get_sliding_window, key, expiry)
+
+        def clear_sliding_window(self, key: str, expiry: int) -> None:
+            return _run_blocking(super().clear_sliding_window, key, expiry)
+
+
+class MemoryStateBackend(BanStore):
+    """进程内状态后端（封禁存储即 BanStore，限流使用内存存储）"""
+
+    name = 'memory'
+    limiter_storage_uri = 'memory://'
+
+    def __init__(self, max_ips: int = 100000, max_paths_per_ip: int = 256, max_counters: int = 100000):
+        """
+        初始化内存状态后端
+
+        Args:
+            max_ips: 最多记录的封禁IP数量
+            max_paths_per_ip: 单个IP最多记录的封禁路径数
+            max_counters: 最多保留的计数器数量（超过时淘汰最久未使用的）
+        """
+        super().__init__(max_ips, max_paths_per_ip)
+        self.max_counters = max_counters
+        # 计数器：{键: (当前值, 过期时间)}，按最近使用排序
+        self._counters: 'OrderedDict[str, Tuple[int, float]]' = OrderedDict()
+        self._counter_lock = Lock()
+
+    def incr(self, key: str, ttl: float) -> Optional[int]:
+        """
+        计数器加一并返回新值（ttl 秒内未再访问的计数器从 0 重新开始）
+
+        Args:
+            key: 计数器键
+            ttl: 过期时间（秒）
+
+        Returns:
+            加一后的值
+        """
+        now = time.monotonic()
+        with self._counter_lock:
+            value, expires = self._counters.get(key, (0, now))
+            value = value + 1 if expires > now else 1
+            self._counters[key] = (value, now + ttl)
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_counters:
+                self._counters.popitem(last=False)
+        return value
+
+
+class RedisStateBackend:
+    """
+    Redis 状态后端
+
+    每个IP的封禁记录保存在一个哈希中（字段 f:<路径> / d:<路径> / * 为结束时间，
+    __max 为最晚的结束时间），键在最晚的结束时间后过期，由 Redis 负责清理过期封禁；
+    违规计数保存在另一个哈希中，保留 7 天。
+    读取时每个IP的记录在本地缓存 local_ttl 秒，绝大多数未封禁IP的检查无需访问 Redis。
+    """
+
+    name = 'redis'
+
+    def __init__(self, client, limiter_storage_uri: str, key_prefix: str = 'ria:',
+                 max_paths_per_ip: int = 256, local_ttl: float = 1.0, local_size: int = 10000):
+        """
+        初始化 Redis 状态后端
+
+        Args:
+            client: Redis 客户端（需 decode_responses=True，可传入兼容的替身对象用于测试）
+            limiter_storage_uri: 限流器存储地址
+            key_prefix: 键名前缀
+            max_paths_per_ip: 单个IP最多记录的封禁路径数（超过后改为全局封禁）
+            local_ttl: 本地读缓存有效期（秒），0 表示不缓存
+            local_size: 本地读缓存最多缓存的IP数量
+        """
+        self.client = client
+        self.limiter_storage_uri = limiter_storage_uri
+        self.key_prefix = key_prefix
+        self.max_paths_per_ip = max_paths_per_ip
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        # 本地读缓存：{ip: (过期时间, {字段: 结束时间})}
+        self._local: 'OrderedDict[str, Tuple[float, Dict[str, float]]]' = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> 'RedisStateBackend':
+        """
+        根据 Redis 地址创建后端
+
+        Args:
+            url: Redis 地址，如 redis://localhost:6379/0
+            **kwargs: 传给构造函数的其他参数
+
+        Returns:
+            RedisStateBackend实例
+        """
+        if redis is None:
+            raise RuntimeError("使用 Redis 状态后端需要安装 redis 包: pip install redis")
+        client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=1.0,
+                                      socket_connect_timeout=1.0)
+        # 限流存储同样不能在事件循环中阻塞访问 Redis（见 GeventRedisStorage）
+        limiter_uri = url
+        if RedisStorage is not None and url.startswith(('redis://', 'rediss://', 'redis+unix://')):
+            limiter_uri = GeventRedisStorage.URI_PREFIX + url
+        return cls(client, limiter_uri, **kwargs)
+
+    def _ban_key(self, client_ip: str) -> str:
+        return f'{self.key_prefix}ban:{client_ip}'
+
+    def _violation_key(self, client_ip: str) -> str:
+        return f'{self.key_prefix}viol:{client_ip}'
+
+    def _load(self, client_ip: str) -> Dict[str, float]:
+        """读取IP的封禁记录（优先使用本地缓存）"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._local.get(client_ip)
+            if cached is not None and cached[0] > now:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        raw = _run_blocking(self.client.hgetall, self._ban_key(client_ip))
+        records = {field: float(value) for field, value in raw.items()}
+        if self.local_ttl > 0:
+            with self._lock:
+                self._local[client_ip] = (now + self.local_ttl, records)
+                self._local.move_to_end(client_ip)
+                while len(self._local) > self.local_size:
+                    self._local.popitem(last=False)
+        return records
+
+    def is_banned(self, client_ip: str, path: str, now: Optional[float] = None) -> Tuple[bool, float, float]:
+        """
+        检查指定IP和路径是否已被封禁（匹配顺序与 BanStore 一致）
+
+        Args:
+            client_ip: 客户端IP
+            path: 请求路径
+            now: 当前时间（默认 time.time()）
+
+        Returns:
+            (是否被封禁, 剩余时间, 结束时间)
+        """
+        try:
+            records = self._load(client_ip)
+        except Exception as e:
+            # Redis 不可用时放行请求，避免整个服务不可用
+            self.errors += 1
+            logger.error(f"读取封禁记录失败: {client_ip}, 错误: {str(e)}")
+            return False, 0, 0
+        if not records:
+            return False, 0, 0
+
+        if now is None:
+            now = time.time()
+        if records.get('__max', 0) <= now:
+            return False, 0, 0
+
+        parts = split_path(path)
+        # 1. 精确路径匹配
+        exact = '/' + '/'.join(parts)
+        end_time = max(records.get('f:' + exact, 0), records.get('d:' + exact, 0))
+        if end_time > now:
+            return True, end_time - now, end_time
+
+        # 2. 全局IP封禁
+        end_time = records.get('*', 0)
+        if end_time > now:
+            return True, end_time - now, end_time
+
+        # 3. 目录封禁（从最具体到最一般，不含根路径）
+        for i in range(len(parts) - 1, 0, -1):
+            end_time = records.get('d:/' + '/'.join(parts[:i]), 0)
+            if end_time > now:
+                return True, end_time - now, end_time
+        return False, 0, 0
+
+    def add_ban(self, client_ip: str, path: str, is_directory: bool, ban_duration: float,
+                now: Optional[float] = None) -> float:
+        """
+        添加封禁记录（累进封禁规则与 BanStore 一致，两次管道往返完成）
+
+        Args:
+            client_ip: 客户端IP
+            path: 请求路径
+            is_directory: 是否为目录
+            ban_duration: 基础封禁时长
+            now: 当前时间（默认 time.time()）
+
+        Returns:
+            封禁结束时间
+        """
+        if now is None:
+            now = time.time()
+        ban_key = self._ban_key(client_ip)
+        violation_key = self._violation_key(client_ip)
+
+        try:
+            # 第一次往返：更新违规计数并读取现有封禁状态
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hincrby(violation_key, 'count', 1)
+            pipe.hget(violation_key, 'last')
+            pipe.hset(violation_key, 'last', now)
+            pipe.expire(violation_key, VIOLATION_TTL)
+            pipe.hgetall(ban_key)
+            count, last_time, _, _, records = _run_blocking(pipe.execute)
+
+            repeated_violation = last_time is not None and now - float(last_time) < REPEAT_WINDOW
+            end_time = now + progressive_duration(ban_duration, count, repeated_violation)
+            max_end = float(records.get('__max', 0))
+            # 旧记录已全部过期（键尚未被 Redis 删除）时重新开始记录，与 BanStore 一致
+            stale = bool(records) and max_end <= now
+            if max_end > now:
+                end_time = max(end_time, max_end)
+                # 已记录的路径数（同一路径的文件和目录封禁算作一条，不含记录字段）
+                path_count = len({field[2:] for field in records if field not in _BOOKKEEPING_FIELDS})
+            else:
+                max_end = 0.0
+                path_count = 0
+
+            fields = {'__max': end_time}
+            if path_count >= self.max_paths_per_ip:
+                # 路径数量超过上限：不再记录新路径，直接全局封禁
+                fields['*'] = end_time
+            else:
+                fields[('d:' if is_directory else 'f:') + '/' + '/'.join(split_path(path))] = end_time
+            if is_severe_violation(count, repeated_violation):
+                fields['*'] = end_time
+
+            # 第二次往返：写入封禁记录，键在最晚结束时间后自动过期
+            pipe = self.client.pipeline(transaction=False)
+            if stale:
+                pipe.delete(ban_key)
+            pipe.hset(ban_key, mapping=fields)
+            pipe.expireat(ban_key, int(fields['__max']) + 1)
+            _run_blocking(pipe.execute)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"写入封禁记录失败: {client_ip}, 错误: {str(e)}")
+            end_time = now + ban_duration
+
+        # 本进程立即可见；其他进程在本地缓存过期后可见
+        with self._lock:
+            self._local.pop(client_ip, None)
+        return end_time
+
+    def incr(self, key: str, ttl: float) -> Optional[int]:
+        """
+        计数器加一并返回新值（一次管道往返，键在 ttl 秒内未再访问时过期）
+
+        Args:
+            key: 计数器键
+            ttl: 过期时间（秒）
+
+        Returns:
+            加一后的值，Redis 不可用时返回 None
+        """
+        counter_key = f'{self.key_prefix}ctr:{key}'
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.incr(counter_key)
+            pipe.expire(counter_key, int(ttl))
+            value, _ = _run_blocking(pipe.execute)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"更新计数器失败: {key}, 错误: {str(e)}")
+            return None
+        return int(value)
+
+    def cleanup(self, now: Optional[float] = None) -> int:
+        """过期封禁由 Redis 键过期自动清理，无需处理"""
+        return 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取后端统计信息
+
+        Returns:
+            包含本地缓存命中、未命中及错误次数的字典
+        """
+        with self._lock:
+            return {
+                'local_cache': len(self._local),
+                'local_hits': self.hits,
+                'local_misses': self.misses,
+                'errors': self.errors,
+            }
+
+
+def setup_state_backend(backend='memory', redis_url=None, key_prefix='ria:', max_ips=100000,
+                        max_paths_per_ip=256, local_ttl=1.0, max_counters=100000):
+    """
+    创建状态后端
+
+    Args:
+        backend: 后端类型（memory / redis）
+        redis_url: Redis 地址（redis 后端必填）
+        key_prefix: Redis 键名前缀
+        max_ips: 内存后端最多记录的封禁IP数量
+        max_paths_per_ip: 单个IP最多记录的封禁路径数
+        local_ttl: Redis 后端本地读缓存有效期（秒）
+        max_counters: 内存后端最多保留的计数器数量
+
+    Returns:
+        MemoryStateBackend 或 RedisStateBackend 实例
+
+    Raises:
+        RuntimeError: 配置了 redis 后端但缺少地址、未安装 redis 包或无法连接。
+            多进程部署时静默退回内存后端会让各进程的封禁和限流状态各自独立，
+            因此直接启动失败
+    """
+    if backend == 'redis':
+        if not redis_url:
+            raise RuntimeError("STATE_BACKEND=redis 但未设置 REDIS_URL")
+        state = RedisStateBackend.from_url(redis_url, key_prefix=key_prefix,
+                                           max_paths_per_ip=max_paths_per_ip, local_ttl=local_ttl)
+        try:
+            state.client.ping()
+        except Exception as e:
+            raise RuntimeError(f"无法连接 Redis 状态后端 {redis_url}: {str(e)}") from e
+        logger.info("共享状态后端: Redis")
+        return state
+    elif backend != 'memory':
+        logger.warning(f"未知的状态后端: {backend}，使用内存后端")
+
+    return MemoryStateBackend(max_ips, max_paths_per_ip, max_counters)
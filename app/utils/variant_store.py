@@ -0,0 +1,219 @@
+"""
+图像格式变体工具模块 - 后台生成 WebP/AVIF 等更小的编码，并按 Accept 请求头选择返回
+"""
+import os
+import queue
+import logging
+import threading
+from typing import Dict, Iterable, NamedTuple, Optional, Set, Tuple
+from PIL import features
+from .disk_cache import DiskLRUCache
+from .image_render import render_variant
+from .image_utils import register_derived_cache, unregister_derived_cache
+from .render_pool import run_render
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 支持的变体格式：格式名 -> (MIME类型, 文件后缀, Pillow 特性名)
+VARIANT_FORMATS = {
+    'avif': ('image/avif', '.avif', 'avif'),
+    'webp': ('image/webp', '.webp', 'webp'),
+}
+
+# 可以生成变体的原图后缀（GIF 可能是动图，WEBP 本身已足够小）
+SOURCE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+# 变体不比原图小时写入的空标记文件后缀，避免重复生成
+SKIP_SUFFIX = '.skip'
+
+
+class Variant(NamedTuple):
+    """可返回的图像变体"""
+    path: str      # 变体文件路径
+    mimetype: str  # MIME类型
+    name: str      # 格式名（用于区分 ETag）
+
+
+def _format_available(name: str) -> bool:
+    """检查当前 Pillow 是否支持编码该格式"""
+    try:
+        return bool(features.check(VARIANT_FORMATS[name][2]))
+    except (KeyError, ValueError):
+        return False
+
+
+class VariantStore:
+    """
+    图像格式变体存储
+
+    请求只在内存中查询变体是否已生成；未生成时加入后台队列并先返回原图。
+    变体文件保存在按字节数限制的磁盘 LRU 缓存中，原图变化时随之失效。
+    """
+
+    def __init__(self, cache: DiskLRUCache, formats: Iterable[str], quality: int = 80,
+                 workers: int = 2, queue_size: int = 1000):
+        """
+        初始化变体存储
+
+        Args:
+            cache: 变体磁盘缓存
+            formats: 按优先级排列的格式名（如 ['avif', 'webp']）
+            quality: 编码质量
+            workers: 后台生成线程数
+            queue_size: 待生成队列长度上限（队列满时丢弃新任务）
+        """
+        self.cache = cache
+        self.formats = []
+        for name in formats:
+            if name not in VARIANT_FORMATS:
+                logger.warning(f"不支持的变体格式: {name}")
+            elif not _format_available(name):
+                logger.warning(f"当前 Pillow 不支持编码 {name}，已忽略")
+            else:
+                self.formats.append(name)
+        self.quality = quality
+        self._queue: 'queue.Queue' = queue.Queue(maxsize=queue_size)
+        self._in_flight: Set[str] = set()
+        self._lock = threading.Lock()
+        self.bytes_saved = 0
+        self.served = 0
+        self.generated = 0
+        self.dropped = 0
+        for i in range(workers if self.formats else 0):
+            threading.Thread(target=self._worker, name=f'variant-worker-{i}', daemon=True).start()
+
+    def _make_key(self, file_path, stat, name) -> str:
+        """生成变体缓存键"""
+        return DiskLRUCache.make_key_from(file_path, stat[0], stat[1], 'variant', name, self.quality)
+
+    def lookup(self, file_path: str, stat: Tuple[int, int],
+               accepted: Iterable[str]) -> Tuple[Optional[Variant], bool]:
+        """
+        查询客户端可接受且已生成的最佳变体，缺失的变体加入后台生成队列
+
+        Args:
+            file_path: 原图路径
+            stat: 原图的 (文件大小, 修改时间纳秒)
+            accepted: 客户端 Accept 中明确接受的 MIME 类型集合
+
+        Returns:
+            (Variant 或 None（返回原图）, 是否有优先级更高的变体尚未生成)；
+            后者为 True 时同一请求稍后会得到不同的内容，响应不应长期缓存
+        """
+        if not self.formats or not file_path.lower().endswith(SOURCE_SUFFIXES):
+            return None, False
+
+        accepted = set(accepted)
+        pending = False
+        for name in self.formats:
+            mimetype, suffix, _ = VARIANT_FORMATS[name]
+            if mimetype not in accepted:
+                continue
+            key = self._make_key(file_path, stat, name)
+            path = self.cache.get(key)
+            if path is None:
+                self._enqueue(key, file_path, stat, name)
+                pending = True
+                continue
+            if path.endswith(SKIP_SUFFIX):
+                continue
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                # 变体文件已被其他进程淘汰
+                self.cache.discard(key)
+                pending = True
+                continue
+            with self._lock:
+                self.served += 1
+                self.bytes_saved += max(0, stat[0] - size)
+            return Variant(path, mimetype, name), pending
+        return None, pending
+
+    def _enqueue(self, key, file_path, stat, name) -> None:
+        """加入后台生成队列（同一变体只排队一次）"""
+        with self._lock:
+            if key in self._in_flight:
+                return
+            self._in_flight.add(key)
+        try:
+            self._queue.put_nowait((key, file_path, stat, name))
+        except queue.Full:
+            with self._lock:
+                self._in_flight.discard(key)
+                self.dropped += 1
+
+    def _worker(self) -> None:
+        """后台生成线程主体"""
+        while True:
+            key, file_path, stat, name = self._queue.get()
+            try:
+                self._generate(key, file_path, stat, name)
+            except Exception as e:
+                logger.error(f"生成图像变体失败: {file_path} ({name}), 错误: {str(e)}")
+            finally:
+                with self._lock:
+                    self._in_flight.discard(key)
+
+    def _generate(self, key, file_path, stat, name) -> None:
+        """生成单个变体并写入缓存；变体不比原图小时写入空标记"""
+        _, suffix, _ = VARIANT_FORMATS[name]
+        data = run_render(render_variant, file_path, name.upper(), self.quality)
+        if len(data) >= stat[0]:
+            self.cache.put(key, b'', suffix=SKIP_SUFFIX, source=file_path)
+            return
+        self.cache.put(key, data, suffix=suffix, source=file_path)
+        with self._lock:
+            self.generated += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取变体统计信息
+
+        Returns:
+            包含返回次数、节省字节数、生成数量及缓存信息的字典
+        """
+        with self._lock:
+            result = {
+                'served': self.served,
+                'bytes_saved': self.bytes_saved,
+                'generated': self.generated,
+                'dropped': self.dropped,
+                'queued': self._queue.qsize(),
+            }
+        result.update({f'cache_{k}': v for k, v in self.cache.stats().items()})
+        return result
+
+
+# 变体存储实例（由 setup_variant_store 在应用启动时初始化，未启用时为 None）
+variant_store: Optional[VariantStore] = None
+
+
+def setup_variant_store(cache_dir, formats, max_bytes, quality=80, workers=2) -> Optional[VariantStore]:
+    """
+    初始化图像格式变体存储
+
+    Args:
+        cache_dir: 缓存根目录
+        formats: 按优先级排列的格式名，为空时不启用
+        max_bytes: 变体缓存字节数上限
+        quality: 编码质量
+        workers: 后台生成线程数
+
+    Returns:
+        VariantStore实例或None（未启用）
+    """
+    global variant_store
+    if variant_store is not None:
+        unregister_derived_cache(variant_store.cache)
+        variant_store = None
+    formats = [f.strip().lower() for f in formats if f.strip()]
+    if not formats:
+        return None
+
+    cache = DiskLRUCache(os.path.join(cache_dir, 'variants'), max_bytes, name='图像变体')
+    register_derived_cache(cache)
+    variant_store = VariantStore(cache, formats, quality, workers)
+    logger.info(f"图像变体已启用: {', '.join(variant_store.formats) or '无可用格式'}")
+    return variant_store
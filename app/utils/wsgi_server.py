@@ -0,0 +1,21 @@
+"""
+WSGI服务器模块 - 对已接受的连接关闭 Nagle 算法的 gevent WSGIServer
+
+pywsgi 分两次发送响应头和响应体。长连接上第一个响应之后，第二个小包会被
+Nagle 算法扣留，直到收到客户端的延迟确认（Linux 上约 40ms）才发出，
+每个请求都因此多出几十毫秒延迟。设置 TCP_NODELAY 后两次发送立即发出。
+"""
+import socket
+from gevent import pywsgi
+
+
+class WSGIServer(pywsgi.WSGIServer):
+    """为每个连接设置 TCP_NODELAY 的 gevent WSGI 服务器"""
+
+    def handle(self, sock, address):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            # 非 TCP 套接字（如 Unix 域套接字）
+            pass
+        super().handle(sock, address)
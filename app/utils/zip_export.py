@@ -0,0 +1,347 @@
+"""
+文件夹导出模块 - 流式生成存储模式（不重新压缩）的 zip 文件
+
+图片本身已是压缩格式，存储模式下输出大小只取决于文件名和文件大小，可以事先算出
+每个条目的位置：响应带 Content-Length，并可按固定的文件名顺序支持 Range 续传。
+CRC32 写在每个条目数据之后的数据描述符（通用标志位 3）和中央目录中，发送数据时
+顺带计算并缓存；续传时跳过的条目从缓存中取 CRC，缓存中没有时重新读取文件计算。
+文件大小、偏移或条目数超过 zip 格式限制时自动使用 Zip64 扩展。
+
+文件按块读取，读取在 gevent 线程池中执行（当前 greenlet 让出控制权），
+生成过程不在内存中保留文件数据，也不阻塞其他请求。
+"""
+import os
+import time
+import zlib
+import struct
+import hashlib
+import logging
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Sequence, Tuple
+from .scanner import ScanEntry
+
+try:
+    from gevent import get_hub
+except ImportError:  # 未安装 gevent 时直接在当前线程中读取
+    get_hub = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 每次读取的文件块大小
+CHUNK_SIZE = 256 * 1024
+
+# CRC 缓存条目数上限（键为 路径、大小、修改时间）
+CRC_CACHE_SIZE = 100000
+
+# 超过时需要 Zip64 扩展的数值上限
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+# 实际值写在 Zip64 扩展字段中时，原字段填入的标记值
+_MARKER32 = 0xFFFFFFFF
+_MARKER16 = 0xFFFF
+
+# 记录结构（小端）
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_DESCRIPTOR = struct.Struct('<IIII')
+_DESCRIPTOR64 = struct.Struct('<IIQQ')
+_END = struct.Struct('<IHHHHIIH')
+_END64 = struct.Struct('<IQHHIIQQQQ')
+_LOCATOR64 = struct.Struct('<IIQI')
+
+_LOCAL_SIG = 0x04034b50
+_CENTRAL_SIG = 0x02014b50
+_DESCRIPTOR_SIG = 0x08074b50
+_END_SIG = 0x06054b50
+_END64_SIG = 0x06064b50
+_LOCATOR64_SIG = 0x07064b50
+
+# 通用标志位：3（CRC 和大小位于数据描述符），11（文件名为 UTF-8）
+_FLAG_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+# 创建系统 Unix（高字节 3），外部属性为普通文件 0644
+_MADE_BY_UNIX = 3 << 8
+_EXTERNAL_ATTR = 0o100644 << 16
+
+# 已计算的 CRC：{(路径, 大小, 修改时间纳秒): CRC32}
+_crc_cache: 'OrderedDict[Tuple[str, int, int], int]' = OrderedDict()
+_crc_lock = threading.Lock()
+
+
+def _run_blocking(func, *args):
+    """在 gevent 主线程中交给线程池执行（当前 greenlet 让出控制权），其他线程中直接执行"""
+    if get_hub is not None and threading.current_thread() is threading.main_thread():
+        return get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+
+def _dos_datetime(mtime_ns: int) -> Tuple[int, int]:
+    """修改时间转换为 zip 使用的 DOS 时间和日期（超出 1980-2107 年时取边界值）"""
+    t = time.localtime(mtime_ns / 1e9)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    if t.tm_year > 2107:
+        return (23 << 11) | (59 << 5) | 29, (127 << 9) | (12 << 5) | 31
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def _cached_crc(key) -> Optional[int]:
+    with _crc_lock:
+        crc = _crc_cache.get(key)
+        if crc is not None:
+            _crc_cache.move_to_end(key)
+        return crc
+
+
+def _store_crc(key, crc: int) -> None:
+    with _crc_lock:
+        _crc_cache[key] = crc
+        _crc_cache.move_to_end(key)
+        while len(_crc_cache) > CRC_CACHE_SIZE:
+            _crc_cache.popitem(last=False)
+
+
+def _read_exact(f, n: int) -> bytes:
+    """读取 n 字节，文件已被截断时用零补齐（保证输出与事先计算的布局一致）"""
+    data = f.read(n) if f is not None else b''
+    if len(data) < n:
+        data += b'\0' * (n - len(data))
+    return data
+
+
+def _file_crc(path: str, size: int) -> int:
+    """读取文件前 size 字节计算 CRC32（在线程池中执行）"""
+    crc = 0
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        f = None
+    try:
+        remaining = size
+        while remaining > 0:
+            data = _read_exact(f, min(CHUNK_SIZE, remaining))
+            crc = zlib.crc32(data, crc)
+            remaining -= len(data)
+    finally:
+        if f is not None:
+            f.close()
+    return crc
+
+
+class ZipEntry:
+    """zip 中的一个条目及其在输出中的位置"""
+    __slots__ = ('path', 'name', 'size', 'mtime_ns', 'name_bytes', 'flags', 'zip64', 'offset',
+                 'header_size', 'descriptor_size', 'central_size')
+
+    def __init__(self, path: str, name: str, size: int, mtime_ns: int, offset: int):
+        self.path = path
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        try:
+            self.name_bytes = name.encode('utf-8')
+            self.flags = _FLAG_DESCRIPTOR | _FLAG_UTF8
+        except UnicodeEncodeError:
+            # os.scandir 对非 UTF-8 文件名返回代理字符，按原始字节写入
+            self.name_bytes = name.encode('utf-8', 'surrogateescape')
+            self.flags = _FLAG_DESCRIPTOR
+        self.zip64 = size >= ZIP64_LIMIT
+        self.offset = offset
+        self.header_size = _LOCAL_HEADER.size + len(self.name_bytes) + (20 if self.zip64 else 0)
+        self.descriptor_size = _DESCRIPTOR64.size if self.zip64 else _DESCRIPTOR.size
+        self.central_size = _CENTRAL_HEADER.size + len(self.name_bytes) + len(self._central_extra())
+
+    @property
+    def end(self) -> int:
+        """条目（本地头 + 数据 + 数据描述符）的结束位置"""
+        return self.offset + self.header_size + self.size + self.descriptor_size
+
+    @property
+    def crc_key(self) -> Tuple[str, int, int]:
+        return self.path, self.size, self.mtime_ns
+
+    def _version(self) -> int:
+        return 45 if self.zip64 or self.offset >= ZIP64_LIMIT else 20
+
+    def local_header(self) -> bytes:
+        dos_time, dos_date = _dos_datetime(self.mtime_ns)
+        if self.zip64:
+            # Zip64 条目：大小字段置为 0xFFFFFFFF，实际值在数据描述符中
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            sizes = _MARKER32
+        else:
+            extra = b''
+            sizes = 0
+        return _LOCAL_HEADER.pack(_LOCAL_SIG, self._version(), self.flags, 0, dos_time, dos_date,
+                                  0, sizes, sizes, len(self.name_bytes), len(extra)) + self.name_bytes + extra
+
+    def descriptor(self, crc: int) -> bytes:
+        if self.zip64:
+            return _DESCRIPTOR64.pack(_DESCRIPTOR_SIG, crc, self.size, self.size)
+        return _DESCRIPTOR.pack(_DESCRIPTOR_SIG, crc, self.size, self.size)
+
+    def _central_extra(self) -> bytes:
+        values = []
+        if self.zip64:
+            values += [self.size, self.size]
+        if self.offset >= ZIP64_LIMIT:
+            values.append(self.offset)
+        if not values:
+            return b''
+        return struct.pack(f'<HH{len(values)}Q', 1, 8 * len(values), *values)
+
+    def central_header(self, crc: int) -> bytes:
+        dos_time, dos_date = _dos_datetime(self.mtime_ns)
+        extra = self._central_extra()
+        size = _MARKER32 if self.zip64 else self.size
+        offset = _MARKER32 if self.offset >= ZIP64_LIMIT else self.offset
+        version = self._version()
+        return _CENTRAL_HEADER.pack(_CENTRAL_SIG, _MADE_BY_UNIX | version, version, self.flags, 0,
+                                    dos_time, dos_date, crc, size, size, len(self.name_bytes), len(extra),
+                                    0, 0, 0, _EXTERNAL_ATTR, offset) + self.name_bytes + extra
+
+
+class ZipExport:
+    """
+    一个文件夹的 zip 导出布局
+
+    条目按文件名排序，位置只取决于文件名和大小；ETag 由文件名、大小和修改时间计算，
+    文件夹内容不变时同一个 ETag 对应完全相同的字节（续传请求可用 If-Range 校验）。
+    """
+
+    def __init__(self, folder_path: str, entries: Sequence[ScanEntry]):
+        """
+        计算导出布局
+
+        Args:
+            folder_path: 文件夹路径
+            entries: ScanEntry 列表（需带文件大小和修改时间）
+        """
+        self.entries: List[ZipEntry] = []
+        digest = hashlib.sha1()
+        offset = 0
+        for item in sorted(entries, key=lambda e: e.name):
+            entry = ZipEntry(os.path.join(folder_path, item.name), item.name, max(item.size, 0),
+                             item.mtime_ns, offset)
+            self.entries.append(entry)
+            offset = entry.end
+            digest.update(entry.name_bytes + b'\0' + f'{entry.size}:{entry.mtime_ns}\n'.encode())
+        # 各条目的起始位置（二分查找续传起点）
+        self._offsets = [entry.offset for entry in self.entries]
+
+        self.central_offset = offset
+        self.central_size = sum(entry.central_size for entry in self.entries)
+        end_offset = self.central_offset + self.central_size
+        self.zip64_end = (len(self.entries) >= ZIP_MAX_ENTRIES or self.central_offset >= ZIP64_LIMIT
+                          or self.central_size >= ZIP64_LIMIT)
+        self._end_offset = end_offset
+        self.length = end_offset + (_END64.size + _LOCATOR64.size if self.zip64_end else 0) + _END.size
+        self.etag = digest.hexdigest()
+
+    def _end_records(self) -> bytes:
+        count = len(self.entries)
+        records = b''
+        if self.zip64_end:
+            records += _END64.pack(_END64_SIG, _END64.size - 12, _MADE_BY_UNIX | 45, 45, 0, 0,
+                                   count, count, self.central_size, self.central_offset)
+            records += _LOCATOR64.pack(_LOCATOR64_SIG, 0, self._end_offset, 1)
+            count = _MARKER16 if count >= ZIP_MAX_ENTRIES else count
+        central_size = _MARKER32 if self.central_size >= ZIP64_LIMIT else self.central_size
+        central_offset = _MARKER32 if self.central_offset >= ZIP64_LIMIT else self.central_offset
+        records += _END.pack(_END_SIG, 0, 0, count, count, central_size, central_offset, 0)
+        return records
+
+    def _crc(self, entry: ZipEntry) -> int:
+        """获取条目的 CRC32（缓存中没有时读取文件计算）"""
+        crc = _cached_crc(entry.crc_key)
+        if crc is None:
+            crc = _run_blocking(_file_crc, entry.path, entry.size)
+            _store_crc(entry.crc_key, crc)
+        return crc
+
+    def _iter_data(self, entry: ZipEntry, start: int, stop: int) -> Iterator[bytes]:
+        """
+        输出条目数据的 [start, stop) 部分；从头读到尾时顺带计算并缓存 CRC
+
+        文件在导出过程中变短或被删除时用零补齐，保证输出长度与布局一致。
+        """
+        try:
+            f = open(entry.path, 'rb')
+        except OSError as e:
+            logger.warning(f"导出时无法读取文件，以零填充: {entry.path}, 错误: {str(e)}")
+            f = None
+        try:
+            if f is not None and start:
+                f.seek(start)
+            full = start == 0 and stop == entry.size
+            crc = 0
+            pos = start
+            while pos < stop:
+                data = _run_blocking(_read_exact, f, min(CHUNK_SIZE, stop - pos))
+                if full:
+                    crc = zlib.crc32(data, crc)
+                pos += len(data)
+                yield data
+            if full:
+                _store_crc(entry.crc_key, crc)
+        finally:
+            if f is not None:
+                f.close()
+
+    def iter_bytes(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        生成输出的 [start, end) 部分
+
+        Args:
+            start: 起始位置
+            end: 结束位置（不含），默认到末尾
+
+        Returns:
+            字节块迭代器
+        """
+        end = self.length if end is None else min(end, self.length)
+        pos = start
+
+        # 条目：本地头、数据、数据描述符
+        first = max(0, bisect_right(self._offsets, pos) - 1)
+        for entry in self.entries[first:]:
+            if pos >= end:
+                return
+            data_start = entry.offset + entry.header_size
+            data_end = data_start + entry.size
+            if pos < data_start:
+                header = entry.local_header()
+                stop = min(end, data_start)
+                yield header[pos - entry.offset:stop - entry.offset]
+                pos = stop
+            if pos < end and pos < data_end:
+                stop = min(end, data_end)
+                yield from self._iter_data(entry, pos - data_start, stop - data_start)
+                pos = stop
+            if pos < end and pos < entry.end:
+                stop = min(end, entry.end)
+                yield entry.descriptor(self._crc(entry))[pos - data_end:stop - data_end]
+                pos = stop
+
+        # 中央目录（CRC 在发送数据时已缓存）
+        record_start = self.central_offset
+        for entry in self.entries:
+            if pos >= end:
+                return
+            record_end = record_start + entry.central_size
+            if pos < record_end:
+                stop = min(end, record_end)
+                yield entry.central_header(self._crc(entry))[pos - record_start:stop - record_start]
+                pos = stop
+            record_start = record_end
+
+        # 结束记录
+        if pos < end:
+            records = self._end_records()
+            yield records[pos - self._end_offset:end - self._end_offset]
@@ -0,0 +1,180 @@
+"""
+封禁表基准测试：对比旧的 ban_records 字典实现与 BanStore（路径前缀树 + 过期堆）
+
+用法：
+    python benchmarks/bench_bans.py --ips 50000
+
+模拟抓取攻击：指定数量的IP各有若干目录/文件封禁，然后分别测量
+添加封禁、未封禁IP检查、已封禁IP深层路径检查以及过期清理的耗时，
+并校验两种实现的封禁判定结果一致。
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.ban_store import BanStore  # noqa: E402
+
+BAN_DURATION = 3600
+
+
+class LegacyBans:
+    """重构前 security.py 中的封禁实现（逻辑保持不变，改为实例属性以便基准测试）"""
+
+    def __init__(self):
+        self.ban_records = {}
+        self.ip_violation_counts = {}
+        self.last_ban_times = {}
+
+    def is_banned(self, client_ip, path, current_time):
+        if client_ip not in self.ban_records:
+            return False, 0, 0
+        ip_records = self.ban_records[client_ip]
+        if path in ip_records:
+            end_time, _ = ip_records[path]
+            if current_time < end_time:
+                return True, max(0, end_time - current_time), end_time
+        if '*' in ip_records:
+            end_time, _ = ip_records['*']
+            if current_time < end_time:
+                return True, max(0, end_time - current_time), end_time
+        path_parts = path.rstrip('/').split('/')
+        possible_parent_paths = []
+        for i in range(len(path_parts), 0, -1):
+            parent_path = '/'.join(path_parts[:i])
+            if parent_path:
+                possible_parent_paths.append(parent_path)
+                possible_parent_paths.append(parent_path + '/')
+        for parent_path in possible_parent_paths:
+            if parent_path in ip_records:
+                end_time, is_directory = ip_records[parent_path]
+                if is_directory and current_time < end_time:
+                    return True, max(0, end_time - current_time), end_time
+        return False, 0, 0
+
+    def add_ban(self, client_ip, path, is_directory, ban_duration, current_time):
+        self.ip_violation_counts[client_ip] = self.ip_violation_counts.get(client_ip, 0) + 1
+        violation_count = self.ip_violation_counts[client_ip]
+        repeated_violation = (client_ip in self.last_ban_times
+                              and current_time - self.last_ban_times[client_ip] < 1800)
+        self.last_ban_times[client_ip] = current_time
+        actual_ban_duration = ban_duration
+        if repeated_violation:
+            actual_ban_duration = ban_duration * min(2 ** (violation_count - 1), 24)
+        elif violation_count > 1:
+            actual_ban_duration = ban_duration * min(1.5 * (violation_count - 1), 12)
+        if client_ip in self.ban_records:
+            existing_end_time = None
+            for record in self.ban_records[client_ip].values():
+                if record[0] > current_time and (existing_end_time is None or record[0] > existing_end_time):
+                    existing_end_time = record[0]
+            end_time = max(existing_end_time or 0, current_time + actual_ban_duration)
+        else:
+            end_time = current_time + actual_ban_duration
+            self.ban_records[client_ip] = {}
+        self.ban_records[client_ip][path] = (end_time, is_directory)
+        if violation_count >= 5 or (repeated_violation and violation_count >= 3):
+            self.ban_records[client_ip]['*'] = (end_time, False)
+        return end_time
+
+    def cleanup(self, current_time):
+        ips_to_remove = []
+        for ip, records in list(self.ban_records.items()):
+            valid_records = {path: record for path, record in records.items() if record[0] > current_time}
+            if valid_records:
+                self.ban_records[ip] = valid_records
+            else:
+                ips_to_remove.append(ip)
+        for ip in ips_to_remove:
+            del self.ban_records[ip]
+        for ip, last_time in list(self.last_ban_times.items()):
+            if current_time - last_time > 604800:
+                self.ip_violation_counts.pop(ip, None)
+                self.last_ban_times.pop(ip, None)
+
+
+def make_workload(ip_count, seed=42):
+    """生成封禁事件：每个IP 1-3 个封禁，目录与文件混合，10% 的IP封禁时长很短"""
+    rng = random.Random(seed)
+    folders = [f'/folder{i}' for i in range(50)]
+    events = []
+    for n in range(ip_count):
+        ip = f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}'
+        duration = 5 if n % 10 == 0 else BAN_DURATION
+        for _ in range(rng.randint(1, 3)):
+            folder = rng.choice(folders)
+            if rng.random() < 0.5:
+                events.append((ip, folder, True, duration))
+            else:
+                events.append((ip, f'{folder}/img{rng.randint(0, 999)}.jpg', False, duration))
+    return events
+
+
+def make_queries(events, count, seed=7):
+    """生成检查请求：一半来自已封禁IP（深层路径），一半来自未封禁IP"""
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        if i % 2:
+            ip, path, _, _ = rng.choice(events)
+            base = path.rsplit('/', 1)[0] if path.endswith('.jpg') else path
+            queries.append((ip, f'{base}/sub/img{rng.randint(0, 999)}.jpg'))
+        else:
+            queries.append((f'192.168.{rng.randint(0, 255)}.{rng.randint(0, 255)}', '/folder1/img1.jpg'))
+    return queries
+
+
+def timed(label, func, ops):
+    """运行一次并打印耗时及每次操作的平均耗时"""
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<24} {elapsed * 1000:>10.1f} ms  ({elapsed / max(ops, 1) * 1e6:>7.2f} µs/次)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='封禁表基准测试')
+    parser.add_argument('--ips', type=int, default=50000, help='封禁IP数量')
+    parser.add_argument('--queries', type=int, default=200000, help='检查次数')
+    args = parser.parse_args()
+
+    events = make_workload(args.ips)
+    queries = make_queries(events, args.queries)
+    now = time.time()
+    later = now + 10  # 短时封禁已到期、其余仍有效
+    print(f"{args.ips} 个IP, {len(events)} 条封禁, {len(queries)} 次检查")
+
+    legacy = LegacyBans()
+    store = BanStore(max_ips=args.ips * 2)
+    results = {}
+    for name, impl in (('旧实现（字典）', legacy), ('BanStore', store)):
+        print(name)
+        if impl is legacy:
+            timed('添加封禁', lambda: [legacy.add_ban(ip, p, d, t, now) for ip, p, d, t in events], len(events))
+            results[name] = timed('检查封禁', lambda: [legacy.is_banned(ip, p, now)[0] for ip, p in queries],
+                                  len(queries))
+            # 旧实现每100个请求全量清理一次
+            timed('清理（无到期）', lambda: legacy.cleanup(now), 1)
+            timed('清理（10%到期）', lambda: legacy.cleanup(later), 1)
+            remaining = len(legacy.ban_records)
+        else:
+            timed('添加封禁', lambda: [store.add_ban(ip, p, d, t, now) for ip, p, d, t in events], len(events))
+            results[name] = timed('检查封禁', lambda: [store.is_banned(ip, p, now)[0] for ip, p in queries],
+                                  len(queries))
+            timed('清理（无到期）', lambda: store.cleanup(now), 1)
+            timed('清理（10%到期）', lambda: store.cleanup(later), 1)
+            remaining = len(store)
+        print(f"  清理后剩余IP: {remaining}")
+
+    legacy_result, store_result = results.values()
+    mismatches = sum(1 for a, b in zip(legacy_result, store_result) if a != b)
+    print(f"判定结果不一致: {mismatches}")
+    assert mismatches == 0, '封禁判定结果不一致'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+紧凑索引基准测试：对比按文件夹保存 str 元组 + 统计字典的内存索引与 mmap 紧凑索引
+
+用法：
+    python benchmarks/bench_packed_index.py --entries 1000000
+    python benchmarks/bench_packed_index.py --entries 10000000 --folders 100
+
+两种索引分别在独立的子进程中构建，测量常驻内存（RSS）和堆内存（匿名页）的增量：
+内存索引的增量即每个工作进程各自占用的私有内存（引用计数写入会破坏 fork 的写时复制）；
+紧凑索引的数据位于文件映射中，所有进程共享同一份页缓存，私有增量只有文件夹表。
+同时测量随机抽样和按文件名查询的平均耗时。
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.scanner import ScanEntry  # noqa: E402
+from app.utils.cache import FolderEntry  # noqa: E402
+from app.utils.packed_index import PackedIndex, write_packed_index  # noqa: E402
+
+SAMPLES = 200000
+
+
+class SyntheticFolder:
+    """按需生成的文件夹内容（避免输入数据本身占用内存影响测量）"""
+
+    def __init__(self, folder, count):
+        self.folder = folder
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        # 定宽序号保证按名称排序
+        return ScanEntry(f'{self.folder}_IMG_{i:09d}.jpg', 100000 + i % 4096, 1700000000000000000 + i)
+
+    def __iter__(self):
+        return (self[i] for i in range(self.count))
+
+
+def make_folders(entries, folder_count):
+    """将图像均分到各文件夹"""
+    per_folder, extra = divmod(entries, folder_count)
+    return {f'folder{i:03d}': SyntheticFolder(f'folder{i:03d}', per_folder + (i < extra))
+            for i in range(folder_count)}
+
+
+def rss_bytes():
+    """当前进程常驻内存（字节）"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def private_bytes():
+    """当前进程的匿名内存（字节，即堆内存，不含可在进程间共享的文件映射页）"""
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Anonymous:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def measure_lookups(folders, entries):
+    """随机抽样与按文件名查询的平均耗时（微秒）"""
+    rng = random.Random(1)
+    names = list(folders)
+    start = time.perf_counter()
+    for _ in range(SAMPLES):
+        rng.choice(entries[rng.choice(names)].images)
+    sample_us = (time.perf_counter() - start) / SAMPLES * 1e6
+
+    queries = []
+    for _ in range(SAMPLES):
+        folder = rng.choice(names)
+        queries.append((folder, folders[folder][rng.randrange(len(folders[folder]))].name))
+    start = time.perf_counter()
+    for folder, name in queries:
+        entries[folder].stats.get(name)
+    lookup_us = (time.perf_counter() - start) / SAMPLES * 1e6
+    return sample_us, lookup_us
+
+
+def run_heap(args, result):
+    """内存索引：每个文件夹一个 str 元组和一个统计字典（与预热后的 FolderEntry 相同）"""
+    folders = make_folders(args.entries, args.folders)
+    before_rss, before_private = rss_bytes(), private_bytes()
+    start = time.perf_counter()
+    entries = {folder: FolderEntry.from_scan(items, 0.0) for folder, items in folders.items()}
+    build = time.perf_counter() - start
+    rss, private = rss_bytes() - before_rss, private_bytes() - before_private
+    result.update(build=build, rss=rss, private=private, shared=0,
+                  lookups=measure_lookups(folders, entries))
+
+
+def run_packed(args, result, path):
+    """紧凑索引：写入文件后 mmap 打开，缓存项为索引视图"""
+    folders = make_folders(args.entries, args.folders)
+    start = time.perf_counter()
+    write_packed_index(path, folders)
+    write = time.perf_counter() - start
+
+    before_rss, before_private = rss_bytes(), private_bytes()
+    index = PackedIndex(path)
+    entries = {folder: FolderEntry.from_packed(index, folder, 0.0) for folder in folders}
+    # 访问全部页面，模拟长时间运行后映射全部载入的情况
+    for folder in entries:
+        for _ in entries[folder].images:
+            pass
+    rss, private = rss_bytes() - before_rss, private_bytes() - before_private
+    result.update(build=write, rss=rss, private=private, shared=index.mapped_bytes(),
+                  lookups=measure_lookups(folders, entries))
+
+
+def run_in_child(target, *args):
+    """在独立子进程中运行并返回结果字典"""
+    with multiprocessing.Manager() as manager:
+        result = manager.dict()
+        process = multiprocessing.Process(target=target, args=args + (result,))
+        process.start()
+        process.join()
+        return dict(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='紧凑索引基准测试')
+    parser.add_argument('--entries', type=int, default=1000000, help='图像总数')
+    parser.add_argument('--folders', type=int, default=20, help='文件夹数量')
+    parser.add_argument('--workers', type=int, default=4, help='用于估算多进程总内存的工作进程数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'index.pack')
+        heap = run_in_child(run_heap, args)
+        packed = run_in_child(lambda a, r: run_packed(a, r, path), args)
+
+    mb = 1024 * 1024
+    print(f"{args.entries} 张图片, {args.folders} 个文件夹")
+    print(f"{'':<12} {'构建(s)':>9} {'RSS增量(MB)':>12} {'堆内存(MB)':>10} {'共享映射(MB)':>13} "
+          f"{'抽样(µs)':>9} {'查询(µs)':>9} {f'{args.workers}进程合计(MB)':>14}")
+    for name, r in (('内存索引', heap), ('紧凑索引', packed)):
+        total = r['private'] * args.workers + r['shared']
+        print(f"{name:<12} {r['build']:>9.2f} {r['rss'] / mb:>12.1f} {r['private'] / mb:>10.1f} "
+              f"{r['shared'] / mb:>13.1f} {r['lookups'][0]:>9.2f} {r['lookups'][1]:>9.2f} {total / mb:>14.1f}")
+
+
+if __name__ == '__main__':
+    # fork 启动的子进程从干净的父进程开始测量
+    multiprocessing.set_start_method('fork')
+    main()
@@ -0,0 +1,487 @@
+"""
+端到端压测：生成合成图库，以真实的 gevent 服务器启动应用，按场景并发请求并输出 JSON 结果
+
+用法：
+    python benchmarks/load_bench.py --files 100 10000 --duration 10 --output result.json
+    python benchmarks/load_bench.py --files 1000000 --data-dir /var/tmp/ria-bench --workers 4
+    python benchmarks/load_bench.py --files 10000 --baseline baseline.json --tolerance 0.15
+
+每个规模生成一个合成 IMAGE_BASE（文件均为同一张小图的硬链接，文件夹数默认取文件数的平方根），
+服务器在独立子进程中通过 create_app 创建应用、预热索引后由 gevent WSGIServer 提供服务
+（--workers 大于 1 时使用多进程模式），压测客户端在本进程中用多个线程保持长连接并发请求。
+
+场景：
+    random   /random
+    folder   /<folder>
+    file     /<folder>/<file>
+    home     /
+    browse   /browse/<folder>
+    banned   /random（携带已被封禁的 X-Forwarded-For，期望 429）
+
+压测时关闭限流（否则同一客户端IP很快会被限流并封禁），封禁检查仍照常执行。
+其他配置（如 RANDOM_SERVE_MODE、LOG_QUEUE）可通过环境变量传给服务器进程。
+
+结果 JSON 中每个场景包含吞吐量（req/s）和 p50/p95/p99 延迟（毫秒）；指定 --baseline 时
+与之前保存的结果对比，吞吐量下降或 p99 上升超过 --tolerance 时以退出码 1 结束。
+"""
+import os
+import sys
+import json
+import time
+import math
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from collections import Counter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+RESULT_VERSION = 1
+
+SCENARIOS = ('random', 'folder', 'file', 'home', 'browse', 'banned')
+
+# 预先封禁的客户端IP（TEST-NET-2 地址段），banned 场景轮流使用
+BANNED_IPS = [f'198.51.100.{i}' for i in range(1, 255)]
+BANNED_PATH = '/random'
+
+
+def folder_layout(files, folders):
+    """
+    计算合成图库的布局
+
+    Args:
+        files: 图像总数
+        folders: 文件夹数（0 表示取文件数的平方根，限制在 1-1000）
+
+    Returns:
+        [(文件夹名称, 图像数), ...]
+    """
+    if folders <= 0:
+        folders = min(1000, max(1, round(math.sqrt(files))))
+    per_folder, extra = divmod(files, folders)
+    return [(f'folder{i:04d}', per_folder + (i < extra)) for i in range(folders)]
+
+
+def image_name(i):
+    """第 i 个图像的文件名（定宽序号保证按名称排序）"""
+    return f'img{i:07d}.jpg'
+
+
+def make_source_image(path):
+    """生成一张可被 Pillow 解码的小 JPEG（主页预览和缩略图会实际解码）"""
+    from PIL import Image
+    image = Image.linear_gradient('L').resize((320, 240)).convert('RGB')
+    image.save(path, 'JPEG', quality=70)
+
+
+def generate_library(root, files, folders):
+    """
+    生成合成图库（已生成且规模相同时直接复用）
+
+    Args:
+        root: 存放目录（图像位于 root/images）
+        files: 图像总数
+        folders: 文件夹数
+
+    Returns:
+        (IMAGE_BASE 路径, 文件夹布局, 生成耗时秒数)
+    """
+    image_base = os.path.join(root, 'images')
+    layout = folder_layout(files, folders)
+    marker = os.path.join(root, 'library.json')
+    try:
+        with open(marker) as f:
+            if json.load(f) == layout:
+                return image_base, layout, 0.0
+    except (OSError, ValueError):
+        pass
+
+    start = time.perf_counter()
+    os.makedirs(image_base, exist_ok=True)
+    source = os.path.join(root, 'source.jpg')
+    make_source_image(source)
+    use_link = True
+    for folder, count in layout:
+        folder_path = os.path.join(image_base, folder)
+        os.makedirs(folder_path, exist_ok=True)
+        for i in range(count):
+            target = os.path.join(folder_path, image_name(i))
+            if os.path.exists(target):
+                continue
+            if use_link:
+                try:
+                    os.link(source, target)
+                    continue
+                except OSError:
+                    # 文件系统不支持硬链接时改为复制
+                    use_link = False
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                dst.write(src.read())
+    with open(marker, 'w') as f:
+        json.dump(layout, f)
+    return image_base, layout, time.perf_counter() - start
+
+
+def free_port():
+    """获取一个空闲端口"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(args):
+    """服务器进程：创建应用、预热索引并启动 gevent 服务器（在子进程中运行）"""
+    import logging
+    from app import create_app
+    from app.config.config import Config
+    from app.utils.index_snapshot import warm_up_index
+    from app.utils.logger import setup_logger
+    from app.utils.prefork import PreforkServer
+    from app.utils.security import add_ban
+    from app.utils.wsgi_server import WSGIServer
+
+    # 路由直接读取 Config 的类属性，因此在基础配置类上修改
+    Config.IMAGE_BASE = args.image_base
+    Config.TRUSTED_PROXIES = ['127.0.0.1']
+
+    class BenchConfig(Config):
+        SECRET_KEY = 'load-bench'
+        RATELIMIT_ENABLED = False
+        LOG_LEVEL = getattr(logging, args.log_level)
+        WORKERS = args.workers
+
+    def app_factory(config, file_monitor=True):
+        app = create_app(config, file_monitor=file_monitor)
+        for ip in BANNED_IPS:
+            add_ban(ip, BANNED_PATH, False, 86400)
+        return app
+
+    def warm_up():
+        warm_up_index(Config.IMAGE_BASE, Config.IMAGE_EXTENSIONS, Config.INDEX_WARMUP_WORKERS,
+                      Config.INDEX_SNAPSHOT_PATH, Config.INDEX_PACKED_PATH if Config.INDEX_PACKED else None)
+
+    if args.workers > 1:
+        setup_logger(None, BenchConfig)
+        warm_up()
+        PreforkServer(app_factory, BenchConfig, args.workers, host='127.0.0.1', port=args.port).run()
+        return
+
+    app = app_factory(BenchConfig)
+    warm_up()
+    WSGIServer(('127.0.0.1', args.port), app, log=None).serve_forever()
+
+
+def start_server(image_base, workdir, args):
+    """
+    启动服务器子进程并等待其开始接受连接
+
+    Returns:
+        (进程, 端口, 启动耗时秒数)
+    """
+    port = free_port()
+    env = dict(os.environ)
+    env.setdefault('CACHE_DIR', os.path.join(workdir, 'cache'))
+    cmd = [sys.executable, os.path.abspath(__file__), '--serve', '--image-base', image_base,
+           '--port', str(port), '--workers', str(args.workers), '--log-level', args.log_level]
+    log = open(os.path.join(workdir, 'server.log'), 'ab')
+    start = time.perf_counter()
+    # 工作目录设为 workdir，服务器的日志文件写在其中
+    process = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务器进程已退出（退出码 {process.returncode}），见 {workdir}/server.log")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/favicon.ico')
+            conn.getresponse().read()
+            conn.close()
+            return process, port, time.perf_counter() - start
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError(f"服务器在 {args.startup_timeout} 秒内未就绪，见 {workdir}/server.log")
+
+
+def stop_server(process):
+    """停止服务器进程（先 SIGTERM，超时后强制结束）"""
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def scenario_request(name, layout):
+    """
+    创建场景的请求生成函数
+
+    Args:
+        name: 场景名称
+        layout: 文件夹布局
+
+    Returns:
+        (generate(rng) -> (路径, 请求头), 期望的状态码集合)
+    """
+    folders = [folder for folder, count in layout if count]
+    no_headers = {}
+
+    if name == 'random':
+        return lambda rng: ('/random', no_headers), {200, 302}
+    if name == 'folder':
+        return lambda rng: (f'/{rng.choice(folders)}', no_headers), {200, 302}
+    if name == 'file':
+        counts = dict(layout)
+
+        def generate(rng):
+            folder = rng.choice(folders)
+            return f'/{folder}/{image_name(rng.randrange(counts[folder]))}', no_headers
+        return generate, {200}
+    if name == 'home':
+        return lambda rng: ('/', no_headers), {200}
+    if name == 'browse':
+        return lambda rng: (f'/browse/{rng.choice(folders)}', no_headers), {200}
+    if name == 'banned':
+        return lambda rng: (BANNED_PATH, {'X-Forwarded-For': rng.choice(BANNED_IPS)}), {429}
+    raise ValueError(f"未知场景: {name}")
+
+
+def client_worker(port, generate, expected, seed, start_at, record_at, deadline, results):
+    """
+    压测线程：保持一个长连接连续发送请求，只记录 record_at 之后发出的请求
+
+    Args:
+        port: 服务器端口
+        generate: 请求生成函数
+        expected: 期望的状态码集合
+        seed: 随机数种子
+        start_at: 开始时间（time.perf_counter）
+        record_at: 预热结束、开始记录的时间
+        deadline: 结束时间
+        results: 结果列表（追加 (延迟列表, 状态码计数, 错误数)）
+    """
+    rng = random.Random(seed)
+    latencies = []
+    statuses = Counter()
+    errors = 0
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.perf_counter() < start_at:
+        time.sleep(0.001)
+    while True:
+        path, headers = generate(rng)
+        sent = time.perf_counter()
+        if sent >= deadline:
+            break
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            if response.will_close:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            status = None
+        if sent < record_at:
+            continue
+        latencies.append(time.perf_counter() - sent)
+        statuses[str(status) if status else 'error'] += 1
+        if status not in expected:
+            errors += 1
+    conn.close()
+    results.append((latencies, statuses, errors))
+
+
+def percentile(sorted_values, p):
+    """最近秩百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(name, port, layout, args):
+    """
+    以 --concurrency 个并发连接运行一个场景
+
+    Returns:
+        场景结果字典
+    """
+    generate, expected = scenario_request(name, layout)
+    results = []
+    start_at = time.perf_counter() + 0.2
+    record_at = start_at + args.warmup
+    deadline = record_at + args.duration
+    threads = [threading.Thread(target=client_worker,
+                                args=(port, generate, expected, i, start_at, record_at, deadline, results))
+               for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    statuses = Counter()
+    for result in results:
+        statuses.update(result[1])
+    ms = lambda value: round(value * 1000, 3) if value is not None else None  # noqa: E731
+    return {
+        'requests': len(latencies),
+        'errors': sum(result[2] for result in results),
+        'rps': round(len(latencies) / args.duration, 1),
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+        'status': dict(sorted(statuses.items())),
+    }
+
+
+def run_size(files, root, args):
+    """生成一个规模的图库，启动服务器并依次运行各场景"""
+    image_base, layout, generate_s = generate_library(root, files, args.folders)
+    workdir = tempfile.mkdtemp(prefix='server-', dir=root)
+    print(f"[{files} 张图片, {len(layout)} 个文件夹] 图库就绪（生成 {generate_s:.1f}s），启动服务器...",
+          file=sys.stderr)
+    process, port, startup_s = start_server(image_base, workdir, args)
+    try:
+        scenarios = {}
+        for name in args.scenarios:
+            scenarios[name] = result = run_scenario(name, port, layout, args)
+            print(f"  {name:<8} {result['rps']:>9.1f} req/s  p50 {result['p50_ms']}ms  "
+                  f"p95 {result['p95_ms']}ms  p99 {result['p99_ms']}ms  错误 {result['errors']}",
+                  file=sys.stderr)
+    finally:
+        stop_server(process)
+    return {
+        'files': files,
+        'folders': len(layout),
+        'generate_s': round(generate_s, 3),
+        'startup_s': round(startup_s, 3),
+        'scenarios': scenarios,
+    }
+
+
+def git_commit():
+    """当前提交（非 git 仓库时返回 None）"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline, tolerance):
+    """
+    与基线结果对比
+
+    Args:
+        result: 本次结果
+        baseline: 基线结果
+        tolerance: 允许的相对变化（如 0.1 表示 10%）
+
+    Returns:
+        退化项列表 [(图片数, 场景, 指标, 基线值, 本次值), ...]
+    """
+    base_runs = {run['files']: run for run in baseline.get('runs', [])}
+    regressions = []
+    print(f"{'图片数':>10} {'场景':<8} {'req/s 基线':>11} {'本次':>9} {'变化':>8} "
+          f"{'p99 基线':>10} {'本次':>9} {'变化':>8}", file=sys.stderr)
+    for run in result['runs']:
+        base_run = base_runs.get(run['files'])
+        if base_run is None:
+            continue
+        for name, current in run['scenarios'].items():
+            base = base_run['scenarios'].get(name)
+            if not base or not base['rps'] or not base['p99_ms'] or current['p99_ms'] is None:
+                continue
+            rps_change = current['rps'] / base['rps'] - 1
+            p99_change = current['p99_ms'] / base['p99_ms'] - 1
+            print(f"{run['files']:>10} {name:<8} {base['rps']:>11.1f} {current['rps']:>9.1f} {rps_change:>+8.1%} "
+                  f"{base['p99_ms']:>10.2f} {current['p99_ms']:>9.2f} {p99_change:>+8.1%}", file=sys.stderr)
+            if rps_change < -tolerance:
+                regressions.append((run['files'], name, 'rps', base['rps'], current['rps']))
+            if p99_change > tolerance:
+                regressions.append((run['files'], name, 'p99_ms', base['p99_ms'], current['p99_ms']))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='端到端压测')
+    parser.add_argument('--files', type=int, nargs='+', default=[100, 10000], help='图库规模（图像总数，可多个）')
+    parser.add_argument('--folders', type=int, default=0, help='文件夹数（0 表示取图像数的平方根）')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS), help='运行的场景')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发连接数')
+    parser.add_argument('--duration', type=float, default=10.0, help='每个场景的记录时长（秒）')
+    parser.add_argument('--warmup', type=float, default=1.0, help='每个场景开始记录前的预热时长（秒）')
+    parser.add_argument('--workers', type=int, default=1, help='服务器工作进程数（大于 1 时使用多进程模式）')
+    parser.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help='服务器日志级别')
+    parser.add_argument('--startup-timeout', type=float, default=600.0, help='等待服务器就绪的最长时间（秒）')
+    parser.add_argument('--data-dir', help='图库存放目录（保留以便下次复用，默认使用临时目录）')
+    parser.add_argument('--output', help='结果 JSON 文件（默认输出到标准输出）')
+    parser.add_argument('--baseline', help='基线结果 JSON 文件')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='对比基线时允许的相对变化')
+    # 服务器进程参数（由 start_server 传入）
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--image-base', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args)
+        return 0
+
+    result = {
+        'version': RESULT_VERSION,
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'workers': args.workers,
+        },
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory(prefix='ria-bench-') as tmp:
+        for files in args.files:
+            root = os.path.join(args.data_dir or tmp, f'files-{files}')
+            os.makedirs(root, exist_ok=True)
+            result['runs'].append(run_size(files, root, args))
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        for files, name, metric, base, current in regressions:
+            print(f"退化: {files} 张图片 {name} {metric} {base} -> {current}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,8 +5,11 @@ import os
 import logging
 import sys
 from app import create_app
+from app.utils.index_snapshot import warm_up_index
+from app.utils.logger import setup_logger
+from app.utils.prefork import PreforkServer
 from app.config.config import Config, DevelopmentConfig, ProductionConfig
-from gevent import pywsgi
+from app.utils.wsgi_server import WSGIServer
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
@@ -72,12 +75,29 @@ if __name__ == '__main__':
         logger.fatal("启动前检查失败，程序退出")
         exit(1)
     
+    # 多进程模式：主进程预热索引后派生工作进程，工作进程各自创建应用
+    if config.WORKERS > 1:
+        setup_logger(None, config)
+        if config.INDEX_WARMUP:
+            warm_up_index(config.IMAGE_BASE, config.IMAGE_EXTENSIONS,
+                          config.INDEX_WARMUP_WORKERS, config.INDEX_SNAPSHOT_PATH,
+                          config.INDEX_PACKED_PATH if config.INDEX_PACKED else None)
+        PreforkServer(create_app, config, config.WORKERS, port=config.PORT,
+                      graceful_timeout=config.GRACEFUL_TIMEOUT, reuse_port=config.REUSE_PORT).run()
+        sys.exit(0)
+    
     # 创建应用
     app = create_app(config)
     
+    # 预热文件夹索引（在开始接受请求之前完成）
+    if config.INDEX_WARMUP:
+        warm_up_index(config.IMAGE_BASE, config.IMAGE_EXTENSIONS,
+                      config.INDEX_WARMUP_WORKERS, config.INDEX_SNAPSHOT_PATH,
+                      config.INDEX_PACKED_PATH if config.INDEX_PACKED else None)
+    
     try:
         # 使用gevent WSGI服务器（高性能）
-        server = pywsgi.WSGIServer(('0.0.0.0', config.PORT), app, log=None)  # 禁用内置日志，使用我们的日志系统
+        server = WSGIServer(('0.0.0.0', config.PORT), app, log=None)  # 禁用内置日志，使用我们的日志系统
         logger.info(f"服务器启动于 0.0.0.0:{config.PORT} (环境: {env})")
         logger.info(f"日志级别: {log_level}")
         server.serve_forever()  # 启动服务器
@@ -89,5 +109,8 @@ if __name__ == '__main__':
         if hasattr(app, 'file_monitor'):
             logger.info("正在停止文件监控...")
             app.file_monitor.stop()  # 停止监控
+            app.file_monitor.handler.stop()  # 停止变化提交线程
             app.file_monitor.join()  # 等待监控线程结束
+        if getattr(app, 'render_pool', None):
+            app.render_pool.shutdown()  # 关闭图像处理进程池
         logger.info("服务器已成功停止")
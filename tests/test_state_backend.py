@@ -0,0 +1,164 @@
+"""
+Redis 状态后端测试 - 使用内存替身客户端，校验封禁规则与 BanStore 一致
+
+运行：python -m unittest discover tests
+"""
+import random
+import unittest
+
+from app.utils.ban_store import BanStore
+from app.utils.state_backend import RedisStateBackend
+
+
+class FakeRedis:
+    """只实现状态后端用到的命令的 Redis 替身（decode_responses=True 语义，过期时间按 clock 计算）"""
+
+    def __init__(self):
+        self.clock = 0.0
+        self._data = {}
+        self._expires = {}
+
+    def _get(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= self.clock:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def ping(self):
+        return True
+
+    def hgetall(self, key):
+        return dict(self._get(key) or {})
+
+    def hget(self, key, field):
+        return (self._get(key) or {}).get(field)
+
+    def hincrby(self, key, field, amount):
+        data = self._get(key)
+        if data is None:
+            data = self._data[key] = {}
+        data[field] = str(int(data.get(field, 0)) + amount)
+        return int(data[field])
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        data = self._get(key)
+        if data is None:
+            data = self._data[key] = {}
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = len(set(items) - set(data))
+        data.update({k: str(v) for k, v in items.items()})
+        return added
+
+    def incr(self, key):
+        value = int(self._get(key) or 0) + 1
+        self._data[key] = str(value)
+        return value
+
+    def delete(self, key):
+        self._expires.pop(key, None)
+        return int(self._data.pop(key, None) is not None)
+
+    def expire(self, key, seconds):
+        if self._get(key) is None:
+            return False
+        self._expires[key] = self.clock + seconds
+        return True
+
+    def expireat(self, key, when):
+        if self._get(key) is None:
+            return False
+        self._expires[key] = when
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """按顺序缓存命令，execute 时依次执行并返回结果列表"""
+
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+class RedisStateBackendTest(unittest.TestCase):
+
+    def make_backends(self, max_paths_per_ip=256):
+        client = FakeRedis()
+        backend = RedisStateBackend(client, 'memory://', max_paths_per_ip=max_paths_per_ip, local_ttl=0)
+        return client, backend, BanStore(max_paths_per_ip=max_paths_per_ip)
+
+    def assert_same_bans(self, backend, store, ips, paths, now):
+        for ip in ips:
+            for path in paths:
+                self.assertEqual(backend.is_banned(ip, path, now), store.is_banned(ip, path, now),
+                                 f"{ip} {path} @ {now}")
+
+    def test_progressive_ban_parity(self):
+        client, backend, store = self.make_backends()
+        rng = random.Random(520)
+        ips = ['10.0.0.1', '10.0.0.2', '2001:db8::1']
+        paths = ['/', '/pc', '/pc/a.jpg', '/pc/b.jpg', '/mobile', '/mobile/x/y.png', '/random']
+        now = 1_700_000_000.0
+        for _ in range(300):
+            now += rng.choice([1, 30, 600, 2000, 7200])
+            ip = rng.choice(ips)
+            path = rng.choice(paths)
+            is_directory = rng.random() < 0.3
+            duration = rng.choice([60, 300, 3600])
+            client.clock = now
+            self.assertEqual(backend.add_ban(ip, path, is_directory, duration, now),
+                             store.add_ban(ip, path, is_directory, duration, now))
+            for offset in (0, 59, 61, 3601, 86400):
+                self.assert_same_bans(backend, store, ips, paths, now + offset)
+        self.assertEqual(backend.errors, 0)
+
+    def test_path_limit_ignores_bookkeeping_fields(self):
+        client, backend, store = self.make_backends(max_paths_per_ip=3)
+        now = 1_700_000_000.0
+        paths = ['/a', '/b', '/c', '/d']
+        # 违规间隔超过重复窗口且次数较少，不会因严重违规触发全局封禁
+        for i, path in enumerate(['/a', '/a', '/b', '/c']):
+            t = now + i * 3600
+            client.clock = t
+            self.assertEqual(backend.add_ban('1.2.3.4', path, i == 1, 86400 * 10, t),
+                             store.add_ban('1.2.3.4', path, i == 1, 86400 * 10, t))
+            self.assert_same_bans(backend, store, ['1.2.3.4'], paths, t)
+        # 已记录 3 条路径（/a 的文件和目录封禁算一条），此时 /d 仍未被封禁
+        self.assertFalse(backend.is_banned('1.2.3.4', '/d', now + 4 * 3600)[0])
+
+    def test_expired_record_starts_over(self):
+        client, backend, store = self.make_backends(max_paths_per_ip=1)
+        now = 1_700_000_000.0
+        # 第二次封禁时旧记录已过期但键尚未删除，第三次时键已由 Redis 删除
+        for t, path in ((now, '/a'), (now + 60.5, '/b'), (now + 100000, '/c')):
+            client.clock = t
+            self.assertEqual(backend.add_ban('5.6.7.8', path, False, 60, t),
+                             store.add_ban('5.6.7.8', path, False, 60, t))
+            self.assert_same_bans(backend, store, ['5.6.7.8'], ['/a', '/b', '/c', '/d'], t)
+
+    def test_incr(self):
+        client, backend, _ = self.make_backends()
+        self.assertEqual([backend.incr('k', 60) for _ in range(3)], [1, 2, 3])
+        client.clock = 61
+        self.assertEqual(backend.incr('k', 60), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()